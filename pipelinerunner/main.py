@@ -3,6 +3,8 @@ import click
 from pipelinerunner.template.interface.cli.template_commands import template
 from pipelinerunner.runner.interface.cli.runner_commands import runner
 from pipelinerunner.runner.interface.cli.runner_run import run
+from pipelinerunner.runner.interface.cli.runner_queue import enqueue, worker
+from pipelinerunner.runner.interface.cli.runner_daemon import serve, status, cancel
 from pipelinerunner.shared.util.version import get_version, PACKAGE_NAME
 
 
@@ -16,5 +18,10 @@ def main():
 main.add_command(runner)
 main.add_command(template)
 main.add_command(run)  # alias for "pipeline runner run"
+main.add_command(enqueue)
+main.add_command(worker)
+main.add_command(serve)
+main.add_command(status)
+main.add_command(cancel)
 if __name__ == '__main__':
     main()
@@ -1,6 +1,7 @@
 from dataclasses import dataclass
+from typing import Optional, Tuple
 
-from pipelinerunner.pipeline.domain.enums import AzurePipelineRunState, AzurePipelineRunResult
+from pipelinerunner.pipeline.domain.enums import AzurePipelineRunState, AzurePipelineRunResult, RunOrder, ShardBy
 
 
 @dataclass
@@ -37,6 +38,24 @@ class AzurePipelineApproval:
     id: str
     run_id: str
     status: str
+    definition_id: Optional[str] = None
+
+
+@dataclass(frozen = True)
+class AgentPool:
+    id: str
+    name: str
+    is_hosted: bool = False  # Microsoft-hosted, its agents cannot be listed
+
+
+@dataclass(frozen = True)
+class AgentPoolCapacity:
+    free_agents: int  # online, enabled and idle
+    queued_jobs: int  # waiting for an agent
+
+    def room(self) -> int:
+        ''' Runs that can start right away without queueing behind the others '''
+        return self.free_agents - self.queued_jobs
 
 
 @dataclass(frozen = True)
@@ -44,3 +63,19 @@ class ExecutionOptions:
     wait: bool = True
     auto_approve: bool = True
     dry_run: bool = False
+    http_pool_size: int = 20
+    hedge_requests: bool = False
+    max_concurrent_triggers: int = 10
+    trigger_concurrency: int = 8
+    max_runs_per_definition: Optional[int] = 8  # window mode caps, None means unbounded
+    max_runs_per_project: Optional[int] = None
+    max_runs: Optional[int] = None
+    wave_sizes: Tuple[int, ...] = (1, 5)  # waves mode, the remaining runs go in a last wave
+    wave_success_ratio: float = 1.0  # of a wave, to start the next one
+    run_order: RunOrder = RunOrder.FILE  # of the pending runs, when they are throttled
+    fail_fast: bool = False  # cancel the runs in flight on the first failure
+    shard: Optional[Tuple[int, int]] = None  # (index, total), only this part of the batch is run
+    shard_by: ShardBy = ShardBy.COUNT
+    respect_agent_pools: bool = False  # hold back the triggers while the agent pool of the pipeline has no free agent
+    incremental: bool = False  # skip the runs unchanged since a successful run, trigger identical runs once
+    incremental_ttl: int = 24  # hours a successful run is trusted for
@@ -0,0 +1,148 @@
+import threading
+import time
+
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from pipelinerunner.pipeline.application.model import AgentPool, AgentPoolCapacity
+from pipelinerunner.pipeline.domain.run import PipelineExecution
+from pipelinerunner.pipeline.domain.cancellation import RunCanceller
+from pipelinerunner.pipeline.domain.poll_scheduler import PollingPolicy
+from pipelinerunner.pipeline.domain.exceptions import (
+    PipelineExecutionCancelled,
+    AzurePipelineAPIError,
+    AzurePipelineAPITransientError
+)
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+@dataclass
+class _PoolState:
+    pool: AgentPool
+    capacity: Optional[AgentPoolCapacity] = None  # None when it could not be read, the pool is not gated meanwhile
+    fetched_at: float = float('-inf')
+    taken: int = 0  # runs let through since the last refresh, Azure does not show them yet
+    waiting: int = 0
+    lock: threading.Lock = field(default_factory = threading.Lock)
+
+    def room(self) -> int:
+        return self.capacity.room() - self.taken if self.capacity else 1
+
+
+class AgentPoolGate:
+    '''
+    Holds back the triggers while the agent pool of the pipeline has no free agent, instead of piling up
+    queued runs on Azure (where they count against the pipeline timeout and can be starved by other teams).
+    The pool of every pipeline is looked up once and its capacity is cached for a few seconds, refreshed by one
+    thread at a time. Microsoft-hosted pools and pools that cannot be read are not gated.
+    '''
+    CAPACITY_TTL = 10  # seconds
+    WAITING = PollingPolicy(initial_interval = 5, min_interval = 2, max_interval = 15)
+
+    def __init__(self):
+        self._pools: Dict[Tuple[str, str], Optional[_PoolState]] = dict()  # (project, definition_id) -> pool
+        self._states: Dict[str, _PoolState] = dict()  # pool id -> state, shared by the pipelines of the same pool
+        self._lookups: Dict[Tuple[str, str], threading.Lock] = dict()
+        self._lock = threading.Lock()
+
+    def wait_for_room(self, execution: PipelineExecution, canceller: Optional[RunCanceller] = None, timeout: Optional[float] = None) -> bool:
+        '''
+        Blocks until the pool of the execution has a free agent, and takes it.
+        False when it timed out, raises PipelineExecutionCancelled when the batch is cancelled meanwhile.
+        '''
+        if execution.resumed or execution.run_info:
+            return True
+        state = self._state_of(execution)
+        if state is None:
+            return True
+        waited_since = time.monotonic()
+        interval = None
+        while True:
+            if self._take(state, execution, max_age = interval or self.CAPACITY_TTL):
+                if interval is not None:
+                    self._stop_waiting(state, waited_since)
+                return True
+            if interval is None:
+                self._start_waiting(state, execution)
+            interval = self.WAITING.with_jitter(self.WAITING.next_interval(interval, changed = False))
+            if timeout is not None:
+                remaining = waited_since + timeout - time.monotonic()
+                if remaining <= 0:
+                    self._stop_waiting(state, waited_since, gave_up = True)
+                    return False
+                interval = min(interval, remaining)
+            cancelled = canceller.requested.wait(interval) if canceller else time.sleep(interval)
+            if cancelled:
+                self._stop_waiting(state, waited_since, gave_up = True)
+                raise PipelineExecutionCancelled(f'The batch is being cancelled, pipeline {execution.runner_name} is not triggered')
+
+    def _state_of(self, execution: PipelineExecution) -> Optional[_PoolState]:
+        key = (execution.project_name, str(execution.definition_id))
+        with self._lock:
+            lookup_lock = self._lookups.setdefault(key, threading.Lock())
+        with lookup_lock:  # the runs of the same pipeline triggered together look its pool up once
+            if key in self._pools:
+                return self._pools[key]
+            try:
+                pool = execution.api.get_agent_pool()
+            except AzurePipelineAPITransientError as exc:  # not cached, so the next run of the pipeline tries again
+                logger.warning(f'Unable to find the agent pool of pipeline {execution.runner_name}, this run is triggered without waiting for an agent: {exc}')
+                return None
+            except AzurePipelineAPIError as exc:  # e.g. the token cannot read the definitions
+                logger.warning(f'Unable to find the agent pool of pipeline {execution.runner_name}, its runs are not held back: {exc}')
+                self._pools[key] = None
+                return None
+            if pool is None:
+                logger.info(f'The agent pool of pipeline {execution.runner_name} is unknown (chosen in the YAML?), its runs are not held back')
+                state = None
+            elif pool.is_hosted:
+                logger.info(f'Pipeline {execution.runner_name} runs on the Microsoft-hosted pool "{pool.name}", its runs are not held back')
+                state = None
+            else:
+                with self._lock:
+                    state = self._states.setdefault(pool.id, _PoolState(pool))
+            self._pools[key] = state
+            return state
+
+    def _take(self, state: _PoolState, execution: PipelineExecution, max_age: float) -> bool:
+        with state.lock:  # the refresh is done by one thread, the others wait for it and use its result
+            if time.monotonic() - state.fetched_at >= max_age:
+                self._refresh(state, execution)
+            if state.room() <= 0:
+                return False
+            state.taken += 1
+            return True
+
+    @staticmethod
+    def _refresh(state: _PoolState, execution: PipelineExecution) -> None:
+        try:
+            state.capacity = execution.api.get_agent_pool_capacity(state.pool.id)
+        except AzurePipelineAPIError as exc:
+            logger.warning(f'Unable to read the agents of pool "{state.pool.name}", runs are not held back meanwhile: {exc}')
+            state.capacity = None
+        state.fetched_at = time.monotonic()
+        state.taken = 0
+        if state.capacity:
+            logger.debug(f'Pool "{state.pool.name}": {state.capacity.free_agents} free agent(s), {state.capacity.queued_jobs} queued job(s)')
+
+    def _start_waiting(self, state: _PoolState, execution: PipelineExecution) -> None:
+        with state.lock:
+            state.waiting += 1
+            first = state.waiting == 1
+            capacity, taken = state.capacity, state.taken
+        if first and capacity:
+            logger.info(
+                f'No free agent on pool "{state.pool.name}" ({capacity.free_agents} free, {capacity.queued_jobs} queued, '
+                f'{taken} just triggered), holding back the runs of pipeline {execution.runner_name}'
+            )
+
+    @staticmethod
+    def _stop_waiting(state: _PoolState, waited_since: float, gave_up: bool = False) -> None:
+        with state.lock:
+            state.waiting -= 1
+            last = state.waiting == 0
+        if last and not gave_up:
+            logger.info(f'Pool "{state.pool.name}" has free agents again, triggering (held back for {time.monotonic() - waited_since:.0f}s)')
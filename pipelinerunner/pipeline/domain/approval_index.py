@@ -0,0 +1,123 @@
+import threading
+import time
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pipelinerunner.pipeline.application.model import AzurePipelineApproval
+from pipelinerunner.pipeline.infrastructure.pipeline_api import BasePipelineAPI
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+ApprovalKey = Tuple[str, str]  # (definition_id, run_id)
+ApprovalListener = Callable[[AzurePipelineApproval], None]
+
+
+class ApprovalIndex:
+    '''
+    Project-wide view of the approvals.
+    It is refreshed with a single query per interval, whatever the number of runs asking for it,
+    and it maps (definition_id, run_id) to its approval.
+    '''
+    REFRESH_INTERVAL = 5
+
+    def __init__(self, api: BasePipelineAPI, refresh_interval: float = REFRESH_INTERVAL):
+        self.api = api
+        self.refresh_interval = refresh_interval
+        self._approvals: Dict[ApprovalKey, AzurePipelineApproval] = dict()
+        self._listeners: Dict[ApprovalKey, List[ApprovalListener]] = dict()
+        self._refreshed_at: Optional[float] = None
+        self._refresh_lock = threading.Lock()
+        self._listeners_lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+
+    def get(self, definition_id: str, run_id: str) -> Optional[AzurePipelineApproval]:
+        self.refresh()
+        return self._approvals.get((str(definition_id), str(run_id)))
+
+    def refresh(self, force: bool = False) -> None:
+        with self._refresh_lock:  # concurrent callers wait for the same query instead of sending their own
+            if not force and not self._is_stale():
+                return
+            approvals = self.api.list_approvals()
+            self._refreshed_at = time.monotonic()
+            previous = self._approvals
+            self._approvals = {
+                (str(approval.definition_id), str(approval.run_id)): approval
+                for approval in approvals
+            }
+        logger.debug(f'Approval index of project "{self.api.runner.project_name}" refreshed ({len(approvals)} approvals)')
+        self._notify_changes(previous)
+
+    def _is_stale(self) -> bool:
+        if self._refreshed_at is None:
+            return True
+        return (time.monotonic() - self._refreshed_at) >= self.refresh_interval
+
+    def subscribe(self, definition_id: str, run_id: str, listener: ApprovalListener) -> Callable[[], None]:
+        ''' The listener is called every time the approval of the run appears or changes. It returns the unsubscribe function. '''
+        key = (str(definition_id), str(run_id))
+        with self._listeners_lock:
+            self._listeners.setdefault(key, list()).append(listener)
+            self._ensure_watcher()
+
+        def unsubscribe() -> None:
+            with self._listeners_lock:
+                listeners = self._listeners.get(key, [])
+                if listener in listeners:
+                    listeners.remove(listener)
+                if not listeners:
+                    self._listeners.pop(key, None)
+
+        return unsubscribe
+
+    def _notify_changes(self, previous: Dict[ApprovalKey, AzurePipelineApproval]) -> None:
+        with self._listeners_lock:
+            listeners = { key: list(values) for key, values in self._listeners.items() }
+        for key, callbacks in listeners.items():
+            approval = self._approvals.get(key)
+            if approval is None or approval == previous.get(key):
+                continue
+            for callback in callbacks:
+                try:
+                    callback(approval)
+                except Exception as exc:
+                    logger.error(f'Error notifying approval change of run {key[1]}: {exc}')
+
+    def _ensure_watcher(self) -> None:
+        ''' Keeps the index fresh in background while there is someone subscribed '''
+        if self._watcher and self._watcher.is_alive():
+            return
+        self._watcher = threading.Thread(target = self._watch, daemon = True)
+        self._watcher.start()
+
+    def _watch(self) -> None:
+        while True:
+            with self._listeners_lock:
+                if not self._listeners:
+                    self._watcher = None
+                    return
+            try:
+                self.refresh()
+            except Exception as exc:
+                logger.debug(f'Failed to refresh approval index: {exc}')
+            time.sleep(self.refresh_interval)
+
+
+class ApprovalIndexRegistry:
+    ''' One approval index per project, shared by all executions of a batch '''
+    def __init__(self, refresh_interval: float = ApprovalIndex.REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._indexes: Dict[str, ApprovalIndex] = dict()
+        self._lock = threading.Lock()
+
+    def get(self, api: BasePipelineAPI) -> ApprovalIndex:
+        project_name = api.runner.project_name
+        with self._lock:
+            index = self._indexes.get(project_name)
+            if index is None:
+                index = ApprovalIndex(api, refresh_interval = self.refresh_interval)
+                self._indexes[project_name] = index
+            return index
@@ -0,0 +1,211 @@
+import asyncio
+import time
+
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from pipelinerunner.runner.application.model import RunnerModel
+from pipelinerunner.pipeline.application.model import (
+    AzurePipelineRunInfo,
+    AzurePipelineRunStatus,
+    AzurePipelineApproval
+)
+from pipelinerunner.pipeline.infrastructure.async_pipeline_api import BaseAsyncPipelineAPI
+from pipelinerunner.pipeline.infrastructure.duration_history import DurationHistory
+from pipelinerunner.pipeline.domain.approval_index import ApprovalIndex
+from pipelinerunner.pipeline.domain.run import PipelineExecution
+from pipelinerunner.pipeline.domain.enums import AzurePipelineRunState, AzurePipelineRunResult
+from pipelinerunner.pipeline.domain.exceptions import (
+    PipelineExecutionAlreadyRunning,
+    PipelineExecutionNotStarted,
+    AzurePipelineAPIError,
+    AzurePipelineAPITransientError,
+    AzurePipelineAPIUnavailableError
+)
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+class AsyncPipelineExecution:
+    ''' Coroutine-based twin of PipelineExecution. Every API call is bounded by the shared limiter. '''
+    APPROVAL_POLLING = PipelineExecution.APPROVAL_POLLING
+    TRIGGER_BACKOFF = PipelineExecution.TRIGGER_BACKOFF
+    MAX_TRIGGER_ATTEMPTS = PipelineExecution.MAX_TRIGGER_ATTEMPTS
+    CLOCK_SKEW_MARGIN = PipelineExecution.CLOCK_SKEW_MARGIN
+
+    def __init__(self,
+                 runner: RunnerModel,
+                 params: Dict,
+                 pipeline_api: BaseAsyncPipelineAPI,
+                 limiter: asyncio.Semaphore,
+                 approval_index: Optional[ApprovalIndex] = None,
+                 key: Optional[str] = None,
+                 priority: int = 0):
+        self.params = params
+        self.key = key  # "<runner>/<position>", identifies the run in the journal of the batch
+        self.runner_name = runner.pipeline_name
+        self.project_name = runner.project_name
+        self.definition_id = runner.definition_id
+        self.priority = priority  # higher ones are started first
+        self.api = pipeline_api
+        self.limiter = limiter
+        self.approval_index = approval_index
+        self.resumed = False  # re-attached to a run triggered by a previous (interrupted) invocation
+        self.run_info: AzurePipelineRunInfo = None
+        self.status: Optional[AzurePipelineRunStatus] = None  # last known status
+        self.started_at: Optional[float] = None
+        self.expected_duration: Optional[float] = None  # in seconds, when known
+
+    async def start(self) -> None:
+        if self.resumed:
+            return
+        if self.run_info:
+            raise PipelineExecutionAlreadyRunning(
+                f'Run {self.run_info.id} is already running!'
+            )
+        self.run_info = await self._trigger()
+        PipelineExecution.claim_run_id(self.run_info.id)
+        self.started_at = time.monotonic()
+        logger.info(f'Run {self.run_info.id} started successfully')
+
+    def attach(self, run_id: str) -> None:
+        ''' Same as PipelineExecution.attach '''
+        self.run_info = AzurePipelineRunInfo(
+            id = str(run_id),
+            status = AzurePipelineRunStatus(state = AzurePipelineRunState.IN_PROGRESS, result = AzurePipelineRunResult.UNKNOWN)
+        )
+        PipelineExecution.claim_run_id(self.run_info.id)
+        self.started_at = time.monotonic()
+        self.resumed = True
+
+    async def _trigger(self) -> AzurePipelineRunInfo:
+        ''' Same retry and duplicate detection as PipelineExecution._trigger '''
+        since = datetime.now(timezone.utc) - self.CLOCK_SKEW_MARGIN
+        maybe_triggered = False
+        interval: Optional[float] = None
+        attempt = 0
+        on_hold = False
+        while True:
+            try:
+                async with self.limiter:
+                    if maybe_triggered:
+                        run_info = await self.api.find_triggered_run(self.params, since = since, exclude = PipelineExecution.claimed_run_ids())
+                        if run_info:
+                            logger.info(f'Run {run_info.id} was created by a previous attempt, no need to trigger it again')
+                            return run_info
+                        maybe_triggered = False
+                    return await self.api.trigger_pipeline(self.params)
+            except AzurePipelineAPIUnavailableError:
+                if not on_hold:
+                    logger.warning(f'Azure DevOps is unavailable, the trigger of pipeline {self.runner_name} is on hold')
+                on_hold = True
+                await self.api.wait_until_available()
+                continue
+            except AzurePipelineAPITransientError as exc:
+                maybe_triggered = maybe_triggered or exc.ambiguous
+                error = exc
+            except AzurePipelineAPIError as exc:
+                if not maybe_triggered:
+                    raise
+                error = exc
+
+            attempt += 1
+            if attempt == self.MAX_TRIGGER_ATTEMPTS:
+                raise error
+            interval = self.TRIGGER_BACKOFF.next_interval(interval, changed = False)
+            logger.warning(f'Attempt {attempt}/{self.MAX_TRIGGER_ATTEMPTS} to trigger pipeline {self.runner_name} failed, retrying in {interval:.0f}s: {error}')
+            await asyncio.sleep(self.TRIGGER_BACKOFF.with_jitter(interval))
+
+    async def get_current_status(self) -> AzurePipelineRunStatus:
+        if not self.run_info:
+            raise PipelineExecutionNotStarted('You must start the pipeline run before check its status')
+        async with self.limiter:
+            self.status = await self.api.get_run_status(run_id = self.run_info.id)
+        return self.status
+
+    def update_status(self, status: AzurePipelineRunStatus) -> None:
+        ''' Feeds a status resolved somewhere else (e.g. by a batched poll) '''
+        self.status = status
+
+    def is_finished(self) -> bool:
+        ''' It only looks at the last known status, no request is made '''
+        if self.status is None or not self.status.is_completed():
+            return False
+        if self.status.is_successful():
+            logger.success(f'Run {self.run_info.id} on pipeline {self.runner_name} finished successfully.')
+            return True
+        logger.error(f'Run {self.run_info.id} on pipeline {self.runner_name} finished with result = {self.status.result.name}.')
+        return True
+
+    async def it_needs_approval(self, timeout: int = 30) -> bool:
+        if not self.run_info:
+            raise PipelineExecutionNotStarted('You must start the pipeline run before checking for approvals!')
+
+        start_time = time.monotonic()
+        interval: Optional[float] = None
+
+        # The timeout and retry logic is needed here due to delay on Azure API
+        while (time.monotonic() - start_time) < timeout:
+            status = await self.get_current_status()
+            if status.state == AzurePipelineRunState.IN_PROGRESS:
+                logger.debug(f'Checking for approval in run {self.run_info.id}...')
+                approval: Optional[AzurePipelineApproval] = await self._get_approval()
+
+                if approval and approval.status == 'pending':
+                    logger.info(f'Run {self.run_info.id} needs approval')
+                    return True
+
+                if time.monotonic() - start_time > 10:
+                    logger.debug(f'Run {self.run_info.id} does not need approval')
+                    return False
+
+            if status.state == AzurePipelineRunState.COMPLETED:
+                logger.debug(f'Run {self.run_info.id} already completed, no approval needed')
+                return False
+
+            interval = self.APPROVAL_POLLING.next_interval(interval, changed = False)
+            await asyncio.sleep(interval)
+
+        logger.warning(f'Timeout checking approval for run {self.run_info.id}, assuming no approval needed')
+        return False
+
+    async def pending_approval(self) -> Optional[AzurePipelineApproval]:
+        if not self.run_info:
+            raise PipelineExecutionNotStarted('You must start the pipeline run before approve it!')
+
+        approval: Optional[AzurePipelineApproval] = await self._get_approval()
+        if not approval:
+            logger.debug(f'There is no need to approve the run {self.run_info.id}')
+            return None
+
+        if approval.status != 'pending':
+            logger.debug(f'Approval for run {self.run_info.id} is not pending (status: {approval.status})')
+            return None
+        return approval
+
+    def record_approval(self, approved: bool) -> bool:
+        if approved:
+            logger.success(f'Run {self.run_info.id} was successfully approved!')
+        else:
+            logger.error(f'Run {self.run_info.id} was NOT approved')
+        return approved
+
+    def expected_end(self) -> Optional[float]:
+        ''' A time.monotonic() timestamp, when the expected duration is known '''
+        if self.started_at is None or self.expected_duration is None:
+            return None
+        return self.started_at + self.expected_duration
+
+    def record_duration(self, history: DurationHistory) -> None:
+        ''' Only successful runs teach something about how long the next ones will take '''
+        if self.resumed or self.started_at is None or self.status is None or not self.status.is_successful():
+            return
+        history.record(self.project_name, self.definition_id, self.params, time.monotonic() - self.started_at)
+
+    async def _get_approval(self) -> Optional[AzurePipelineApproval]:
+        if self.approval_index:  # one shared query per interval for the whole project
+            return await asyncio.to_thread(self.approval_index.get, self.definition_id, self.run_info.id)
+        async with self.limiter:
+            return await self.api.get_approval_status(run_id = self.run_info.id)
@@ -0,0 +1,201 @@
+import asyncio
+
+from typing import Dict, List, Optional
+
+from pipelinerunner.runner.application.model import RunnerModel
+from pipelinerunner.pipeline.application.model import ExecutionOptions, AzurePipelineApproval
+from pipelinerunner.pipeline.domain.async_run import AsyncPipelineExecution
+from pipelinerunner.pipeline.domain.batch_context import BatchContext
+from pipelinerunner.pipeline.domain.run_strategy import BasePipelineExecutionStrategy, ExecutionMonitor
+from pipelinerunner.pipeline.domain.poll_scheduler import PollScheduler
+from pipelinerunner.pipeline.domain.exceptions import (
+    AzurePipelineAPIError,
+    AzurePipelineAPIUnavailableError,
+    PipelineExecutionCancelled
+)
+from pipelinerunner.pipeline.infrastructure.async_pipeline_api import BaseAsyncPipelineAPI
+from pipelinerunner.pipeline.infrastructure.factory_pipeline_api import AsyncPipelineAPIFactory
+from pipelinerunner.pipeline.domain.run_ordering import RunOrderer
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+class AsyncPipelineExecutionStrategy(BasePipelineExecutionStrategy):
+    ''' Drives trigger, approval and monitoring of every run from a single event loop '''
+    TRIGGER_SLOT_POLLING = 0.05  # seconds
+    def __init__(self, runner: RunnerModel, options: ExecutionOptions, context: Optional[BatchContext] = None):
+        super().__init__(runner, options, context)
+        self._async_pipeline_api: Optional[BaseAsyncPipelineAPI] = None
+
+    def run(self):
+        asyncio.run(self.run_async())
+
+    async def run_async(self, limiter: Optional[asyncio.Semaphore] = None):
+        ''' The limiter bounds the API calls in flight and can be shared by several runners in the same loop '''
+        limiter = limiter or asyncio.Semaphore(self.options.http_pool_size)
+        logger.info(
+            f'Starting asynchronously {len(self.runner.runs)} runs on pipeline '
+            f'"{self.runner.project_name}/{self.runner.pipeline_name}" '
+            f'using branch "{self.runner.branch_name}" (definition_id = {self.runner.definition_id})'
+        )
+        executions = [
+            self._create_async_pipeline_execution(params = run.parameters, limiter = limiter, priority = run.priority, position = idx)
+            for idx, run in enumerate(self.runner.runs, 1)
+        ]
+        executions = RunOrderer(self.options.run_order).sort(executions, execution_of = lambda e: e)
+        executions = await self._start_all(executions)
+
+        if not self.options.wait:
+            logger.success('All pipelines have been started (no waiting)! Check manually their status.')
+            return
+
+        await self._handle_approvals(executions, limiter)
+        logger.info(f'Waiting {len(executions)} run(s) on pipeline {self.runner.pipeline_name} to complete')
+        await self._monitor(executions, limiter)
+
+        logger.info(
+            f'All runs on pipeline "{self.runner.pipeline_name}" '
+            f'(definition_id = {self.runner.definition_id}) completed!'
+        )
+
+    async def _start_all(self, executions: List[AsyncPipelineExecution]) -> List[AsyncPipelineExecution]:
+        results = await asyncio.gather(*(self._start(e) for e in executions), return_exceptions = True)
+        started = list()
+        cancelled = 0
+        for execution, result in zip(executions, results):
+            if isinstance(result, PipelineExecutionCancelled):
+                cancelled += 1
+                continue
+            if isinstance(result, BaseException):
+                logger.error(f'Failed to start run with parameters {execution.params}: {result}')
+                continue
+            started.append(execution)
+        if cancelled:
+            logger.warning(f'The batch was cancelled, {cancelled} run(s) on pipeline {self.runner.pipeline_name} not started')
+        return started
+
+    async def _start(self, execution: AsyncPipelineExecution) -> None:
+        '''
+        Triggers within the cap of concurrent triggers of the batch, then journals and tracks the run as soon as it exists,
+        so it is not triggered again on resume if the CLI dies meanwhile, and Ctrl+C cancels it
+        '''
+        if not execution.resumed:
+            if self.context.canceller.is_cancelling():
+                raise PipelineExecutionCancelled(f'The batch is being cancelled, pipeline {execution.runner_name} is not triggered')
+            await self._acquire_trigger_slot(execution)
+            try:
+                await execution.start()
+            finally:
+                self.context.triggering.release()
+            if execution.key:
+                self.context.journal.triggered(execution.key, execution.run_info.id)
+        # the canceller works with the blocking API, as it also runs from the signal handling, outside of the event loop
+        self.context.canceller.track(execution.run_info.id, execution.runner_name, self._get_or_create_api())
+
+    async def _acquire_trigger_slot(self, execution: AsyncPipelineExecution) -> None:
+        ''' The cap is shared with the threads of the other batches (e.g. in the daemon), so it is polled instead of blocking the loop '''
+        while not self.context.triggering.acquire(blocking = False):
+            await asyncio.sleep(self.TRIGGER_SLOT_POLLING)
+            if self.context.canceller.is_cancelling():
+                raise PipelineExecutionCancelled(f'The batch is being cancelled, pipeline {execution.runner_name} is not triggered')
+
+    async def _handle_approvals(self, executions: List[AsyncPipelineExecution], limiter: asyncio.Semaphore) -> None:
+        ''' Checks every run concurrently and then approves the pending ones with a single bulk request '''
+        checks = await asyncio.gather(*(self._pending_approval(e) for e in executions))
+        pending = [ (execution, approval) for execution, approval in zip(executions, checks) if approval ]
+        if not pending:
+            return
+        if not self.options.auto_approve:
+            logger.warning(f'{len(pending)} run(s) waiting manual approval')
+            return
+        try:
+            async with limiter:
+                results = await self._get_or_create_async_api().approve_many([ approval for _, approval in pending ])
+        except AzurePipelineAPIError as exc:
+            logger.error(str(exc))
+            results = dict()
+        for execution, approval in pending:
+            if execution.record_approval(approved = results.get(approval.id, False)):
+                self.context.journal.approved_run(execution.key, execution.run_info.id)
+
+    async def _pending_approval(self, execution: AsyncPipelineExecution) -> Optional[AzurePipelineApproval]:
+        try:
+            if not await execution.it_needs_approval():
+                return None
+            return await execution.pending_approval()
+        except Exception as exc:
+            logger.error(f'Error checking approval for run {execution.run_info.id}: {exc}')
+            return None
+
+    async def _monitor(self, executions: List[AsyncPipelineExecution], limiter: asyncio.Semaphore) -> None:
+        ''' Every tick resolves the status of the due runs with one batched query '''
+        api = self._get_or_create_api()
+        scheduler: PollScheduler[AsyncPipelineExecution] = PollScheduler(ExecutionMonitor.POLLING)
+        for execution in executions:
+            scheduler.add(execution, expected_end = execution.expected_end())
+
+        while len(scheduler):
+            await asyncio.sleep(scheduler.next_due_in() or 0)
+            due = scheduler.pop_due()
+            if not due:
+                continue
+            previous = { e: e.status for e in due }
+            try:
+                async with limiter:
+                    await asyncio.to_thread(self.context.status_poller.poll_with, api, due)
+            except AzurePipelineAPIUnavailableError:
+                logger.debug(f'Azure DevOps is unavailable, polling of {len(due)} run(s) suspended')
+                for e in due:
+                    scheduler.reschedule(e, changed = False)
+                continue
+            except Exception as exc:
+                logger.error(f'Error polling runs on pipeline {self.runner.pipeline_name}: {exc}')
+                for e in due:
+                    scheduler.reschedule(e, changed = False)
+                continue
+            for e in due:
+                if e.is_finished():
+                    scheduler.remove(e)
+                    e.record_duration(self.context.duration_history)
+                    self.context.journal.completed_run(e.key, e.run_info.id, e.status.result.value)
+                    if e.status.is_successful():
+                        self.context.canceller.untrack(e.run_info.id)
+                    else:
+                        await asyncio.to_thread(self.context.canceller.run_failed, e.run_info.id, e.runner_name)
+                    continue
+                scheduler.reschedule(e, changed = e.status != previous[e])
+
+    def _create_async_pipeline_execution(self,
+                                         params: Dict,
+                                         limiter: asyncio.Semaphore,
+                                         priority: int = 0,
+                                         position: Optional[int] = None) -> AsyncPipelineExecution:
+        key = f'{self.runner.name}/{position}' if position is not None else None
+        execution = AsyncPipelineExecution(
+            runner = self.runner,
+            params = params,
+            pipeline_api = self._get_or_create_async_api(),
+            limiter = limiter,
+            approval_index = self.context.approval_indexes.get(self._get_or_create_api()),
+            key = key,
+            priority = priority
+        )
+        run_id = self.context.journal.run_id_of(key) if key else None
+        if run_id:  # resuming a batch, this run was already triggered
+            execution.attach(run_id)
+            logger.info(f'Run {key} re-attached to run {run_id} of pipeline {self.runner.pipeline_name}')
+        execution.expected_duration = self.context.duration_history.expected(
+            self.runner.project_name, self.runner.definition_id, params
+        )
+        return execution
+
+    def _get_or_create_async_api(self) -> BaseAsyncPipelineAPI:
+        if self._async_pipeline_api is None:
+            self._async_pipeline_api = AsyncPipelineAPIFactory.create(
+                runner = self.runner,
+                dry_run = self.options.dry_run,
+                session_pool = self.context.session_pool
+            )
+        return self._async_pipeline_api
@@ -0,0 +1,95 @@
+import threading
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+from pipelinerunner.pipeline.application.model import ExecutionOptions
+from pipelinerunner.pipeline.domain.approval_index import ApprovalIndexRegistry
+from pipelinerunner.pipeline.domain.status_poller import RunStatusPoller
+from pipelinerunner.pipeline.domain.cancellation import RunCanceller
+from pipelinerunner.pipeline.domain.agent_pool_gate import AgentPoolGate
+from pipelinerunner.pipeline.domain.run import PipelineExecution
+from pipelinerunner.pipeline.infrastructure.session_pool import AzureSessionPool
+from pipelinerunner.pipeline.infrastructure.duration_history import DurationHistory, DurationHistoryFactory
+from pipelinerunner.pipeline.infrastructure.batch_journal import BatchJournal, BatchJournalFactory
+from pipelinerunner.pipeline.infrastructure.run_result_cache import RunResultCache, RunResultCacheFactory
+
+
+@dataclass
+class BatchContext:
+    ''' Resources shared by every execution strategy of the same batch '''
+    session_pool: AzureSessionPool = field(default_factory = AzureSessionPool)
+    approval_indexes: ApprovalIndexRegistry = field(default_factory = ApprovalIndexRegistry)
+    status_poller: RunStatusPoller = field(default_factory = RunStatusPoller)
+    triggering: threading.BoundedSemaphore = field(default_factory = lambda: threading.BoundedSemaphore(ExecutionOptions.max_concurrent_triggers))
+    duration_history: DurationHistory = field(default_factory = DurationHistory)
+    canceller: RunCanceller = field(default_factory = RunCanceller)
+    journal: BatchJournal = field(default_factory = lambda: BatchJournalFactory.create(in_memory = True))
+    agent_pools: Optional[AgentPoolGate] = None  # only when the triggers wait for a free agent
+    run_results: Optional[RunResultCache] = None  # only in incremental mode
+    shared: bool = False  # the connections, pollers and history belong to a warm context that outlives the batch
+
+    @classmethod
+    def create(cls,
+               options: ExecutionOptions,
+               journal: Optional[BatchJournal] = None,
+               warm: Optional['BatchContext'] = None) -> 'BatchContext':
+        '''
+        A journal is given when resuming a batch, otherwise a new one is started.
+        With a warm context (e.g. the daemon), the batch reuses its connections, pollers, trigger cap and history.
+        A dry run keeps its own approval indexes, pool gate, history and results, as they are bound to the fake api.
+        '''
+        if warm is not None:
+            return cls(
+                session_pool = warm.session_pool,
+                # the indexes and the pool gate keep the api they were first given, a dry run must not share them with real batches
+                approval_indexes = ApprovalIndexRegistry() if options.dry_run else warm.approval_indexes,
+                status_poller = warm.status_poller,
+                triggering = warm.triggering,
+                # the durations of dry runs mean nothing, they must not reach the history of the real batches
+                duration_history = DurationHistory() if options.dry_run else warm.duration_history,
+                canceller = RunCanceller(fail_fast = options.fail_fast),
+                journal = journal or BatchJournalFactory.create(in_memory = options.dry_run),
+                agent_pools = cls._agent_pools(options, warm) if options.respect_agent_pools else None,
+                run_results = cls._run_results(options, warm),
+                shared = True
+            )
+        return cls(
+            session_pool = AzureSessionPool(pool_size = options.http_pool_size, hedging = options.hedge_requests),
+            triggering = threading.BoundedSemaphore(options.max_concurrent_triggers),  # trigger requests at the same time, not runs in flight
+            duration_history = DurationHistoryFactory.create(in_memory = options.dry_run),
+            canceller = RunCanceller(fail_fast = options.fail_fast),
+            journal = journal or BatchJournalFactory.create(in_memory = options.dry_run),
+            agent_pools = AgentPoolGate() if options.respect_agent_pools else None,
+            run_results = cls._run_results(options)
+        )
+
+    @staticmethod
+    def _agent_pools(options: ExecutionOptions, warm: 'BatchContext') -> AgentPoolGate:
+        if options.dry_run or warm.agent_pools is None:
+            return AgentPoolGate()
+        return warm.agent_pools
+
+    @staticmethod
+    def _run_results(options: ExecutionOptions, warm: Optional['BatchContext'] = None) -> Optional[RunResultCache]:
+        ''' The runs of a dry run never happened, so they are neither trusted nor remembered '''
+        if not options.incremental:
+            return None
+        if warm is not None and warm.run_results is not None and not options.dry_run:
+            return warm.run_results
+        return RunResultCacheFactory.create(in_memory = options.dry_run)
+
+    def start(self, execution: PipelineExecution) -> None:
+        ''' Triggers the execution once its agent pool has room (when asked to), within the cap of triggers at the same time '''
+        if self.agent_pools:
+            self.agent_pools.wait_for_room(execution, self.canceller)
+        with self.triggering:
+            execution.start()
+
+    def close(self) -> None:
+        self.duration_history.save()
+        if self.run_results:
+            self.run_results.save()
+        self.journal.close()
+        if not self.shared:
+            self.session_pool.close()
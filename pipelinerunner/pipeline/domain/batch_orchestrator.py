@@ -1,25 +1,276 @@
-from typing import List
+import asyncio
+import signal
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from dataclasses import replace
+from typing import Callable, Dict, List, Optional
 
 from pipelinerunner.runner.application.model import RunnerModel
+from pipelinerunner.runner.domain.serializer import RunnerSerializer
 from pipelinerunner.pipeline.application.model import ExecutionOptions
+from pipelinerunner.pipeline.domain.batch_context import BatchContext
+from pipelinerunner.pipeline.domain.run import PipelineExecution
 from pipelinerunner.pipeline.domain.run_strategy import (
     SequentialPipelineExecutionStrategy,
-    ParallelPipelineExecutionStrategy
+    ParallelPipelineExecutionStrategy,
+    WavePipelineExecutionStrategy,
+    ApprovalHandler,
+    ExecutionMonitor
 )
-from pipelinerunner.pipeline.domain.enums import PipelineExecutionMode
+from pipelinerunner.pipeline.domain.async_run_strategy import AsyncPipelineExecutionStrategy
+from pipelinerunner.pipeline.domain.sliding_window import SlidingWindowExecutor, RunWindow
+from pipelinerunner.pipeline.domain.dependency_graph import DependencyGraph, DependencyGraphExecutor
+from pipelinerunner.pipeline.domain.incremental import IncrementalPlanner
+from pipelinerunner.pipeline.domain.run_ordering import RunOrderer, PlannedRun, simulate_makespan
+from pipelinerunner.pipeline.domain.enums import PipelineExecutionMode, RunOrder
+from pipelinerunner.pipeline.infrastructure.batch_journal import BatchJournal
+from pipelinerunner.pipeline.infrastructure.factory_pipeline_api import PipelineAPIFactory
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
 
 
 class PipelineBatchOrchestrator:
-    def __init__(self, runners: List[RunnerModel], mode: PipelineExecutionMode, options: ExecutionOptions):
-        self.runners = runners
+    def __init__(self,
+                 runners: List[RunnerModel],
+                 mode: PipelineExecutionMode,
+                 options: ExecutionOptions,
+                 journal: Optional[BatchJournal] = None,
+                 warm: Optional[BatchContext] = None):
+        ''' The journal of a previous invocation is given to resume its batch, a warm context to share its resources '''
+        self.runners = runners if journal is not None else self._unique_names(runners)
         self.mode = mode
         self.options = options
+        self.resuming = journal is not None
+        self.context = BatchContext.create(options, journal = journal, warm = warm)
+        self.incremental: Optional[IncrementalPlanner] = None
+
+    @staticmethod
+    def _unique_names(runners: List[RunnerModel]) -> List[RunnerModel]:
+        '''
+        The runs are identified in the journal by "<runner>/<position>", so a runner declared twice (allowed without
+        depends_on) is renamed "<runner>#2" in this batch, instead of re-attaching to the runs of the first one
+        '''
+        occurrences: Counter = Counter()
+        unique = list()
+        for runner in runners:
+            occurrences[runner.name] += 1
+            if occurrences[runner.name] > 1:
+                name = f'{runner.name}#{occurrences[runner.name]}'
+                logger.warning(f'Runner "{runner.name}" is declared more than once, it is called "{name}" in this batch')
+                runner = replace(runner, name = name)
+            unique.append(runner)
+        return unique
 
     def run_all(self):
+        if not self._plan_incremental():
+            self.context.close()
+            return
+        previous_handler = self._handle_interrupts()
+        self._open_journal()
+        try:
+            self._run_all()
+        except KeyboardInterrupt:
+            self.context.canceller.cancel_all(reason = 'interrupted by the operator')
+            raise
+        finally:
+            if previous_handler is not None:
+                signal.signal(signal.SIGINT, previous_handler)
+            if self.incremental:
+                self.incremental.record(self.context.journal)
+            self._log_http_stats()
+            self.context.close()
+
+    def _plan_incremental(self) -> bool:
+        '''
+        Leaves out the runs unchanged since a successful run, before the journal records the batch,
+        so a resumed batch is made of the same runs. False when there is nothing left to run.
+        '''
+        if not self.options.incremental or self.resuming:
+            return True
+        self.incremental = IncrementalPlanner(
+            cache = self.context.run_results,
+            api_factory = lambda runner: PipelineAPIFactory.create(runner, dry_run = self.options.dry_run, session_pool = self.context.session_pool),
+            max_age = self.options.incremental_ttl * 3600
+        )
+        self.runners = self.incremental.select(self.runners)
+        if not self.runners:
+            logger.success('Nothing to run, every run is unchanged since its last success')
+            return False
+        return True
+
+    def _open_journal(self):
+        journal = self.context.journal
+        if self.resuming:
+            journal.resumed()
+            total = sum(len(runner.runs) for runner in self.runners)
+            in_flight = len(journal.in_flight())
+            logger.info(
+                f'Resuming batch {journal.batch_id}: {len(journal.completed)} run(s) already finished and '
+                f'{in_flight} still in flight are re-attached, {total - len(journal.run_ids)} run(s) never started are triggered'
+            )
+            return
+        journal.start_batch([ RunnerSerializer.serialize(runner) for runner in self.runners ], self.mode.value)
+        if journal.path is not None:
+            logger.info(f'Batch {journal.batch_id} (if interrupted, resume it with: pipeline run --resume {journal.batch_id})')
+
+    def _handle_interrupts(self):
+        ''' Ctrl+C cancels the runs in flight, a second Ctrl+C exits right away '''
+        if threading.current_thread() is not threading.main_thread():  # signals only reach the main thread
+            return None
+
+        def on_interrupt(signum, frame):
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            self.context.canceller.requested.set()  # the worker threads stop starting and waiting for runs
+            logger.warning('Interrupted, cancelling the runs in flight (press Ctrl+C again to exit right away)')
+            raise KeyboardInterrupt
+
+        return signal.signal(signal.SIGINT, on_interrupt)
+
+    def _run_all(self):
+        graph = DependencyGraph(self.runners)
+        self._report_order(graph)
+        if graph.has_dependencies():
+            if self.mode != PipelineExecutionMode.PARALLEL:
+                logger.warning(f'The runners declare dependencies, so they run as a dependency graph instead of in {self.mode.value} mode')
+            DependencyGraphExecutor(graph, self.options, self.context).run()
+            return
+
+        if self.mode == PipelineExecutionMode.ASYNC:
+            if self.options.respect_agent_pools:
+                logger.warning('The async mode does not wait for free agents, --respect-agent-pools is ignored')
+            asyncio.run(self._run_all_async())
+            return
+
         if self.mode == PipelineExecutionMode.SEQUENTIAL:
             for runner in self.runners:
-                SequentialPipelineExecutionStrategy(runner, self.options).run()
+                SequentialPipelineExecutionStrategy(runner, self.options, self.context).run()
+            return
+
+        if self.mode == PipelineExecutionMode.WINDOW:
+            SlidingWindowExecutor(self.runners, self.options, self.context).run()
+            return
+
+        if self.mode == PipelineExecutionMode.WAVES:
+            self._run_all_in_waves()
             return
-        
-        for runner in self.runners:
-            ParallelPipelineExecutionStrategy(runner, self.options).run()
+
+        self._run_all_parallel()
+
+    def _report_order(self, graph: DependencyGraph) -> None:
+        ''' The order the runs will be started in and the predicted makespan, once for the batch whatever its mode '''
+        if self.options.run_order == RunOrder.FILE:
+            return
+        orderer = RunOrderer(self.options.run_order)
+        in_file_order = self.mode in (PipelineExecutionMode.SEQUENTIAL, PipelineExecutionMode.WAVES) and not graph.has_dependencies()
+        planned = self._plan(interleaved = self.mode != PipelineExecutionMode.SEQUENTIAL or graph.has_dependencies())
+        if in_file_order:
+            logger.info(f'The {self.mode.value} mode starts the runs of each runner in file order')
+        else:
+            planned = orderer.sort(planned, execution_of = lambda run: run)
+        if planned:
+            orderer.report(planned, self._predict_makespan(planned, graph))
+
+    def _plan(self, interleaved: bool) -> List[PlannedRun]:
+        ''' The runs still to trigger, round-robin over the runners when they start together, runner by runner otherwise '''
+        history = self.context.duration_history
+        queues = [
+            [
+                PlannedRun(runner, index, run.priority, history.expected(runner.project_name, runner.definition_id, run.parameters))
+                for index, run in enumerate(runner.runs)
+                if not self.context.journal.run_id_of(f'{runner.name}/{index + 1}')  # resuming, already triggered
+            ]
+            for runner in self.runners
+        ]
+        if not interleaved:
+            return [ run for queue in queues for run in queue ]
+        planned = list()
+        for position in range(max((len(q) for q in queues), default = 0)):
+            planned.extend(q[position] for q in queues if position < len(q))
+        return planned
+
+    def _predict_makespan(self, planned: List[PlannedRun], graph: DependencyGraph) -> Optional[float]:
+        ''' How long the batch should take in its mode, each run taking its expected duration '''
+        if all(run.expected_duration is None for run in planned):
+            return None
+        fallback = RunOrderer.fallback_duration(planned)
+        duration_of: Callable[[PlannedRun], float] = lambda run: RunOrderer.expected(run, fallback)
+        if graph.has_dependencies():
+            durations = { (id(run.runner), run.index): duration_of(run) for run in planned }  # the runs already triggered take no time
+            return graph.predict_makespan(lambda node: durations.get((id(node.runner), node.index), 0.0))
+        if self.mode == PipelineExecutionMode.SEQUENTIAL:
+            return sum(duration_of(run) for run in planned)
+        if self.mode == PipelineExecutionMode.WINDOW:
+            window = RunWindow(self.runners, self.options)  # an empty one, just for the replay
+            return simulate_makespan(
+                planned,
+                duration_of = duration_of,
+                try_acquire = lambda run: window.try_acquire(run.runner),
+                release = lambda run: window.release(run.runner)
+            )
+        if self.mode == PipelineExecutionMode.WAVES:
+            runs_of: Dict[int, List[PlannedRun]] = dict()
+            for run in planned:
+                runs_of.setdefault(id(run.runner), list()).append(run)
+            return max(
+                sum(max(duration_of(run) for run in wave) for wave in WavePipelineExecutionStrategy.split_in_waves(runs, self.options.wave_sizes))
+                for runs in runs_of.values()
+            )
+        return max(duration_of(run) for run in planned)  # every run starts right away
+
+    def _run_all_parallel(self):
+        '''
+        Every runner starts its runs at the same time (bounded by the cap of concurrent triggers of the batch),
+        then the approvals and the monitoring of all runs are shared, so the batch takes about as long as its slowest runner
+        '''
+        strategies = [ ParallelPipelineExecutionStrategy(runner, self.options, self.context) for runner in self.runners ]
+        executions: List[PipelineExecution] = list()
+        with ThreadPoolExecutor(max_workers = max(1, len(strategies)), thread_name_prefix = 'runner') as executor:
+            futures = [ executor.submit(strategy.start_all) for strategy in strategies ]
+            for strategy, future in zip(strategies, futures):
+                try:
+                    executions.extend(future.result())
+                except Exception as exc:
+                    logger.error(f'Failed to start the runs of runner "{strategy.runner.name}": {exc}')
+
+        if not executions:
+            return
+        if not self.options.wait:
+            logger.success('All pipelines have been started (no waiting)! Check manually their status.')
+            return
+
+        ApprovalHandler(auto_approve = self.options.auto_approve).handle(executions)
+        ExecutionMonitor(poller = self.context.status_poller, history = self.context.duration_history).monitor(executions)
+        logger.info(f'All {len(executions)} run(s) of {len(strategies)} runner(s) completed!')
+
+    def _run_all_in_waves(self):
+        ''' The runners roll out their waves independently, so a broken runner does not hold back the others '''
+        strategies = [ WavePipelineExecutionStrategy(runner, self.options, self.context) for runner in self.runners ]
+        with ThreadPoolExecutor(max_workers = max(1, len(strategies)), thread_name_prefix = 'runner') as executor:
+            futures = [ executor.submit(strategy.run) for strategy in strategies ]
+            for strategy, future in zip(strategies, futures):
+                try:
+                    future.result()
+                except Exception as exc:
+                    logger.error(f'Failed to run the waves of runner "{strategy.runner.name}": {exc}')
+
+    async def _run_all_async(self):
+        limiter = asyncio.Semaphore(self.options.http_pool_size)  # shared by all runners of the batch
+        strategies = [ AsyncPipelineExecutionStrategy(runner, self.options, self.context) for runner in self.runners ]
+        await asyncio.gather(*(strategy.run_async(limiter) for strategy in strategies))
+
+    def _log_http_stats(self):
+        all_stats = self.context.session_pool.stats()
+        for stats in all_stats:
+            logger.info(f'HTTP {stats}')
+        for session in self.context.session_pool.sessions():
+            logger.info(f'Response cache of organization "{session.organization_name}": {session.response_cache.stats}')
+            if session.circuit.times_opened:
+                logger.info(str(session.circuit))
+            for latency in session.latency.summary():
+                logger.debug(f'Latency of {latency}')
+        if all_stats:
+            logger.debug(str(self.context.session_pool.governor))
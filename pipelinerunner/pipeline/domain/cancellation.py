@@ -0,0 +1,92 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List
+
+from pipelinerunner.pipeline.infrastructure.pipeline_api import BasePipelineAPI
+from pipelinerunner.pipeline.domain.exceptions import AzurePipelineAPIError
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+@dataclass(frozen = True)
+class InFlightRun:
+    run_id: str
+    pipeline_name: str
+    api: BasePipelineAPI
+
+
+class RunCanceller:
+    '''
+    Knows the runs of the batch that are still in flight, so they can all be cancelled at once
+    (on Ctrl+C, or on the first failure with fail-fast) instead of being left behind consuming agents.
+    Once a cancellation is requested, no new run should be started and a run started meanwhile is cancelled right away.
+    '''
+    MAX_WORKERS = 16
+
+    def __init__(self, fail_fast: bool = False):
+        self.fail_fast = fail_fast
+        self.requested = threading.Event()  # only set here, so it is safe to set from a signal handler
+        self._runs: Dict[str, InFlightRun] = dict()
+        self._lock = threading.Lock()
+        self._cancelled = False
+
+    def track(self, run_id: str, pipeline_name: str, api: BasePipelineAPI) -> None:
+        run = InFlightRun(str(run_id), pipeline_name, api)
+        with self._lock:
+            late = self._cancelled
+            if not late:
+                self._runs[run.run_id] = run
+        if late:  # started while the batch was being cancelled
+            self._cancel_all([ run ])
+
+    def untrack(self, run_id: str) -> None:
+        with self._lock:
+            self._runs.pop(str(run_id), None)
+
+    def run_failed(self, run_id: str, pipeline_name: str) -> None:
+        self.untrack(run_id)
+        if self.fail_fast and not self.requested.is_set():
+            self.cancel_all(reason = f'run {run_id} on pipeline {pipeline_name} failed (fail-fast)')
+
+    def is_cancelling(self) -> bool:
+        return self.requested.is_set()
+
+    def cancel_all(self, reason: str) -> List[InFlightRun]:
+        ''' Cancels every run in flight concurrently, only the first call does it '''
+        self.requested.set()
+        with self._lock:
+            if self._cancelled:
+                return list()
+            self._cancelled = True
+            runs = list(self._runs.values())
+            self._runs.clear()
+        logger.warning(f'Cancelling the batch: {reason}')
+        return self._cancel_all(runs)
+
+    def _cancel_all(self, runs: List[InFlightRun]) -> List[InFlightRun]:
+        if not runs:
+            logger.info('No run in flight to cancel')
+            return list()
+        with ThreadPoolExecutor(max_workers = min(self.MAX_WORKERS, len(runs)), thread_name_prefix = 'cancel') as executor:
+            results = list(executor.map(self._cancel, runs))
+
+        rows = [ [ run.run_id, run.pipeline_name, 'cancelled' if ok else 'FAILED to cancel' ] for run, ok in zip(runs, results) ]
+        logger.print_table(
+            title = f'Cancelled runs ({sum(results)}/{len(runs)})',
+            columns = ["Run ID", "Pipeline", "Result"],
+            rows = rows
+        )
+        return [ run for run, ok in zip(runs, results) if ok ]
+
+    @staticmethod
+    def _cancel(run: InFlightRun) -> bool:
+        try:
+            run.api.cancel_run(run.run_id)
+            return True
+        except AzurePipelineAPIError as exc:
+            logger.error(str(exc))
+            return False
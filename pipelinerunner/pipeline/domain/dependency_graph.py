@@ -0,0 +1,286 @@
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from pipelinerunner.runner.application.model import RunnerModel
+from pipelinerunner.pipeline.application.model import ExecutionOptions
+from pipelinerunner.pipeline.domain.batch_context import BatchContext
+from pipelinerunner.pipeline.domain.run import PipelineExecution
+from pipelinerunner.pipeline.domain.run_strategy import ParallelPipelineExecutionStrategy, ApprovalHandler, ExecutionMonitor
+from pipelinerunner.pipeline.domain.run_ordering import RunOrderer
+from pipelinerunner.pipeline.domain.enums import DependencyNodeState
+from pipelinerunner.pipeline.domain.exceptions import AzurePipelineAPIError, DependencyGraphError, PipelineExecutionCancelled
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+@dataclass(eq = False)
+class DependencyNode:
+    ''' A single run of a runner, named "<runner>/<run name or position>" '''
+    key: str
+    runner: RunnerModel
+    index: int
+    predecessors: List['DependencyNode'] = field(default_factory = list)
+    successors: List['DependencyNode'] = field(default_factory = list)
+    state: DependencyNodeState = DependencyNodeState.PENDING
+    execution: Optional[PipelineExecution] = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+
+class DependencyGraph:
+    '''
+    The runs of a batch and what each one waits for.
+    A runner in depends_on stands for all of its runs, "<runner>/<run>" for a single one.
+    The depends_on of a runner applies to every one of its runs.
+    The names only have to be unique when the batch declares dependencies, as they are what depends_on references.
+    '''
+    def __init__(self, runners: List[RunnerModel]):
+        self.nodes: List[DependencyNode] = list()
+        self._by_runner: Dict[str, List[DependencyNode]] = dict()
+        self._by_key: Dict[str, DependencyNode] = dict()
+        declared = self.declares_dependencies(runners)
+        for runner in runners:
+            if runner.name in self._by_runner and declared:
+                raise DependencyGraphError(f'Runner "{runner.name}" is declared more than once')
+            self._by_runner.setdefault(runner.name, list())
+            for index, run in enumerate(runner.runs):
+                node = DependencyNode(key = f'{runner.name}/{run.name or index + 1}', runner = runner, index = index)
+                if node.key in self._by_key and declared:
+                    raise DependencyGraphError(f'Run "{node.key}" is declared more than once')
+                self._by_key.setdefault(node.key, node)
+                self._by_runner[runner.name].append(node)
+                self.nodes.append(node)
+
+        for node in self.nodes:
+            references = list(node.runner.depends_on) + list(node.runner.runs[node.index].depends_on)
+            for reference in references:
+                for predecessor in self._resolve(reference, node):
+                    if predecessor is node or predecessor in node.predecessors:
+                        continue
+                    node.predecessors.append(predecessor)
+                    predecessor.successors.append(node)
+        self.order = self._topological_order()
+
+    def _resolve(self, reference: str, node: DependencyNode) -> List[DependencyNode]:
+        if reference in self._by_runner:
+            return self._by_runner[reference]
+        if reference in self._by_key:
+            return [ self._by_key[reference] ]
+        raise DependencyGraphError(f'Run "{node.key}" depends on "{reference}", which is neither a runner nor a run of the batch')
+
+    def _topological_order(self) -> List[DependencyNode]:
+        ''' Kahn's algorithm, keeping the order of the file among independent runs '''
+        pending = { node: len(node.predecessors) for node in self.nodes }
+        ready = deque(node for node in self.nodes if not node.predecessors)
+        order = list()
+        while ready:
+            node = ready.popleft()
+            order.append(node)
+            for successor in node.successors:
+                pending[successor] -= 1
+                if not pending[successor]:
+                    ready.append(successor)
+        if len(order) < len(self.nodes):
+            cycle = ', '.join(node.key for node in self.nodes if pending[node])
+            raise DependencyGraphError(f'The dependencies form a cycle between: {cycle}')
+        return order
+
+    @staticmethod
+    def declares_dependencies(runners: List[RunnerModel]) -> bool:
+        return any(runner.depends_on or any(run.depends_on for run in runner.runs) for runner in runners)
+
+    def has_dependencies(self) -> bool:
+        return any(node.predecessors for node in self.nodes)
+
+    def ready(self) -> List[DependencyNode]:
+        ''' The pending runs whose predecessors all succeeded '''
+        return [
+            node for node in self.order
+            if node.state == DependencyNodeState.PENDING
+            and all(p.state == DependencyNodeState.SUCCEEDED for p in node.predecessors)
+        ]
+
+    def skip_dependents(self, failed: DependencyNode) -> List[DependencyNode]:
+        skipped = list()
+        queue = deque(failed.successors)
+        while queue:
+            node = queue.popleft()
+            if node.state != DependencyNodeState.PENDING:
+                continue
+            node.state = DependencyNodeState.SKIPPED
+            skipped.append(node)
+            queue.extend(node.successors)
+        return skipped
+
+    def predict_makespan(self, duration_of: Callable[[DependencyNode], float]) -> float:
+        ''' The longest chain of runs, every run starting as soon as its predecessors end '''
+        finish: Dict[DependencyNode, float] = dict()
+        for node in self.order:
+            finish[node] = max((finish[p] for p in node.predecessors), default = 0.0) + duration_of(node)
+        return max(finish.values(), default = 0.0)
+
+    def critical_path(self) -> List[DependencyNode]:
+        ''' The chain of runs that gated the end of the batch: the last one to finish and, going back, whatever it waited for the longest '''
+        finished = [ node for node in self.nodes if node.finished_at is not None ]
+        if not finished:
+            return list()
+        path = [ max(finished, key = lambda n: n.finished_at) ]
+        while True:
+            predecessors = [ p for p in path[-1].predecessors if p.finished_at is not None ]
+            if not predecessors:
+                break
+            path.append(max(predecessors, key = lambda n: n.finished_at))
+        path.reverse()
+        return path
+
+
+class DependencyGraphExecutor:
+    '''
+    Runs the batch as a dependency graph: every run starts as soon as all of its predecessors succeed,
+    so independent branches go in parallel. The dependents of a failed run are skipped.
+    '''
+    APPROVAL_WORKERS = 4
+
+    def __init__(self, graph: DependencyGraph, options: ExecutionOptions, context: BatchContext):
+        self.graph = graph
+        self.options = options
+        self.context = context
+        self.monitor = ExecutionMonitor(poller = context.status_poller, history = context.duration_history)
+        self.approvals = ApprovalHandler(auto_approve = options.auto_approve)
+        self.orderer = RunOrderer(options.run_order)
+        self._executions: Dict[str, List[PipelineExecution]] = dict()
+        self._nodes: Dict[PipelineExecution, DependencyNode] = dict()
+        self._started_at: Optional[float] = None
+
+    def run(self) -> None:
+        if not self.options.wait:
+            logger.warning('A dependency graph needs to wait for the runs to know when their dependents can start, so --no-wait is ignored')
+        logger.info(f'Running {len(self.graph.nodes)} run(s) as a dependency graph')
+        self._started_at = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers = self.APPROVAL_WORKERS, thread_name_prefix = 'approvals') as approvals:
+            while True:
+                started = self._start(self.graph.ready())
+                if started:
+                    approvals.submit(self._handle_approvals, started)
+                if not len(self.monitor):
+                    if not self.graph.ready():
+                        break
+                    continue
+                for execution in self.monitor.poll_due():
+                    self._finish(self._nodes.pop(execution))
+
+        self._log_summary()
+
+    def _start(self, nodes: List[DependencyNode]) -> List[PipelineExecution]:
+        if not nodes:
+            return list()
+        if self.context.canceller.is_cancelling():
+            for node in nodes:
+                node.state = DependencyNodeState.SKIPPED
+            logger.warning(f'The batch was cancelled, skipping: {", ".join(node.key for node in nodes)}')
+            return list()
+        for node in nodes:
+            node.state = DependencyNodeState.RUNNING
+            node.execution = self._executions_of(node.runner)[node.index]
+        nodes = self.orderer.sort(nodes, execution_of = lambda node: node.execution)  # the trigger order, under the cap of concurrent triggers
+
+        fan_out = min(self.options.trigger_concurrency, len(nodes))
+        with ThreadPoolExecutor(max_workers = fan_out, thread_name_prefix = 'trigger') as executor:
+            results = list(executor.map(self._trigger, nodes))
+
+        started = list()
+        for node, ok in zip(nodes, results):
+            if not ok:
+                node.finished_at = time.monotonic()
+                self._fail(node)
+                continue
+            self._nodes[node.execution] = node
+            self.monitor.track(node.execution)
+            started.append(node.execution)
+        return started
+
+    def _trigger(self, node: DependencyNode) -> bool:
+        node.started_at = time.monotonic()
+        try:
+            self.context.start(node.execution)
+            return True
+        except PipelineExecutionCancelled:
+            return False
+        except AzurePipelineAPIError as exc:
+            logger.error(f'Failed to start run "{node.key}": {exc}')
+            return False
+
+    def _finish(self, node: DependencyNode) -> None:
+        node.finished_at = time.monotonic()
+        if node.execution.status.is_successful():
+            node.state = DependencyNodeState.SUCCEEDED
+            ready = [ s.key for s in node.successors if s in self.graph.ready() ]
+            if ready:
+                logger.info(f'Run "{node.key}" succeeded, starting: {", ".join(ready)}')
+            return
+        self._fail(node)
+
+    def _fail(self, node: DependencyNode) -> None:
+        node.state = DependencyNodeState.FAILED
+        skipped = self.graph.skip_dependents(node)
+        if skipped:
+            logger.warning(f'Run "{node.key}" failed, skipping {len(skipped)} dependent run(s): {", ".join(s.key for s in skipped)}')
+
+    def _executions_of(self, runner: RunnerModel) -> List[PipelineExecution]:
+        ''' Created once per runner, so its runs share the API client of its strategy '''
+        if runner.name not in self._executions:
+            strategy = ParallelPipelineExecutionStrategy(runner, self.options, self.context)
+            self._executions[runner.name] = strategy.create_executions()
+        return self._executions[runner.name]
+
+    def _handle_approvals(self, executions: List[PipelineExecution]) -> None:
+        try:
+            self.approvals.handle(executions)
+        except Exception as exc:
+            logger.error(f'Error handling the approvals of {len(executions)} run(s): {exc}')
+        self.monitor.wake_up()
+
+    def _log_summary(self) -> None:
+        elapsed = time.monotonic() - self._started_at
+        states = { state: 0 for state in DependencyNodeState }
+        for node in self.graph.nodes:
+            states[node.state] += 1
+        logger.info(
+            f'Dependency graph completed in {elapsed:.1f}s: '
+            f'{states[DependencyNodeState.SUCCEEDED]} succeeded, '
+            f'{states[DependencyNodeState.FAILED]} failed, '
+            f'{states[DependencyNodeState.SKIPPED]} skipped'
+        )
+
+        path = self.graph.critical_path()
+        if not path:
+            return
+        rows = [
+            [
+                node.key,
+                node.runner.pipeline_name,
+                node.execution.run_info.id if node.execution and node.execution.run_info else '-',
+                f'+{node.started_at - self._started_at:.1f}s',
+                f'{node.duration:.1f}s',
+                node.state.value
+            ]
+            for node in path
+        ]
+        logger.print_table(
+            title = f'Critical path ({path[-1].finished_at - self._started_at:.1f}s)',
+            columns = ["Run", "Pipeline", "Run ID", "Started", "Duration", "State"],
+            rows = rows
+        )
@@ -5,6 +5,9 @@ from typing import List, Optional
 class PipelineExecutionMode(Enum):
     PARALLEL = ('parallel', 'It runs one pipeline after another')
     SEQUENTIAL = ('sequential', 'It runs all pipelines at once')
+    ASYNC = ('async', 'It drives all runs from a single asyncio event loop')
+    WINDOW = ('window', 'It keeps a limited number of runs in flight, starting a new one as soon as another finishes')
+    WAVES = ('waves', 'It starts the runs of each runner in waves, the next wave only when the previous one succeeded enough')
 
     def __init__(self, value: str, description: str):
         self._value_ = value
@@ -38,6 +41,55 @@ class PipelineExecutionMode(Enum):
         raise ValueError(f"Invalid execution mode '{value}'. Valid values are: {valid_values}")
 
 
+class RunOrder(Enum):
+    FILE = ('file', 'In the order of the file')
+    SHORTEST_FIRST = ('shortest-first', 'Shortest expected duration first, to get results sooner')
+    LONGEST_FIRST = ('longest-first', 'Longest expected duration first, to finish the whole batch sooner')
+
+    def __init__(self, value: str, description: str):
+        self._value_ = value
+        self.description = description
+
+    def get_values() -> List:
+        return [ order.value for order in RunOrder ]
+
+    def get_help_message() -> str:
+        return ' - '.join(f'{order.value}: {order.description}' for order in RunOrder)
+
+    @staticmethod
+    def from_value(value) -> 'RunOrder':
+        normalized = (value or RunOrder.FILE.value).lower().strip()
+        for order in RunOrder:
+            if order.value == normalized:
+                return order
+        valid_values = ", ".join(RunOrder.get_values())
+        raise ValueError(f"Invalid run order '{value}'. Valid values are: {valid_values}")
+
+
+class ShardBy(Enum):
+    COUNT = ('count', 'Same number of runs in every shard')
+    DURATION = ('duration', 'Same expected duration in every shard, from the durations of past runs')
+
+    def __init__(self, value: str, description: str):
+        self._value_ = value
+        self.description = description
+
+    def get_values() -> List:
+        return [ by.value for by in ShardBy ]
+
+    def get_help_message() -> str:
+        return ' - '.join(f'{by.value}: {by.description}' for by in ShardBy)
+
+    @staticmethod
+    def from_value(value) -> 'ShardBy':
+        normalized = (value or ShardBy.COUNT.value).lower().strip()
+        for by in ShardBy:
+            if by.value == normalized:
+                return by
+        valid_values = ", ".join(ShardBy.get_values())
+        raise ValueError(f"Invalid shard balancing '{value}'. Valid values are: {valid_values}")
+
+
 class AzurePipelineRunState(Enum):
     IN_PROGRESS = 'inProgress'
     COMPLETED = 'completed'
@@ -54,6 +106,18 @@ class AzurePipelineRunState(Enum):
                 return state
         return AzurePipelineRunState.UNKNOWN
 
+    @staticmethod
+    def from_build_status(value: Optional[str]) -> 'AzurePipelineRunState':
+        ''' The builds API has its own status names for the same lifecycle '''
+        if not value:
+            return AzurePipelineRunState.UNKNOWN
+        normalized = value.strip().lower()
+        if normalized in ('notstarted', 'postponed'):  # queued runs are reported as in progress by the runs API
+            return AzurePipelineRunState.IN_PROGRESS
+        if normalized == 'cancelling':
+            return AzurePipelineRunState.CANCELING
+        return AzurePipelineRunState.from_string(value)
+
 
 class AzurePipelineRunResult(Enum):
     SUCCEEDED = 'succeeded'
@@ -70,3 +134,17 @@ class AzurePipelineRunResult(Enum):
             if result.value.lower() == normalized:
                 return result
         return AzurePipelineRunResult.UNKNOWN
+
+
+class CircuitState(Enum):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+
+class DependencyNodeState(Enum):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
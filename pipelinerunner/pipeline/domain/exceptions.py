@@ -14,5 +14,42 @@ class PipelineExecutionError(PipelineException):
     pass
 
 
+class PipelineExecutionCancelled(PipelineException):
+    ''' The batch is being cancelled, so no new run is started '''
+    pass
+
+
+class DependencyGraphError(PipelineException):
+    ''' The depends_on of the runners reference unknown runs or form a cycle '''
+    pass
+
+
+class BatchJournalError(PipelineException):
+    ''' The journal of a batch cannot be found or read back '''
+    pass
+
+
+class WorkQueueError(PipelineException):
+    ''' The shared work queue cannot be opened or a queued run cannot be read back '''
+    pass
+
+
+class DaemonError(PipelineException):
+    ''' The daemon cannot be reached, or it refused the request '''
+    pass
+
+
 class AzurePipelineAPIError(PipelineException):
     pass
+
+
+class AzurePipelineAPITransientError(AzurePipelineAPIError):
+    ''' A failure that may go away when retried. When ambiguous, the request may have been processed anyway. '''
+    def __init__(self, message: str, ambiguous: bool = False):
+        super().__init__(message)
+        self.ambiguous = ambiguous
+
+
+class AzurePipelineAPIUnavailableError(AzurePipelineAPITransientError):
+    ''' The request was not even sent, as Azure DevOps is considered unavailable (circuit open) '''
+    pass
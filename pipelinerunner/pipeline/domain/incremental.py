@@ -0,0 +1,124 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pipelinerunner.runner.application.model import RunnerModel
+from pipelinerunner.pipeline.domain.dependency_graph import DependencyGraph, DependencyNode
+from pipelinerunner.pipeline.domain.enums import AzurePipelineRunResult
+from pipelinerunner.pipeline.domain.exceptions import AzurePipelineAPIError
+from pipelinerunner.pipeline.infrastructure.pipeline_api import BasePipelineAPI
+from pipelinerunner.pipeline.infrastructure.batch_journal import BatchJournal
+from pipelinerunner.pipeline.infrastructure.run_result_cache import RunResultCache
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+class IncrementalPlanner:
+    '''
+    Leaves out of the batch the runs whose inputs did not change since a successful run: same pipeline,
+    same parameters and the branch still on the same commit. Identical runs of the batch are triggered once.
+    A run is never left out when the commit of its branch is unknown (only its duplicates are),
+    nor when it is linked to others by depends_on, as its dependents expect it to run.
+    '''
+    MAX_WORKERS = 8
+
+    def __init__(self, cache: RunResultCache, api_factory: Callable[[RunnerModel], BasePipelineAPI], max_age: float):
+        self.cache = cache
+        self.api_factory = api_factory
+        self.max_age = max_age
+        self.fingerprints: Dict[str, str] = dict()  # journal key -> fingerprint, of the runs kept whose commit is known
+
+    def select(self, runners: List[RunnerModel]) -> List[RunnerModel]:
+        ''' The runners with only the runs to trigger, in the order of the file (runners left without runs are dropped) '''
+        graph = DependencyGraph(runners)
+        commits = self._resolve_commits(runners)
+        kept: Dict[DependencyNode, Optional[str]] = dict()  # node -> fingerprint
+        first_of: Dict[str, DependencyNode] = dict()
+        skipped, collapsed = 0, 0
+        for node in graph.nodes:
+            if node.predecessors or node.successors:
+                kept[node] = None
+                continue
+            runner = node.runner
+            commit = commits.get(self._branch_of(runner))
+            fingerprint = self.cache.fingerprint(
+                runner.project_name, runner.definition_id, runner.branch_name, commit, runner.runs[node.index].parameters
+            )
+            if fingerprint in first_of:
+                logger.debug(f'Run "{node.key}" is identical to run "{first_of[fingerprint].key}", it is triggered once')
+                collapsed += 1
+                continue
+            run_id = self.cache.lookup(fingerprint, self.max_age) if commit else None
+            if run_id:
+                logger.debug(f'Run "{node.key}" is unchanged since the successful run {run_id}, it is skipped')
+                skipped += 1
+                continue
+            first_of[fingerprint] = node
+            kept[node] = fingerprint if commit else None
+
+        selected = self._rebuild(runners, graph, kept)
+        logger.info(
+            f'Incremental: {len(kept)} of {len(graph.nodes)} run(s) to trigger, {skipped} unchanged since a successful run, '
+            f'{collapsed} duplicate(s) collapsed'
+        )
+        return selected
+
+    def record(self, journal: BatchJournal) -> int:
+        ''' Remembers the runs of the batch that succeeded, returns how many '''
+        recorded = 0
+        for key, result in list(journal.completed.items()):
+            fingerprint = self.fingerprints.get(key)
+            run_id = journal.run_id_of(key)
+            if fingerprint and run_id and AzurePipelineRunResult.from_string(result) == AzurePipelineRunResult.SUCCEEDED:
+                self.cache.record(fingerprint, run_id)
+                recorded += 1
+        return recorded
+
+    def _rebuild(self,
+                 runners: List[RunnerModel],
+                 graph: DependencyGraph,
+                 kept: Dict[DependencyNode, Optional[str]]) -> List[RunnerModel]:
+        nodes_of: Dict[int, List[DependencyNode]] = dict()
+        for node in graph.nodes:
+            nodes_of.setdefault(id(node.runner), list()).append(node)
+        selected = list()
+        for runner in runners:
+            runs = list()
+            for position, node in enumerate(nodes_of.get(id(runner), list()), 1):
+                if node not in kept:
+                    continue
+                # unnamed runs are named after their position in the file, so depends_on keeps pointing at them
+                run = replace(runner.runs[node.index], name = runner.runs[node.index].name or str(position))
+                runs.append(run)
+                if kept[node]:  # the journal identifies the runs by their position in the runner
+                    self.fingerprints[f'{runner.name}/{len(runs)}'] = kept[node]
+            if runs:
+                selected.append(replace(runner, runs = runs))
+        return selected
+
+    def _resolve_commits(self, runners: List[RunnerModel]) -> Dict[Tuple[str, str, str], Optional[str]]:
+        ''' One lookup per pipeline and branch, a run whose commit cannot be found is never skipped '''
+        branches: Dict[Tuple[str, str, str], RunnerModel] = dict()
+        for runner in runners:
+            branches.setdefault(self._branch_of(runner), runner)
+        if not branches:
+            return dict()
+        with ThreadPoolExecutor(max_workers = min(self.MAX_WORKERS, len(branches)), thread_name_prefix = 'commit') as executor:
+            commits = list(executor.map(self._resolve_commit, branches.values()))
+        return dict(zip(branches.keys(), commits))
+
+    def _resolve_commit(self, runner: RunnerModel) -> Optional[str]:
+        try:
+            commit = self.api_factory(runner).get_branch_commit()
+        except AzurePipelineAPIError as exc:
+            logger.warning(f'Unable to find the commit of branch "{runner.branch_name}" of pipeline {runner.pipeline_name}, its runs are not skipped: {exc}')
+            return None
+        if commit is None:
+            logger.info(f'The commit of branch "{runner.branch_name}" of pipeline {runner.pipeline_name} is unknown, its runs are not skipped')
+        return commit
+
+    @staticmethod
+    def _branch_of(runner: RunnerModel) -> Tuple[str, str, str]:
+        return (runner.project_name, str(runner.definition_id), runner.branch_name)
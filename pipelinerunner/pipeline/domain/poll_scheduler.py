@@ -0,0 +1,138 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+
+from dataclasses import dataclass
+from typing import Dict, Generic, Hashable, List, Optional, Tuple, TypeVar
+
+
+T = TypeVar("T", bound = Hashable)
+
+
+@dataclass(frozen = True)
+class PollingPolicy:
+    initial_interval: float = 5
+    min_interval: float = 2
+    max_interval: float = 30
+    backoff_factor: float = 1.5
+    jitter: float = 0.2  # fraction of the interval randomly added or removed
+
+    def next_interval(self, current: Optional[float], changed: bool, remaining: Optional[float] = None) -> float:
+        '''
+        Backs off exponentially while nothing changes and goes back to the initial pace on any change.
+        When the expected end of the run is known, the interval is tightened as it gets closer.
+        '''
+        if current is None or changed:
+            interval = self.initial_interval
+        else:
+            interval = min(current * self.backoff_factor, self.max_interval)
+        if remaining is not None:
+            if remaining <= 0:  # overdue, it may finish at any moment
+                interval = min(interval, self.initial_interval)
+            else:
+                interval = min(interval, max(self.min_interval, remaining / 2))
+        return max(self.min_interval, interval)
+
+    def with_jitter(self, interval: float) -> float:
+        ''' Spreads the polls of runs started together so they do not keep hitting the API in lockstep '''
+        spread = interval * self.jitter
+        return max(0.0, interval + random.uniform(-spread, spread))
+
+
+@dataclass
+class _PollEntry:
+    interval: Optional[float]
+    expected_end: Optional[float]
+    version: int
+
+
+class PollScheduler(Generic[T]):
+    '''
+    Keeps the next-due poll time of every tracked item in a min-heap.
+    Waiting is done on an event, so it can be interrupted at any time with wake() or stop().
+    '''
+    COALESCE_WINDOW = 1.0  # items due within this window are polled together
+
+    def __init__(self, policy: PollingPolicy = PollingPolicy(), coalesce_window: float = COALESCE_WINDOW):
+        self.policy = policy
+        self.coalesce_window = coalesce_window
+        self._heap: List[Tuple[float, int, T]] = list()
+        self._entries: Dict[T, _PollEntry] = dict()
+        self._versions = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+
+    def add(self, item: T, expected_end: Optional[float] = None) -> None:
+        ''' The expected_end is a time.monotonic() timestamp, when known '''
+        with self._lock:
+            entry = _PollEntry(interval = None, expected_end = expected_end, version = next(self._versions))
+            self._entries[item] = entry
+            self._push(item, entry, changed = True)
+        self._wakeup.set()
+
+    def reschedule(self, item: T, changed: bool) -> None:
+        with self._lock:
+            entry = self._entries.get(item)
+            if entry is None:
+                return
+            entry.version = next(self._versions)
+            self._push(item, entry, changed)
+
+    def remove(self, item: T) -> None:
+        with self._lock:
+            self._entries.pop(item, None)  # its heap nodes are discarded lazily
+
+    def _push(self, item: T, entry: _PollEntry, changed: bool) -> None:
+        now = time.monotonic()
+        remaining = entry.expected_end - now if entry.expected_end is not None else None
+        entry.interval = self.policy.next_interval(entry.interval, changed, remaining)
+        heapq.heappush(self._heap, (now + self.policy.with_jitter(entry.interval), entry.version, item))
+
+    def pop_due(self) -> List[T]:
+        ''' Items whose poll is due (including the ones due within the coalesce window) '''
+        due = list()
+        with self._lock:
+            limit = time.monotonic() + self.coalesce_window
+            while self._heap and self._heap[0][0] <= limit:
+                _, version, item = heapq.heappop(self._heap)
+                entry = self._entries.get(item)
+                if entry is None or entry.version != version:  # removed or rescheduled
+                    continue
+                due.append(item)
+        return due
+
+    def next_due_in(self) -> Optional[float]:
+        ''' Seconds until the next poll is due, None when nothing is scheduled '''
+        with self._lock:
+            while self._heap:
+                due_at, version, item = self._heap[0]
+                entry = self._entries.get(item)
+                if entry is None or entry.version != version:
+                    heapq.heappop(self._heap)
+                    continue
+                return max(0.0, due_at - time.monotonic())
+            return None
+
+    def wait_due(self) -> List[T]:
+        ''' Blocks until some item is due. It returns earlier (maybe empty) when woken up or stopped. '''
+        while not self._stopped:
+            due = self.pop_due()
+            if due:
+                return due
+            if self._wakeup.wait(self.next_due_in()):
+                self._wakeup.clear()
+                return self.pop_due()
+        return list()
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def stop(self) -> None:
+        self._stopped = True
+        self._wakeup.set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,213 @@
+import json
+import threading
+import time
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+from pipelinerunner.runner.domain.serializer import RunnerSerializer
+from pipelinerunner.pipeline.application.model import ExecutionOptions
+from pipelinerunner.pipeline.domain.batch_context import BatchContext
+from pipelinerunner.pipeline.domain.run import PipelineExecution
+from pipelinerunner.pipeline.domain.run_strategy import ParallelPipelineExecutionStrategy, ApprovalHandler, ExecutionMonitor
+from pipelinerunner.pipeline.domain.exceptions import AzurePipelineAPIError, PipelineExecutionCancelled, WorkQueueError
+from pipelinerunner.pipeline.infrastructure.work_queue import WorkQueue, QueuedRun
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+class QueueWorker:
+    '''
+    Claims runs from the shared work queue, triggers and monitors them and writes their results back.
+    Up to capacity runs are held at once and their leases are renewed by a thread of their own while they are monitored,
+    as a slow poll or trigger must not let them expire.
+    When the worker stops (e.g. Ctrl+C), its runs are given back to the queue without being cancelled,
+    so another worker re-attaches to them.
+    '''
+    APPROVAL_WORKERS = 4
+    MAX_HOLD_BACK = 0.5  # of the lease, a run waiting for a free agent longer than that since its claim is given back
+    IDLE_POLLING = 5  # seconds between two claims when the worker has nothing to monitor
+
+    def __init__(self,
+                 queue: WorkQueue,
+                 options: ExecutionOptions,
+                 context: BatchContext,
+                 worker_id: str,
+                 capacity: int = 20,
+                 lease: float = 120,
+                 follow: bool = False):
+        self.queue = queue
+        self.options = options
+        self.context = context
+        self.worker_id = worker_id
+        self.capacity = capacity
+        self.lease = lease
+        self.follow = follow  # keep waiting for new runs once the queue is empty
+        self.monitor = ExecutionMonitor(poller = context.status_poller, history = context.duration_history)
+        self.approvals = ApprovalHandler(auto_approve = options.auto_approve)
+        self.results: Counter = Counter()
+        self._held: Dict[PipelineExecution, QueuedRun] = dict()
+        self._strategies: Dict[str, ParallelPipelineExecutionStrategy] = dict()
+        self._waiting: Dict[int, QueuedRun] = dict()  # claimed, not triggered yet (e.g. waiting for a free agent)
+        self._lost: Set[int] = set()  # claims whose lease expired, another worker may own them now
+        self._held_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def run(self) -> None:
+        logger.info(f'Worker {self.worker_id} claiming up to {self.capacity} run(s) from {self.queue.path} (lease of {self.lease:.0f}s)')
+        renewal = threading.Thread(target = self._keep_leases, name = 'lease-renewal', daemon = True)
+        renewal.start()
+        try:
+            with ThreadPoolExecutor(max_workers = self.APPROVAL_WORKERS, thread_name_prefix = 'approvals') as approvals:
+                self._loop(approvals)
+        except KeyboardInterrupt:
+            self._stopping.set()
+            with self._held_lock:
+                held = list(self._held.values())
+                self._held.clear()
+            logger.warning(f'Worker stopped, {len(held)} run(s) given back to the queue (they keep running, another worker re-attaches to them)')
+            self.queue.release(held, self.worker_id)
+            raise
+        finally:
+            self._stopping.set()
+            renewal.join()
+            self._report()
+
+    def _loop(self, approvals: ThreadPoolExecutor) -> None:
+        while True:
+            claimed = self.queue.claim(self.worker_id, limit = self.capacity - len(self._held), lease = self.lease)
+            started = self._start_all(claimed, claimed_at = time.monotonic())
+            if started:
+                approvals.submit(self._handle_approvals, started)
+
+            if len(self.monitor):
+                for execution in self.monitor.poll_due():
+                    self._complete(execution)
+                continue
+            if claimed:
+                continue
+            if not self.follow and not self.queue.has_open_runs():
+                logger.info('The work queue is empty, the worker stops')
+                return
+            time.sleep(self.IDLE_POLLING)  # runs held by other workers may be reclaimed, or new ones enqueued
+
+    def _start_all(self, claimed: List[QueuedRun], claimed_at: float) -> List[PipelineExecution]:
+        if not claimed:
+            return list()
+        logger.info(f'{len(claimed)} run(s) claimed from the queue')
+        pending = list()
+        started = list()
+        for queued in claimed:
+            execution = self._create_execution(queued)
+            if queued.run_id:  # a previous worker triggered it and died
+                execution.attach(queued.run_id)
+                logger.info(f'Run {queued.run_id} of pipeline {execution.runner_name} re-attached (attempt {queued.attempts})')
+                started.append(execution)
+                self._hold(execution, queued)
+                continue
+            pending.append((execution, queued))
+
+        with self._held_lock:  # their leases are renewed while they wait to be triggered
+            self._waiting.update({ queued.id: queued for _, queued in pending })
+        deadline = claimed_at + self.lease * self.MAX_HOLD_BACK
+        fan_out = min(self.options.trigger_concurrency, len(pending)) or 1
+        with ThreadPoolExecutor(max_workers = fan_out, thread_name_prefix = 'trigger') as executor:
+            results = list(executor.map(lambda item: self._start(item, deadline), pending))
+        with self._held_lock:
+            for _, queued in pending:
+                self._waiting.pop(queued.id, None)
+        for (execution, queued), ok in zip(pending, results):
+            if ok is None:  # held back, another worker (or this one later) takes it again
+                self.queue.release([ queued ], self.worker_id)
+                continue
+            if not ok:
+                self._finish(queued, 'not triggered')
+                continue
+            if not self.queue.triggered(queued, self.worker_id, execution.run_info.id):
+                logger.warning(f'The lease of run {execution.run_info.id} was lost while triggering it')
+            started.append(execution)
+            self._hold(execution, queued)
+        return started
+
+    def _start(self, item: Tuple[PipelineExecution, QueuedRun], deadline: float) -> Optional[bool]:
+        ''' None when the run is given back: held back for a free agent until the deadline, or its lease was lost meanwhile '''
+        execution, queued = item
+        try:
+            gate = self.context.agent_pools
+            if gate and not gate.wait_for_room(execution, self.context.canceller, timeout = max(0.0, deadline - time.monotonic())):
+                return None
+            with self._held_lock:
+                lost = queued.id in self._lost
+            if lost:  # another worker may be triggering it already
+                logger.warning(f'The lease of the queued run {queued.id} expired before it was triggered, it is left to the worker holding it now')
+                return None
+            with self.context.triggering:
+                execution.start()
+            return True
+        except PipelineExecutionCancelled:
+            return None
+        except AzurePipelineAPIError as exc:
+            logger.error(f'Failed to start a run on pipeline {execution.runner_name}: {exc}')
+            return False
+
+    def _create_execution(self, queued: QueuedRun) -> PipelineExecution:
+        ''' The executions of the same runner share its strategy, and so its API client '''
+        key = json.dumps(queued.runner, sort_keys = True)
+        strategy = self._strategies.get(key)
+        if strategy is None:
+            strategy = ParallelPipelineExecutionStrategy(RunnerSerializer.deserialize(queued.runner), self.options, self.context)
+            self._strategies[key] = strategy
+        return strategy.create_execution(params = queued.parameters, priority = queued.priority)
+
+    def _hold(self, execution: PipelineExecution, queued: QueuedRun) -> None:
+        with self._held_lock:
+            self._held[execution] = queued
+        self.monitor.track(execution)
+
+    def _complete(self, execution: PipelineExecution) -> None:
+        with self._held_lock:
+            queued = self._held.pop(execution)
+        self._finish(queued, execution.status.result.value)
+
+    def _finish(self, queued: QueuedRun, result: str) -> None:
+        self.results[result] += 1
+        if not self.queue.complete(queued, self.worker_id, result):
+            logger.warning(f'The lease of the queued run {queued.id} was lost, its result is left to the worker holding it now')
+
+    def _keep_leases(self) -> None:
+        ''' Renews the leases three times per lease, whatever the main loop is blocked on '''
+        while not self._stopping.wait(self.lease / 3):
+            try:
+                self._renew_leases()
+            except WorkQueueError as exc:  # e.g. the queue is locked for too long, the next round tries again
+                logger.warning(f'Failed to renew the leases: {exc}')
+
+    def _renew_leases(self) -> None:
+        with self._held_lock:
+            held = list(self._held.values()) + list(self._waiting.values())
+        renewed = self.queue.renew(held, self.worker_id, self.lease)
+        lost = { queued.id for queued in held } - renewed
+        with self._held_lock:
+            self._lost |= lost
+        if lost:
+            logger.warning(f'{len(lost)} lease(s) expired before being renewed, those runs may be monitored by another worker too')
+
+    def _handle_approvals(self, executions: List[PipelineExecution]) -> None:
+        try:
+            self.approvals.handle(executions)
+        except Exception as exc:
+            logger.error(f'Error handling the approvals of {len(executions)} run(s): {exc}')
+        self.monitor.wake_up()
+
+    def _report(self) -> None:
+        if self.results:
+            logger.print_table(
+                title = f'Runs handled by worker {self.worker_id} ({sum(self.results.values())})',
+                columns = ["Result", "Runs"],
+                rows = [ [ result, count ] for result, count in self.results.most_common() ]
+            )
+        counts = self.queue.counts()
+        logger.info(f'Work queue: {counts[WorkQueue.PENDING]} pending, {counts[WorkQueue.CLAIMED]} claimed, {counts[WorkQueue.DONE]} done')
@@ -1,6 +1,8 @@
+import threading
 import time
 
-from typing import Dict, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional, Set
 
 from pipelinerunner.runner.application.model import RunnerModel
 from pipelinerunner.pipeline.application.model import (
@@ -9,8 +11,20 @@ from pipelinerunner.pipeline.application.model import (
     AzurePipelineApproval
 )
 from pipelinerunner.pipeline.infrastructure.pipeline_api import BasePipelineAPI
-from pipelinerunner.pipeline.domain.enums import AzurePipelineRunState
-from pipelinerunner.pipeline.domain.exceptions import PipelineExecutionAlreadyRunning, PipelineExecutionNotStarted, AzurePipelineAPIError
+from pipelinerunner.pipeline.infrastructure.duration_history import DurationHistory
+from pipelinerunner.pipeline.infrastructure.batch_journal import BatchJournal
+from pipelinerunner.pipeline.domain.approval_index import ApprovalIndex
+from pipelinerunner.pipeline.domain.cancellation import RunCanceller
+from pipelinerunner.pipeline.domain.poll_scheduler import PollingPolicy
+from pipelinerunner.pipeline.domain.enums import AzurePipelineRunState, AzurePipelineRunResult
+from pipelinerunner.pipeline.domain.exceptions import (
+    PipelineExecutionAlreadyRunning,
+    PipelineExecutionNotStarted,
+    PipelineExecutionCancelled,
+    AzurePipelineAPIError,
+    AzurePipelineAPITransientError,
+    AzurePipelineAPIUnavailableError
+)
 from pipelinerunner.shared.util.logger import BetterLogger
 
 
@@ -18,38 +32,160 @@ logger = BetterLogger.get_logger(__name__)
 
 
 class PipelineExecution:
-    TIME_IN_SECONDS_TO_CHECK_STATUS = 10
+    STATUS_POLLING = PollingPolicy(initial_interval = 5, max_interval = 30)
+    APPROVAL_POLLING = PollingPolicy(initial_interval = 2, min_interval = 1, max_interval = 5)
+    TRIGGER_BACKOFF = PollingPolicy(initial_interval = 2, min_interval = 1, max_interval = 30, backoff_factor = 2)
+    MAX_TRIGGER_ATTEMPTS = 4
+    CLOCK_SKEW_MARGIN = timedelta(minutes = 1)  # between this machine and Azure when looking for runs created by us
+
+    CLAIM_RETENTION = timedelta(hours = 1)  # the lookup after an ambiguous trigger only sees the runs created since the trigger began
+
+    _claimed_run_ids: Dict[str, float] = dict()  # run id -> time.monotonic() it was claimed by some execution of this process
+    _claimed_lock = threading.Lock()
 
     def __init__(self,
                  runner: RunnerModel,
                  params: Dict,
-                 pipeline_api: BasePipelineAPI):
+                 pipeline_api: BasePipelineAPI,
+                 approval_index: Optional[ApprovalIndex] = None,
+                 canceller: Optional[RunCanceller] = None,
+                 journal: Optional[BatchJournal] = None,
+                 key: Optional[str] = None,
+                 priority: int = 0):
         self.params = params
+        self.key = key  # "<runner>/<position>", identifies the run in the journal of the batch
         self.runner_name = runner.pipeline_name
+        self.project_name = runner.project_name
+        self.definition_id = runner.definition_id
+        self.priority = priority  # higher ones are started first
         self.api = pipeline_api
+        self.approval_index = approval_index
+        self.canceller = canceller
+        self.journal = journal
+        self.resumed = False  # re-attached to a run triggered by a previous (interrupted) invocation
         self.run_info: AzurePipelineRunInfo = None
+        self.status: Optional[AzurePipelineRunStatus] = None  # last known status
+        self.started_at: Optional[float] = None
+        self.expected_duration: Optional[float] = None  # in seconds, when known
+        self._wakeup = threading.Event()
 
     def start(self) -> None:
+        if self.resumed:
+            return
         if self.run_info:
             raise PipelineExecutionAlreadyRunning(
                 f'Run {self.run_info.id} is already running!'
             )
-        self.run_info: AzurePipelineRunInfo = self.api.trigger_pipeline(self.params)
+        if self._is_cancelling():
+            raise PipelineExecutionCancelled(f'The batch is being cancelled, pipeline {self.runner_name} is not triggered')
+        self.run_info: AzurePipelineRunInfo = self._trigger()
+        self.claim_run_id(self.run_info.id)
+        self.started_at = time.monotonic()
+        if self.journal and self.key:
+            self.journal.triggered(self.key, self.run_info.id)
         logger.info(f'Run {self.run_info.id} started successfully')
+        if self.canceller:
+            self.canceller.track(self.run_info.id, self.runner_name, self.api)
+
+    def attach(self, run_id: str) -> None:
+        ''' Takes over a run triggered by a previous invocation, so start() does not trigger it again '''
+        self.run_info = AzurePipelineRunInfo(
+            id = str(run_id),
+            status = AzurePipelineRunStatus(state = AzurePipelineRunState.IN_PROGRESS, result = AzurePipelineRunResult.UNKNOWN)
+        )
+        self.claim_run_id(self.run_info.id)
+        self.started_at = time.monotonic()  # the durations of resumed runs are not reliable, so they are not recorded
+        self.resumed = True
+        if self.canceller:
+            self.canceller.track(self.run_info.id, self.runner_name, self.api)
+
+    def _trigger(self) -> AzurePipelineRunInfo:
+        '''
+        Triggers with bounded retries. After an ambiguous failure (e.g. a timeout) the run may exist anyway,
+        so the recent runs are checked before POSTing again and an agent is never booked twice.
+        '''
+        since = datetime.now(timezone.utc) - self.CLOCK_SKEW_MARGIN
+        maybe_triggered = False
+        interval: Optional[float] = None
+        attempt = 0
+        on_hold = False
+        while True:
+            try:
+                if maybe_triggered:
+                    run_info = self.api.find_triggered_run(self.params, since = since, exclude = self.claimed_run_ids())
+                    if run_info:
+                        logger.info(f'Run {run_info.id} was created by a previous attempt, no need to trigger it again')
+                        return run_info
+                    maybe_triggered = False
+                return self.api.trigger_pipeline(self.params)
+            except AzurePipelineAPIUnavailableError:
+                # Nothing was sent, so it does not count as an attempt. The trigger is queued until Azure recovers.
+                if not on_hold:
+                    logger.warning(f'Azure DevOps is unavailable, the trigger of pipeline {self.runner_name} is on hold')
+                on_hold = True
+                self.api.wait_until_available()
+                continue
+            except AzurePipelineAPITransientError as exc:
+                maybe_triggered = maybe_triggered or exc.ambiguous
+                error = exc
+            except AzurePipelineAPIError as exc:
+                if not maybe_triggered:  # the trigger itself was refused
+                    raise
+                error = exc  # the lookup failed, so it is not safe to POST yet
+
+            attempt += 1
+            if attempt == self.MAX_TRIGGER_ATTEMPTS:
+                raise error
+            interval = self.TRIGGER_BACKOFF.next_interval(interval, changed = False)
+            logger.warning(f'Attempt {attempt}/{self.MAX_TRIGGER_ATTEMPTS} to trigger pipeline {self.runner_name} failed, retrying in {interval:.0f}s: {error}')
+            self._sleep(self.TRIGGER_BACKOFF.with_jitter(interval))
+
+    @classmethod
+    def claimed_run_ids(cls) -> Set[str]:
+        with cls._claimed_lock:
+            cls._forget_old_claims()
+            return set(cls._claimed_run_ids)
+
+    @classmethod
+    def claim_run_id(cls, run_id: str) -> None:
+        with cls._claimed_lock:
+            cls._forget_old_claims()
+            cls._claimed_run_ids[str(run_id)] = time.monotonic()
+
+    @classmethod
+    def _forget_old_claims(cls) -> None:
+        ''' A long-lived process (e.g. the daemon) would otherwise keep the id of every run it ever triggered '''
+        oldest = time.monotonic() - cls.CLAIM_RETENTION.total_seconds()
+        cls._claimed_run_ids = { run_id: claimed_at for run_id, claimed_at in cls._claimed_run_ids.items() if claimed_at >= oldest }
 
     def wait_until_it_completes(self) -> None:
         if not self.run_info:
             raise PipelineExecutionNotStarted('You must start the pipeline run before wait it for completing!')
         logger.info(f'Waiting for run {self.run_info.id } to complete...')
 
+        interval: Optional[float] = None
+        changed = True
         while True:
-            time.sleep(self.TIME_IN_SECONDS_TO_CHECK_STATUS)
-            status: AzurePipelineRunStatus = self.get_current_status()
+            interval = self.STATUS_POLLING.next_interval(interval, changed, self._remaining_time())
+            self._sleep(self.STATUS_POLLING.with_jitter(interval))
+            previous = self.status
+            try:
+                status: AzurePipelineRunStatus = self.get_current_status()
+            except AzurePipelineAPIUnavailableError:
+                self.api.wait_until_available()  # polling is suspended and the last known status is kept
+                changed = False
+                continue
+            except AzurePipelineAPIError as exc:
+                logger.warning(f'Failed to get the status of run {self.run_info.id}, retrying: {exc}')
+                changed = False
+                continue
+            changed = status != previous
             logger.debug(f'Current status of run {self.run_info.id}: {status}')
 
             if status.is_running():
                 continue
 
+            self._completed()
             if not status.is_completed():
                 logger.error(f'Run {self.run_info.id} on pipeline {self.runner_name} ended abnormally with state = {status.state.name}')
                 return
@@ -64,15 +200,23 @@ class PipelineExecution:
     def get_current_status(self) -> AzurePipelineRunStatus:
         if not self.run_info:
             raise PipelineExecutionNotStarted('You must start the pipeline run before check its status')
-        return self.api.get_run_status(run_id = self.run_info.id)
+        self.status = self.api.get_run_status(run_id = self.run_info.id)
+        return self.status
 
-    def is_finished(self) -> bool:
-        status: AzurePipelineRunStatus = self.get_current_status()
+    def update_status(self, status: AzurePipelineRunStatus) -> None:
+        ''' Feeds a status resolved somewhere else (e.g. by a batched poll) '''
+        self.status = status
+
+    def is_finished(self, refresh: bool = True) -> bool:
+        if refresh or self.status is None:
+            self.get_current_status()
+        status: AzurePipelineRunStatus = self.status
         if status.is_completed():
+            self._completed()
             if status.is_successful():
-                logger.success(f'Run {self.run_info.id} finished successfully.')
+                logger.success(f'Run {self.run_info.id} on pipeline {self.runner_name} finished successfully.')
                 return True
-            logger.error(f'Run {self.run_info.id} finished with result = {status.result.name}.')
+            logger.error(f'Run {self.run_info.id} on pipeline {self.runner_name} finished with result = {status.result.name}.')
             return True
         return False
 
@@ -81,50 +225,132 @@ class PipelineExecution:
             raise PipelineExecutionNotStarted('You must start the pipeline run before checking for approvals!')
 
         start_time = time.time()
-        check_interval = 2
-
-        # The timeout and retry logic is needed here due to delay on Azure API
-        while (time.time() - start_time) < timeout:
-            status = self.get_current_status()        
-            if status.state == AzurePipelineRunState.IN_PROGRESS:
-                logger.debug(f'Checking for approval in run {self.run_info.id}...')
-                approval: Optional[AzurePipelineApproval] = self.api.get_approval_status(run_id = self.run_info.id)
-                
-                if approval and approval.status == 'pending':
-                    logger.info(f'Run {self.run_info.id} needs approval')
-                    return True
-                
-                if time.time() - start_time > 10:
-                    logger.debug(f'Run {self.run_info.id} does not need approval')
+        interval: Optional[float] = None
+        unsubscribe = self._subscribe_to_approval(lambda approval: self.wake_up())
+
+        try:
+            # The timeout and retry logic is needed here due to delay on Azure API
+            while (time.time() - start_time) < timeout:
+                if self._is_cancelling():
                     return False
+                status = self.get_current_status()        
+                if status.state == AzurePipelineRunState.IN_PROGRESS:
+                    logger.debug(f'Checking for approval in run {self.run_info.id}...')
+                    approval: Optional[AzurePipelineApproval] = self._get_approval()
+                    
+                    if approval and approval.status == 'pending':
+                        logger.info(f'Run {self.run_info.id} needs approval')
+                        return True
+                    
+                    if time.time() - start_time > 10:
+                        logger.debug(f'Run {self.run_info.id} does not need approval')
+                        return False
 
-            if status.state == AzurePipelineRunState.COMPLETED:
-                logger.debug(f'Run {self.run_info.id} already completed, no approval needed')
-                return False
-            
-            time.sleep(check_interval)
+                if status.state == AzurePipelineRunState.COMPLETED:
+                    logger.debug(f'Run {self.run_info.id} already completed, no approval needed')
+                    return False
+                
+                interval = self.APPROVAL_POLLING.next_interval(interval, changed = False)
+                self._sleep(interval)  # woken up earlier when the approval index sees a change
 
-        logger.warning(f'Timeout checking approval for run {self.run_info.id}, assuming no approval needed')
-        return False
+            logger.warning(f'Timeout checking approval for run {self.run_info.id}, assuming no approval needed')
+            return False
+        finally:
+            unsubscribe()
 
     def approve(self) -> bool:
+        approval: Optional[AzurePipelineApproval] = self.pending_approval()
+        if not approval:
+            return True
+        
+        try:
+            self.api.approve_run(run_id = self.run_info.id, approval_id = approval.id)        
+            return self.record_approval(approved = True)
+
+        except AzurePipelineAPIError as exc:
+            logger.error(str(exc))
+            return False
+
+    def pending_approval(self) -> Optional[AzurePipelineApproval]:
+        ''' The approval still to be given to this run, if any '''
         if not self.run_info:
             raise PipelineExecutionNotStarted('You must start the pipeline run before approve it!')
         
-        approval: Optional[AzurePipelineApproval] = self.api.get_approval_status(run_id = self.run_info.id)
+        approval: Optional[AzurePipelineApproval] = self._get_approval()
         if not approval:
             logger.debug(f'There is no need to approve the run {self.run_info.id}')
-            return True
+            return None
 
         if approval.status != 'pending':
             logger.debug(f'Approval for run {self.run_info.id} is not pending (status: {approval.status})')
-            return True
-        
-        try:
-            self.api.approve_run(run_id = self.run_info.id, approval_id = approval.id)        
+            return None
+        return approval
+
+    def record_approval(self, approved: bool) -> bool:
+        ''' Outcome of an approval given on behalf of this run (e.g. in bulk) '''
+        if approved:
+            if self.journal and self.key:
+                self.journal.approved_run(self.key, self.run_info.id)
             logger.success(f'Run {self.run_info.id} was successfully approved!')
-            return True
+        else:
+            logger.error(f'Run {self.run_info.id} was NOT approved')
+        return approved
+
+    def expected_end(self) -> Optional[float]:
+        ''' A time.monotonic() timestamp, when the expected duration is known '''
+        if self.started_at is None or self.expected_duration is None:
+            return None
+        return self.started_at + self.expected_duration
 
+    def record_duration(self, history: DurationHistory) -> None:
+        ''' Only successful runs teach something about how long the next ones will take '''
+        if self.resumed or self.started_at is None or self.status is None or not self.status.is_successful():
+            return
+        history.record(self.project_name, self.definition_id, self.params, time.monotonic() - self.started_at)
+
+    def cancel(self) -> bool:
+        if not self.run_info:
+            raise PipelineExecutionNotStarted('You must start the pipeline run before cancel it!')
+        try:
+            self.api.cancel_run(run_id = self.run_info.id)
+            logger.warning(f'Run {self.run_info.id} on pipeline {self.runner_name} cancelled')
+            return True
         except AzurePipelineAPIError as exc:
             logger.error(str(exc))
             return False
+
+    def _completed(self) -> None:
+        ''' The run is no longer in flight, with fail-fast a failure cancels the others '''
+        if self.journal and self.key and self.key not in self.journal.completed:
+            self.journal.completed_run(self.key, self.run_info.id, self.status.result.value)
+        if not self.canceller:
+            return
+        if self.status.is_successful():
+            self.canceller.untrack(self.run_info.id)
+            return
+        self.canceller.run_failed(self.run_info.id, self.runner_name)
+
+    def _is_cancelling(self) -> bool:
+        return self.canceller is not None and self.canceller.is_cancelling()
+
+    def _remaining_time(self) -> Optional[float]:
+        expected_end = self.expected_end()
+        return expected_end - time.monotonic() if expected_end is not None else None
+
+    def wake_up(self) -> None:
+        ''' Interrupts the current wait so the run is checked right away '''
+        self._wakeup.set()
+
+    def _sleep(self, seconds: float) -> None:
+        self._wakeup.wait(seconds)
+        self._wakeup.clear()
+
+    def _get_approval(self) -> Optional[AzurePipelineApproval]:
+        if self.approval_index:
+            return self.approval_index.get(definition_id = self.definition_id, run_id = self.run_info.id)
+        return self.api.get_approval_status(run_id = self.run_info.id)
+
+    def _subscribe_to_approval(self, listener: Callable[[AzurePipelineApproval], None]) -> Callable[[], None]:
+        if not self.approval_index:
+            return lambda: None
+        return self.approval_index.subscribe(definition_id = self.definition_id, run_id = self.run_info.id, listener = listener)
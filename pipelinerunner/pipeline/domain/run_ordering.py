@@ -0,0 +1,112 @@
+import heapq
+import statistics
+
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+from pipelinerunner.runner.application.model import RunnerModel
+from pipelinerunner.pipeline.domain.enums import RunOrder
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+T = TypeVar("T")
+
+
+@dataclass(eq = False)
+class PlannedRun:
+    ''' A run of the batch before its execution is created, enough to report the order and predict the makespan '''
+    runner: RunnerModel
+    index: int
+    priority: int
+    expected_duration: Optional[float]
+
+    @property
+    def runner_name(self) -> str:
+        return self.runner.pipeline_name
+
+
+class RunOrderer:
+    '''
+    Orders the pending runs by priority (higher first) and then by expected duration.
+    Shortest first lowers the mean completion time (results come sooner), longest first lowers the makespan
+    when the runs are throttled (the long ones do not end up alone at the tail).
+    A run without history is assumed to take as long as the median of the others.
+    '''
+    REPORTED_RUNS = 20
+
+    def __init__(self, order: RunOrder):
+        self.order = order
+
+    def sort(self, items: List[T], execution_of: Callable[[T], object]) -> List[T]:
+        ''' Stable, so the file order is kept among runs with the same priority and expected duration '''
+        if self.order == RunOrder.FILE:
+            return sorted(items, key = lambda item: -execution_of(item).priority)
+        fallback = self.fallback_duration([ execution_of(item) for item in items ])
+        sign = 1 if self.order == RunOrder.SHORTEST_FIRST else -1
+        return sorted(items, key = lambda item: (
+            -execution_of(item).priority,
+            sign * self.expected(execution_of(item), fallback)
+        ))
+
+    @staticmethod
+    def fallback_duration(executions: List[object]) -> float:
+        known = [ e.expected_duration for e in executions if e.expected_duration is not None ]
+        return statistics.median(known) if known else 0.0
+
+    @staticmethod
+    def expected(execution: object, fallback: float) -> float:
+        return execution.expected_duration if execution.expected_duration is not None else fallback
+
+    def report(self, executions: List[object], makespan: Optional[float]) -> None:
+        ''' The order the runs will be started in and how long the whole batch should take '''
+        fallback = self.fallback_duration(executions)
+        unknown = sum(1 for e in executions if e.expected_duration is None)
+        rows = [
+            [
+                position,
+                e.runner_name,
+                e.priority,
+                f'{e.expected_duration:.0f}s' if e.expected_duration is not None else f'~{fallback:.0f}s (no history)'
+            ]
+            for position, e in enumerate(executions[:self.REPORTED_RUNS], 1)
+        ]
+        logger.print_table(
+            title = f'Run order: {self.order.value} ({len(executions)} run(s))',
+            columns = ["#", "Pipeline", "Priority", "Expected"],
+            rows = rows
+        )
+        if len(executions) > self.REPORTED_RUNS:
+            logger.info(f'... and {len(executions) - self.REPORTED_RUNS} more run(s)')
+        if makespan is None:
+            logger.info('Predicted makespan: unknown, none of these pipelines has history yet')
+            return
+        note = f' ({unknown} run(s) without history estimated as {fallback:.0f}s)' if unknown else ''
+        logger.info(f'Predicted makespan: {makespan:.0f}s{note}')
+
+
+def simulate_makespan(items: List[T],
+                      duration_of: Callable[[T], float],
+                      try_acquire: Callable[[T], bool],
+                      release: Callable[[T], None]) -> float:
+    '''
+    Replays a sliding window: the items start in order as soon as the caps allow it, each one taking its expected duration.
+    The caps are checked with the given acquire/release functions, which must start from an empty window.
+    '''
+    pending = list(items)
+    running: List[Tuple[float, int, T]] = list()  # (end, tiebreaker, item)
+    now = 0.0
+    sequence = 0
+    while pending or running:
+        for item in list(pending):
+            if try_acquire(item):
+                pending.remove(item)
+                heapq.heappush(running, (now + duration_of(item), sequence, item))
+                sequence += 1
+        if not running:  # nothing fits even in an empty window
+            break
+        now, _, item = heapq.heappop(running)
+        release(item)
+    return now
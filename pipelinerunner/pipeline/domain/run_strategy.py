@@ -1,13 +1,23 @@
 import time
 
 from abc import ABC, abstractmethod
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from pipelinerunner.runner.application.model import RunnerModel
-from pipelinerunner.pipeline.application.model import ExecutionOptions
+from pipelinerunner.pipeline.application.model import ExecutionOptions, AzurePipelineApproval
 from pipelinerunner.pipeline.domain.run import PipelineExecution
+from pipelinerunner.pipeline.domain.batch_context import BatchContext
+from pipelinerunner.pipeline.domain.run_ordering import RunOrderer
+from pipelinerunner.pipeline.domain.status_poller import RunStatusPoller
+from pipelinerunner.pipeline.domain.poll_scheduler import PollingPolicy, PollScheduler
+from pipelinerunner.pipeline.domain.exceptions import (
+    AzurePipelineAPIError,
+    AzurePipelineAPIUnavailableError,
+    PipelineExecutionCancelled
+)
 from pipelinerunner.pipeline.infrastructure.pipeline_api import BasePipelineAPI
+from pipelinerunner.pipeline.infrastructure.duration_history import DurationHistory
 from pipelinerunner.pipeline.infrastructure.factory_pipeline_api import PipelineAPIFactory
 from pipelinerunner.shared.util.logger import BetterLogger
 
@@ -16,21 +26,52 @@ logger = BetterLogger.get_logger(__name__)
 
 
 class BasePipelineExecutionStrategy(ABC):
-    def __init__(self, runner: RunnerModel, options: ExecutionOptions):
+    def __init__(self, runner: RunnerModel, options: ExecutionOptions, context: Optional[BatchContext] = None):
         self.runner = runner
         self.options = options
+        self.context = context or BatchContext.create(options)
         self._pipeline_api: Optional[BasePipelineAPI] = None
 
-    def _create_pipeline_execution(self, params: Dict) -> PipelineExecution:
-        return PipelineExecution(
+    def create_executions(self) -> List[PipelineExecution]:
+        ''' One (not started) execution per run of the runner, in run order '''
+        return [
+            self._create_pipeline_execution(params = run.parameters, priority = run.priority, position = idx)
+            for idx, run in enumerate(self.runner.runs, 1)
+        ]
+
+    def create_execution(self, params: Dict, priority: int = 0, position: Optional[int] = None) -> PipelineExecution:
+        ''' A single (not started) execution, for a run that does not come from the runner itself (e.g. the work queue) '''
+        return self._create_pipeline_execution(params = params, priority = priority, position = position)
+
+    def _create_pipeline_execution(self, params: Dict, priority: int = 0, position: Optional[int] = None) -> PipelineExecution:
+        api = self._get_or_create_api()
+        key = f'{self.runner.name}/{position}' if position is not None else None
+        execution = PipelineExecution(
             runner = self.runner,
             params = params,
-            pipeline_api = self._get_or_create_api()
+            pipeline_api = api,
+            approval_index = self.context.approval_indexes.get(api),
+            canceller = self.context.canceller,
+            journal = self.context.journal,
+            key = key,
+            priority = priority
         )
+        execution.expected_duration = self.context.duration_history.expected(
+            self.runner.project_name, self.runner.definition_id, params
+        )
+        run_id = self.context.journal.run_id_of(key) if key else None
+        if run_id:  # resuming a batch, this run was already triggered
+            execution.attach(run_id)
+            logger.info(f'Run {key} re-attached to run {run_id} of pipeline {self.runner.pipeline_name}')
+        return execution
     
     def _get_or_create_api(self) -> BasePipelineAPI:
         if self._pipeline_api is None:
-            self._pipeline_api = PipelineAPIFactory.create(runner = self.runner, dry_run = self.options.dry_run)
+            self._pipeline_api = PipelineAPIFactory.create(
+                runner = self.runner,
+                dry_run = self.options.dry_run,
+                session_pool = self.context.session_pool
+            )
         return self._pipeline_api
 
     @abstractmethod
@@ -38,8 +79,8 @@ class BasePipelineExecutionStrategy(ABC):
 
 
 class SequentialPipelineExecutionStrategy(BasePipelineExecutionStrategy):
-    def __init__(self, runner: RunnerModel, options: ExecutionOptions):
-        super().__init__(runner, options)
+    def __init__(self, runner: RunnerModel, options: ExecutionOptions, context: Optional[BatchContext] = None):
+        super().__init__(runner, options, context)
 
     def run(self):
         logger.info(
@@ -50,16 +91,27 @@ class SequentialPipelineExecutionStrategy(BasePipelineExecutionStrategy):
 
         total_of_runs = len(self.runner.runs)
         for idx, run in enumerate(self.runner.runs, 1):
+            if self.context.canceller.is_cancelling():
+                logger.warning(f'The batch was cancelled, {total_of_runs - idx + 1} run(s) on pipeline {self.runner.pipeline_name} not started')
+                return
             logger.info(f'Processing run {idx}/{total_of_runs} for pipeline {self.runner.pipeline_name}')
 
-            execution: PipelineExecution = self._create_pipeline_execution(params = run.parameters)
-            execution.start()
+            execution: PipelineExecution = self._create_pipeline_execution(params = run.parameters, priority = run.priority, position = idx)
+            try:
+                self.context.start(execution)
+            except PipelineExecutionCancelled:
+                logger.warning(f'The batch was cancelled, {total_of_runs - idx + 1} run(s) on pipeline {self.runner.pipeline_name} not started')
+                return
 
             if execution.it_needs_approval() and self.options.auto_approve:    # it may take some seconds
                 execution.approve()
 
             if self.options.wait:
                 execution.wait_until_it_completes()
+                execution.record_duration(self.context.duration_history)
+                if self.options.fail_fast and not execution.status.is_successful():
+                    logger.warning(f'Run {idx}/{total_of_runs} failed, the remaining {total_of_runs - idx} run(s) are not started (fail-fast)')
+                    return
 
         logger.info(
             f'All sequential runs on pipeline "{self.runner.pipeline_name}" '
@@ -68,25 +120,13 @@ class SequentialPipelineExecutionStrategy(BasePipelineExecutionStrategy):
 
 
 class ParallelPipelineExecutionStrategy(BasePipelineExecutionStrategy):
-    def __init__(self, runner: RunnerModel, options: ExecutionOptions):
-        super().__init__(runner, options)
+    def __init__(self, runner: RunnerModel, options: ExecutionOptions, context: Optional[BatchContext] = None):
+        super().__init__(runner, options, context)
         self.approvals = ApprovalHandler(auto_approve = options.auto_approve)
-        self.monitor = ExecutionMonitor()
+        self.monitor = ExecutionMonitor(poller = self.context.status_poller, history = self.context.duration_history)
 
     def run(self):
-        logger.info(
-            f'Starting at once {len(self.runner.runs)} runs on pipeline '
-            f'"{self.runner.project_name}/{self.runner.pipeline_name}" '
-            f'using branch "{self.runner.branch_name}" (definition_id = {self.runner.definition_id})'
-        )
-        executions = list()
-        total_of_runs = len(self.runner.runs)
-        for idx, run in enumerate(self.runner.runs, 1):  # starting all runs one by one
-            logger.info(f'Processing run {idx}/{total_of_runs} for pipeline {self.runner.pipeline_name}')
-            execution: PipelineExecution = self._create_pipeline_execution(params = run.parameters)
-            execution.start()
-            executions.append(execution)
-            
+        executions = self.start_all()
         if not self.options.wait:
             logger.success('All pipelines have been started (no waiting)! Check manually their status.')
             return
@@ -99,6 +139,120 @@ class ParallelPipelineExecutionStrategy(BasePipelineExecutionStrategy):
             f'(definition_id = {self.runner.definition_id}) completed!'
         )
 
+    def start_all(self) -> List[PipelineExecution]:
+        '''
+        Triggers the runs concurrently (up to trigger_concurrency at once, and within the cap of concurrent triggers shared by the batch).
+        The started executions come back in run order, the failed ones are left out.
+        '''
+        logger.info(
+            f'Starting at once {len(self.runner.runs)} runs on pipeline '
+            f'"{self.runner.project_name}/{self.runner.pipeline_name}" '
+            f'using branch "{self.runner.branch_name}" (definition_id = {self.runner.definition_id})'
+        )
+        executions = RunOrderer(self.options.run_order).sort(self.create_executions(), execution_of = lambda e: e)
+        return self.start(executions)
+
+    def start(self, executions: List[PipelineExecution], first_idx: int = 1) -> List[PipelineExecution]:
+        ''' Triggers the given executions concurrently, first_idx being the position of the first one among the runs of the runner '''
+        if not executions:
+            return list()
+        fan_out = min(self.options.trigger_concurrency, len(executions))
+
+        first_trigger_at = time.monotonic()
+        with ThreadPoolExecutor(max_workers = fan_out, thread_name_prefix = 'trigger') as executor:
+            futures = [
+                executor.submit(self._start, idx, execution)
+                for idx, execution in enumerate(executions, first_idx)
+            ]
+            started = [ execution for execution, future in zip(executions, futures) if future.result() ]
+        elapsed = time.monotonic() - first_trigger_at
+
+        logger.info(
+            f'{len(started)}/{len(executions)} run(s) on pipeline {self.runner.pipeline_name} triggered '
+            f'in {elapsed:.2f}s from first to last trigger (fan-out = {fan_out})'
+        )
+        return started
+
+    def _start(self, idx: int, execution: PipelineExecution) -> bool:
+        total_of_runs = len(self.runner.runs)
+        logger.info(f'Processing run {idx}/{total_of_runs} for pipeline {self.runner.pipeline_name}')
+        try:
+            self.context.start(execution)
+            return True
+        except PipelineExecutionCancelled:
+            logger.debug(f'Run {idx}/{total_of_runs} on pipeline {self.runner.pipeline_name} not started, the batch was cancelled')
+            return False
+        except AzurePipelineAPIError as exc:
+            logger.error(f'Failed to start run {idx}/{total_of_runs} on pipeline {self.runner.pipeline_name}: {exc}')
+            return False
+
+
+class WavePipelineExecutionStrategy(ParallelPipelineExecutionStrategy):
+    '''
+    Canary rollout of the runs of a runner: a first small wave, then bigger ones, then the rest.
+    The next wave only starts when enough runs of the previous one succeeded (a run that failed to start counts as failed),
+    so a parameter set that is broken for everyone costs a few runs instead of all of them.
+    '''
+    def run(self):
+        if not self.options.wait:
+            logger.warning('The waves mode needs to wait for each wave to know whether to go on, so --no-wait is ignored')
+        executions = self.create_executions()
+        waves = self.split_in_waves(executions, self.options.wave_sizes)
+        logger.info(
+            f'Starting {len(executions)} runs on pipeline "{self.runner.project_name}/{self.runner.pipeline_name}" '
+            f'in {len(waves)} wave(s) of {", ".join(str(len(w)) for w in waves)} run(s) '
+            f'(success ratio to go on = {self.options.wave_success_ratio:.0%})'
+        )
+
+        first_idx = 1
+        for number, wave in enumerate(waves, 1):
+            if self.context.canceller.is_cancelling():
+                logger.warning(f'The batch was cancelled, waves {number} to {len(waves)} of pipeline {self.runner.pipeline_name} not started')
+                return
+            logger.info(f'Wave {number}/{len(waves)} of pipeline {self.runner.pipeline_name}: {len(wave)} run(s)')
+            started = self.start(wave, first_idx = first_idx)
+            first_idx += len(wave)
+            if started:
+                self.approvals.handle(started)
+                self._wait_for(started)
+
+            succeeded = sum(1 for e in started if e.status is not None and e.status.is_successful())
+            ratio = succeeded / len(wave)
+            summary = f'Wave {number}/{len(waves)} of pipeline {self.runner.pipeline_name}: {succeeded}/{len(wave)} run(s) succeeded ({ratio:.0%})'
+            if number == len(waves):
+                logger.info(summary)
+                break
+            if ratio < self.options.wave_success_ratio:
+                remaining = sum(len(w) for w in waves[number:])
+                logger.error(f'{summary}, below {self.options.wave_success_ratio:.0%}. The remaining {remaining} run(s) are not started.')
+                return
+            logger.success(summary)
+
+        logger.info(
+            f'All waves on pipeline "{self.runner.pipeline_name}" '
+            f'(definition_id = {self.runner.definition_id}) completed!'
+        )
+
+    @staticmethod
+    def split_in_waves(executions: List[PipelineExecution], sizes: Tuple[int, ...]) -> List[List[PipelineExecution]]:
+        waves = list()
+        position = 0
+        for size in sizes:
+            if position >= len(executions):
+                break
+            waves.append(executions[position:position + size])
+            position += size
+        if position < len(executions):
+            waves.append(executions[position:])  # the rest
+        return waves
+
+    def _wait_for(self, executions: List[PipelineExecution]) -> None:
+        ''' Like monitor(), but without a progress bar, as the waves of several runners are monitored at the same time '''
+        for execution in executions:
+            self.monitor.track(execution)
+        while len(self.monitor) and not self.context.canceller.is_cancelling():
+            self.monitor.poll_due()
+
 
 class ApprovalHandler:
     def __init__(self, auto_approve: bool = True):
@@ -112,13 +266,41 @@ class ApprovalHandler:
         if not self.auto_approve:
             logger.warning(f'{len(needing)} run(s) waiting manual approval')
             return
-        approved = sum(1 for e in needing if e.approve())
+        approved = self._approve_in_bulk(needing)
         pending = len(needing) - approved
         if approved:
             logger.success(f'{approved} run(s) automatically approved')
         if pending:
             logger.warning(f'{pending} run(s) NOT approved. Manual intervention required.')
 
+    def _approve_in_bulk(self, executions: List[PipelineExecution]) -> int:
+        ''' One bulk request per project (chunked by the API) instead of one request per run '''
+        approved = 0
+        by_project: Dict[str, List[Tuple[PipelineExecution, AzurePipelineApproval]]] = dict()
+        for execution in executions:
+            try:
+                approval = execution.pending_approval()
+            except AzurePipelineAPIError as exc:
+                logger.error(f'Error getting the approval of run {execution.run_info.id}: {exc}')
+                continue
+            if approval is None:  # nothing left to approve
+                approved += 1
+                continue
+            by_project.setdefault(execution.api.runner.project_name, list()).append((execution, approval))
+
+        for pending in by_project.values():
+            api = pending[0][0].api  # approvals are project-wide, any api of the project will do
+            try:
+                results = api.approve_many([ approval for _, approval in pending ])
+            except AzurePipelineAPIError as exc:
+                logger.error(str(exc))
+                results = dict()
+            approved += sum(
+                1 for execution, approval in pending
+                if execution.record_approval(approved = results.get(approval.id, False))
+            )
+        return approved
+
     def _check_approvals_in_parallel(self, executions: List[PipelineExecution]) -> List[PipelineExecution]:
         needing = []
         max_workers = min(len(executions), 10)
@@ -148,20 +330,68 @@ class ApprovalHandler:
             return False
 
 class ExecutionMonitor:
-    CHECK_INTERVAL = 5
+    POLLING = PollingPolicy(initial_interval = 5, max_interval = 30)
+
+    def __init__(self,
+                 poller: Optional[RunStatusPoller] = None,
+                 policy: PollingPolicy = POLLING,
+                 history: Optional[DurationHistory] = None):
+        self.poller = poller or RunStatusPoller()
+        self.history = history
+        self.scheduler: PollScheduler[PipelineExecution] = PollScheduler(policy)
 
     def monitor(self, executions: List[PipelineExecution]):
         logger.info(f'Waiting {len(executions)} run(s) to complete')
         total = len(executions)
+        for execution in executions:
+            self.track(execution)
+
         with logger.progress("Monitoring pipeline executions") as progress:
             task = progress.add_task("Active runs", total = total, completed = 0)
 
-            while executions:
-                time.sleep(self.CHECK_INTERVAL)
-                finished = [ e for e in executions if e.is_finished() ]
-
-                for e in finished:
-                    executions.remove(e)
-                    progress.update(task, completed = total - len(executions))
+            while len(self.scheduler):
+                if self.poll_due():
+                    progress.update(task, completed = total - len(self.scheduler))
 
             progress.update(task, completed=total)
+
+    def track(self, execution: PipelineExecution) -> None:
+        ''' Starts monitoring a run, it can be called while other runs are already being monitored '''
+        self.scheduler.add(execution, expected_end = execution.expected_end())
+
+    def poll_due(self) -> List[PipelineExecution]:
+        ''' Waits for the next due polls, resolves them and returns the runs that finished meanwhile '''
+        due = self.scheduler.wait_due()  # only the runs whose poll is due, each one at its own pace
+        if not due:
+            return list()
+        previous = { e: e.status for e in due }
+        try:
+            self.poller.poll(due)  # one batched query per project instead of one per run
+        except AzurePipelineAPIUnavailableError:
+            logger.debug(f'Azure DevOps is unavailable, polling of {len(due)} run(s) suspended')
+            for e in due:
+                self.scheduler.reschedule(e, changed = False)
+            return list()
+        except AzurePipelineAPIError as exc:
+            logger.warning(f'Failed to poll {len(due)} run(s), keeping their last known status: {exc}')
+            for e in due:
+                self.scheduler.reschedule(e, changed = False)
+            return list()
+
+        finished = list()
+        for e in due:
+            if e.is_finished(refresh = False):
+                self.scheduler.remove(e)
+                if self.history is not None:
+                    e.record_duration(self.history)
+                finished.append(e)
+                continue
+            self.scheduler.reschedule(e, changed = e.status != previous[e])
+        return finished
+
+    def __len__(self) -> int:
+        return len(self.scheduler)
+
+    def wake_up(self):
+        ''' Interrupts the current wait so the due runs are checked right away '''
+        self.scheduler.wake()
@@ -0,0 +1,153 @@
+import hashlib
+import heapq
+import json
+import statistics
+
+from collections import Counter
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional, Set, Tuple
+
+from pipelinerunner.runner.application.model import RunnerModel
+from pipelinerunner.pipeline.domain.dependency_graph import DependencyGraph, DependencyNode
+from pipelinerunner.pipeline.domain.enums import ShardBy
+from pipelinerunner.pipeline.infrastructure.duration_history import DurationHistory
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+@dataclass
+class ShardUnit:
+    ''' Runs that must go to the same shard: a single run, or runs linked by depends_on '''
+    nodes: List[DependencyNode]
+    digest: str
+    weight: float = 1.0
+
+
+class BatchSharder:
+    '''
+    Splits a batch in shards without any coordination: every agent computes the same plan from the same file
+    and keeps its own part. Runs are identified by a hash of what they are (runner, pipeline and parameters),
+    not by their position, so reordering the file does not move them to another shard.
+    Runs linked by depends_on always go to the same shard. Balancing by duration needs the same duration history
+    on every agent (e.g. restored from a CI cache), the plan id logged by each agent must be the same.
+    '''
+    def __init__(self, index: int, total: int, by: ShardBy = ShardBy.COUNT, history: Optional[DurationHistory] = None):
+        if not 1 <= index <= total:
+            raise ValueError(f'Invalid shard {index}/{total}, it must be between 1 and {total}')
+        self.index = index
+        self.total = total
+        self.by = by
+        self.history = history
+
+    def select(self, runners: List[RunnerModel]) -> List[RunnerModel]:
+        ''' The runners with only the runs of this shard, in the order of the file (runners left without runs are dropped) '''
+        graph = DependencyGraph(runners)
+        units = self._units(graph)
+        by_duration = self.by == ShardBy.DURATION and self._weigh_by_duration(units)
+        assignment, loads = self._assign(units)
+
+        mine: Set[DependencyNode] = { node for unit in units if assignment[unit.digest] == self.index for node in unit.nodes }
+        nodes_of: Dict[int, List[DependencyNode]] = dict()
+        for node in graph.nodes:
+            nodes_of.setdefault(id(node.runner), list()).append(node)
+        selected = list()
+        for runner in runners:
+            # unnamed runs are named after their position in the file, so depends_on keeps pointing at them
+            runs = [
+                replace(run, name = run.name or str(position))
+                for position, (run, node) in enumerate(zip(runner.runs, nodes_of.get(id(runner), list())), 1)
+                if node in mine
+            ]
+            if runs:
+                selected.append(replace(runner, runs = runs))
+        self._report(units, assignment, loads, len(mine), len(graph.nodes), by_duration)
+        return selected
+
+    def _units(self, graph: DependencyGraph) -> List[ShardUnit]:
+        ''' The connected components of the dependency graph, each one with a digest that does not depend on the file order '''
+        parent: Dict[DependencyNode, DependencyNode] = { node: node for node in graph.nodes }
+
+        def find(node: DependencyNode) -> DependencyNode:
+            while parent[node] is not node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        for node in graph.nodes:
+            for predecessor in node.predecessors:
+                parent[find(node)] = find(predecessor)
+
+        identities = self._identities(graph)
+        components: Dict[DependencyNode, List[DependencyNode]] = dict()
+        for node in graph.nodes:
+            components.setdefault(find(node), list()).append(node)
+        units = list()
+        for nodes in components.values():
+            digest = hashlib.sha256('|'.join(sorted(identities[node] for node in nodes)).encode('utf-8')).hexdigest()
+            units.append(ShardUnit(nodes = nodes, digest = digest, weight = float(len(nodes))))
+        return units
+
+    @staticmethod
+    def _identities(graph: DependencyGraph) -> Dict[DependencyNode, str]:
+        ''' Identical runs are told apart by their occurrence, which is the same whatever their order '''
+        identities = dict()
+        occurrences: Counter = Counter()
+        for node in graph.nodes:
+            run = node.runner.runs[node.index]
+            identity = json.dumps([
+                node.runner.name,
+                node.runner.project_name,
+                str(node.runner.definition_id),
+                node.runner.branch_name,
+                run.name,
+                run.parameters
+            ], sort_keys = True, default = str)
+            occurrences[identity] += 1
+            identities[node] = f'{identity}#{occurrences[identity]}'
+        return identities
+
+    def _weigh_by_duration(self, units: List[ShardUnit]) -> bool:
+        ''' A run without history weighs as much as the median of the others (a run each, when nothing is known) '''
+        expected: Dict[DependencyNode, Optional[float]] = {
+            node: self.history.expected(node.runner.project_name, node.runner.definition_id, node.runner.runs[node.index].parameters)
+            for unit in units for node in unit.nodes
+        } if self.history is not None else dict()
+        known = [ seconds for seconds in expected.values() if seconds is not None ]
+        if not known:
+            logger.warning('None of these pipelines has history yet, the shards are balanced by run count')
+            return False
+        fallback = statistics.median(known)
+        for unit in units:
+            unit.weight = sum(expected[node] if expected[node] is not None else fallback for node in unit.nodes)
+        return True
+
+    def _assign(self, units: List[ShardUnit]) -> Tuple[Dict[str, int], List[float]]:
+        ''' Heaviest units first, each one to the least loaded shard (lowest index on ties), so the plan is deterministic '''
+        loads = [ (0.0, shard) for shard in range(1, self.total + 1) ]
+        heapq.heapify(loads)
+        assignment: Dict[str, int] = dict()
+        totals = [ 0.0 ] * self.total
+        for unit in sorted(units, key = lambda u: (-u.weight, u.digest)):
+            load, shard = heapq.heappop(loads)
+            assignment[unit.digest] = shard
+            totals[shard - 1] = load + unit.weight
+            heapq.heappush(loads, (totals[shard - 1], shard))
+        return assignment, totals
+
+    def _report(self,
+                units: List[ShardUnit],
+                assignment: Dict[str, int],
+                loads: List[float],
+                selected: int,
+                total: int,
+                by_duration: bool) -> None:
+        plan = hashlib.sha256(
+            '|'.join(f'{unit.digest}:{assignment[unit.digest]}' for unit in sorted(units, key = lambda u: u.digest)).encode('utf-8')
+        ).hexdigest()[:12]
+        unit = 's' if by_duration else ' run(s)'
+        logger.info(
+            f'Shard {self.index}/{self.total} (by {self.by.value}, plan {plan}): {selected} of {total} run(s), '
+            f'load {loads[self.index - 1]:.0f}{unit} (shards between {min(loads):.0f}{unit} and {max(loads):.0f}{unit})'
+        )
@@ -0,0 +1,177 @@
+import threading
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from pipelinerunner.runner.application.model import RunnerModel
+from pipelinerunner.pipeline.application.model import ExecutionOptions
+from pipelinerunner.pipeline.domain.batch_context import BatchContext
+from pipelinerunner.pipeline.domain.run import PipelineExecution
+from pipelinerunner.pipeline.domain.run_strategy import ParallelPipelineExecutionStrategy, ApprovalHandler, ExecutionMonitor
+from pipelinerunner.pipeline.domain.run_ordering import RunOrderer
+from pipelinerunner.pipeline.domain.exceptions import AzurePipelineAPIError, PipelineExecutionCancelled
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+DefinitionKey = Tuple[str, str]  # (project_name, definition_id), as definition ids are unique per project only
+
+
+class RunWindow:
+    ''' Counts the runs in flight per definition, per project and in total, and checks them against their caps '''
+    def __init__(self, runners: List[RunnerModel], options: ExecutionOptions):
+        self.max_runs_per_project = options.max_runs_per_project
+        self.max_runs = options.max_runs
+        self.max_runs_per_definition: Dict[DefinitionKey, Optional[int]] = dict()
+        for runner in runners:
+            key = self.definition_key(runner)
+            cap = runner.max_in_flight or options.max_runs_per_definition
+            current = self.max_runs_per_definition.get(key)
+            self.max_runs_per_definition[key] = cap if current is None else min(current, cap or current)  # the strictest one wins
+        self._by_definition: Counter = Counter()
+        self._by_project: Counter = Counter()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def definition_key(runner: RunnerModel) -> DefinitionKey:
+        return (runner.project_name, str(runner.definition_id))
+
+    def try_acquire(self, runner: RunnerModel) -> bool:
+        ''' Takes a slot for a run of the runner, when all of its caps have room for it '''
+        key = self.definition_key(runner)
+        with self._lock:
+            if not self._has_room(self._by_definition[key], self.max_runs_per_definition.get(key)):
+                return False
+            if not self._has_room(self._by_project[runner.project_name], self.max_runs_per_project):
+                return False
+            if not self._has_room(self._total, self.max_runs):
+                return False
+            self._by_definition[key] += 1
+            self._by_project[runner.project_name] += 1
+            self._total += 1
+            return True
+
+    def release(self, runner: RunnerModel) -> None:
+        with self._lock:
+            self._by_definition[self.definition_key(runner)] -= 1
+            self._by_project[runner.project_name] -= 1
+            self._total -= 1
+
+    @staticmethod
+    def _has_room(in_flight: int, cap: Optional[int]) -> bool:
+        return cap is None or in_flight < cap
+
+    def __len__(self) -> int:
+        return self._total
+
+
+class SlidingWindowExecutor:
+    '''
+    Keeps the agent pools full without overflowing them: a new run is triggered the moment another one finishes,
+    as long as the caps of its definition, its project and the whole batch have room for it.
+    The runs of different runners are interleaved, so a runner at its cap never holds back the others.
+    '''
+    APPROVAL_WORKERS = 4
+
+    def __init__(self, runners: List[RunnerModel], options: ExecutionOptions, context: BatchContext):
+        self.options = options
+        self.context = context
+        self.strategies = [ ParallelPipelineExecutionStrategy(runner, options, context) for runner in runners ]
+        self.window = RunWindow(runners, options)
+        self.monitor = ExecutionMonitor(poller = context.status_poller, history = context.duration_history)
+        self.approvals = ApprovalHandler(auto_approve = options.auto_approve)
+        self.orderer = RunOrderer(options.run_order)
+        self._runners: Dict[PipelineExecution, RunnerModel] = dict()
+
+    def run(self) -> None:
+        pending = self.orderer.sort(self._interleave(), execution_of = lambda item: item[1])
+        total = len(pending)
+        logger.info(f'Starting {total} run(s) in a sliding window ({self._describe_caps()})')
+
+        finished = 0
+        with ThreadPoolExecutor(max_workers = self.APPROVAL_WORKERS, thread_name_prefix = 'approvals') as approvals:
+            while pending or len(self.monitor):
+                waiting = len(pending)
+                started = self._fill(pending)
+                if started:
+                    approvals.submit(self._handle_approvals, started)  # the window keeps moving meanwhile
+                    logger.debug(f'{len(self.window)} run(s) in flight, {len(pending)} waiting for a slot')
+                if not len(self.monitor):
+                    if not pending or len(pending) < waiting:  # some were admitted, even if they failed to start
+                        continue
+                    # nothing in flight will ever free a slot for them
+                    logger.error(f'{len(pending)} run(s) do not fit in the window even when it is empty, they are not started')
+                    return
+                for execution in self.monitor.poll_due():
+                    self.window.release(self._runners.pop(execution))
+                    finished += 1
+                logger.debug(f'{finished}/{total} run(s) finished')
+
+        logger.info(f'All {total} run(s) of {len(self.strategies)} runner(s) went through the window!')
+
+    def _interleave(self) -> List[Tuple[RunnerModel, PipelineExecution]]:
+        ''' Round-robin over the runners, keeping the order of the runs of each one '''
+        queues = [ [ (s.runner, e) for e in s.create_executions() ] for s in self.strategies ]
+        pending = list()
+        for position in range(max((len(q) for q in queues), default = 0)):
+            pending.extend(q[position] for q in queues if position < len(q))
+        return pending
+
+    def _fill(self, pending: List[Tuple[RunnerModel, PipelineExecution]]) -> List[PipelineExecution]:
+        ''' Starts every pending run that fits in the window, concurrently '''
+        if pending and self.context.canceller.is_cancelling():
+            logger.warning(f'The batch was cancelled, {len(pending)} pending run(s) not started')
+            pending.clear()
+            return list()
+        admitted = list()
+        for item in list(pending):
+            runner, _ = item
+            if self.window.try_acquire(runner):
+                pending.remove(item)
+                admitted.append(item)
+        if not admitted:
+            return list()
+
+        fan_out = min(self.options.trigger_concurrency, len(admitted))
+        with ThreadPoolExecutor(max_workers = fan_out, thread_name_prefix = 'trigger') as executor:
+            results = list(executor.map(self._start, admitted))
+
+        started = list()
+        for (runner, execution), ok in zip(admitted, results):
+            if not ok:
+                self.window.release(runner)  # the slot goes to the next one
+                continue
+            self._runners[execution] = runner
+            self.monitor.track(execution)
+            started.append(execution)
+        return started
+
+    def _start(self, item: Tuple[RunnerModel, PipelineExecution]) -> bool:
+        runner, execution = item
+        try:
+            self.context.start(execution)
+            return True
+        except PipelineExecutionCancelled:
+            return False
+        except AzurePipelineAPIError as exc:
+            logger.error(f'Failed to start a run on pipeline {runner.pipeline_name}: {exc}')
+            return False
+
+    def _handle_approvals(self, executions: List[PipelineExecution]) -> None:
+        try:
+            self.approvals.handle(executions)
+        except Exception as exc:
+            logger.error(f'Error handling the approvals of {len(executions)} run(s): {exc}')
+        self.monitor.wake_up()  # the approved runs may have moved on
+
+    def _describe_caps(self) -> str:
+        caps = [ f'{project}/{definition_id}: {cap or "unbounded"}' for (project, definition_id), cap in self.window.max_runs_per_definition.items() ]
+        if self.window.max_runs_per_project:
+            caps.append(f'per project: {self.window.max_runs_per_project}')
+        if self.window.max_runs:
+            caps.append(f'total: {self.window.max_runs}')
+        return ', '.join(caps)
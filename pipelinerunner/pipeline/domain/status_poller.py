@@ -0,0 +1,33 @@
+from typing import Dict, List
+
+from pipelinerunner.pipeline.application.model import AzurePipelineRunStatus
+from pipelinerunner.pipeline.domain.run import PipelineExecution
+from pipelinerunner.pipeline.domain.enums import AzurePipelineRunState, AzurePipelineRunResult
+from pipelinerunner.pipeline.infrastructure.pipeline_api import BasePipelineAPI
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+class RunStatusPoller:
+    ''' Resolves the status of every tracked run with one batched (and paginated) query per project '''
+    def poll(self, executions: List[PipelineExecution]) -> None:
+        by_project: Dict[str, List[PipelineExecution]] = dict()
+        for execution in executions:
+            by_project.setdefault(execution.api.runner.project_name, list()).append(execution)
+        for group in by_project.values():
+            self.poll_with(group[0].api, group)
+
+    def poll_with(self, api: BasePipelineAPI, executions: List[PipelineExecution]) -> None:
+        ''' All executions must belong to the project of the given API (async executions are accepted too) '''
+        started = [ e for e in executions if e.run_info ]
+        if not started:
+            return
+        statuses = api.get_runs_status([ e.run_info.id for e in started ])
+        logger.debug(f'Resolved the status of {len(statuses)}/{len(started)} run(s) in project "{api.runner.project_name}"')
+        for execution in started:
+            status = statuses.get(execution.run_info.id)
+            if status is None:  # the run on azure could be deleted
+                status = AzurePipelineRunStatus(state = AzurePipelineRunState.UNKNOWN, result = AzurePipelineRunResult.UNKNOWN)
+            execution.update_status(status)
@@ -0,0 +1,53 @@
+import asyncio
+
+from datetime import datetime
+from typing import Collection, Dict, List, Optional
+
+from pipelinerunner.runner.application.model import RunnerModel
+from pipelinerunner.pipeline.infrastructure.async_pipeline_api import BaseAsyncPipelineAPI
+from pipelinerunner.pipeline.infrastructure.azure_pipeline_api import AzurePipelineAPI
+from pipelinerunner.pipeline.infrastructure.session_pool import AzureSessionPool
+from pipelinerunner.pipeline.application.model import (
+    AzurePipelineRunInfo,
+    AzurePipelineRunStatus,
+    AzurePipelineApproval
+)
+
+
+class AsyncAzurePipelineAPI(BaseAsyncPipelineAPI):
+    ''' 
+    Async facade over AzurePipelineAPI.
+    The HTTP calls still use the pooled keep-alive session, but they are offloaded
+    to worker threads so the event loop is never blocked by network I/O.
+    '''
+    def __init__(self, runner: RunnerModel, session_pool: Optional[AzureSessionPool] = None):
+        super().__init__(runner)
+        self._api = AzurePipelineAPI(runner, session_pool = session_pool)
+
+    async def trigger_pipeline(self, params: Dict) -> AzurePipelineRunInfo:
+        return await asyncio.to_thread(self._api.trigger_pipeline, params)
+
+    async def wait_until_available(self) -> None:
+        while (retry_in := self._api.session.circuit.retry_in()) > 0:  # no thread is held while waiting
+            await asyncio.sleep(retry_in)
+
+    async def find_triggered_run(self, params: Dict, since: datetime, exclude: Collection[str] = ()) -> Optional[AzurePipelineRunInfo]:
+        return await asyncio.to_thread(self._api.find_triggered_run, params, since, exclude)
+
+    async def get_run_status(self, run_id: str) -> AzurePipelineRunStatus:
+        return await asyncio.to_thread(self._api.get_run_status, run_id)
+
+    async def get_approval_status(self, run_id: str) -> Optional[AzurePipelineApproval]:
+        return await asyncio.to_thread(self._api.get_approval_status, run_id)
+
+    async def list_approvals(self) -> List[AzurePipelineApproval]:
+        return await asyncio.to_thread(self._api.list_approvals)
+
+    async def approve_run(self, run_id: str, approval_id: str) -> None:
+        return await asyncio.to_thread(self._api.approve_run, run_id, approval_id)
+
+    async def approve_many(self, approvals: List[AzurePipelineApproval]) -> Dict[str, bool]:
+        return await asyncio.to_thread(self._api.approve_many, approvals)
+
+    async def cancel_run(self, run_id: str) -> None:
+        return await asyncio.to_thread(self._api.cancel_run, run_id)
@@ -0,0 +1,42 @@
+import asyncio
+
+from typing import Dict, List, Optional
+
+from pipelinerunner.runner.application.model import RunnerModel
+from pipelinerunner.pipeline.infrastructure.async_pipeline_api import BaseAsyncPipelineAPI
+from pipelinerunner.pipeline.infrastructure.dry_run_pipeline_api import DryRunPipelineAPI
+from pipelinerunner.pipeline.application.model import AzurePipelineRunInfo, AzurePipelineRunStatus, AzurePipelineApproval
+
+
+class AsyncDryRunPipelineAPI(BaseAsyncPipelineAPI):
+    def __init__(self, runner: RunnerModel):
+        super().__init__(runner)
+        self._api = DryRunPipelineAPI(runner)
+
+    async def trigger_pipeline(self, params: Dict) -> AzurePipelineRunInfo:
+        await asyncio.sleep(0)  # yielding to the event loop as a real request would do
+        return self._api.trigger_pipeline(params)
+
+    async def get_run_status(self, run_id: str) -> AzurePipelineRunStatus:
+        await asyncio.sleep(0)
+        return self._api.get_run_status(run_id)
+
+    async def get_approval_status(self, run_id: str) -> Optional[AzurePipelineApproval]:
+        await asyncio.sleep(0)
+        return self._api.get_approval_status(run_id)
+
+    async def list_approvals(self) -> List[AzurePipelineApproval]:
+        await asyncio.sleep(0)
+        return self._api.list_approvals()
+
+    async def approve_run(self, run_id: str, approval_id: str) -> None:
+        await asyncio.sleep(0)
+        return self._api.approve_run(run_id, approval_id)
+
+    async def approve_many(self, approvals: List[AzurePipelineApproval]) -> Dict[str, bool]:
+        await asyncio.sleep(0)
+        return self._api.approve_many(approvals)
+
+    async def cancel_run(self, run_id: str) -> None:
+        await asyncio.sleep(0)
+        return self._api.cancel_run(run_id)
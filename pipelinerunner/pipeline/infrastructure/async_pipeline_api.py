@@ -0,0 +1,53 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Collection, Dict, List, Optional
+
+from pipelinerunner.runner.application.model import RunnerModel
+from pipelinerunner.pipeline.application.model import AzurePipelineRunInfo, AzurePipelineRunStatus, AzurePipelineApproval
+from pipelinerunner.pipeline.domain.exceptions import AzurePipelineAPIError
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+class BaseAsyncPipelineAPI(ABC):
+    def __init__(self, runner: RunnerModel):
+         self.runner = runner
+
+    @abstractmethod
+    async def trigger_pipeline(self, params: Dict) -> AzurePipelineRunInfo: pass
+
+    async def wait_until_available(self) -> None:
+        return None
+
+    async def find_triggered_run(self, params: Dict, since: datetime, exclude: Collection[str] = ()) -> Optional[AzurePipelineRunInfo]:
+        ''' Looks for a run created since the given (UTC) time with the same parameters and branch, ignoring the excluded run ids '''
+        return None
+
+    @abstractmethod
+    async def get_run_status(self, run_id: str) -> AzurePipelineRunStatus: pass
+
+    @abstractmethod
+    async def get_approval_status(self, run_id: str) -> Optional[AzurePipelineApproval]: pass
+    
+    @abstractmethod
+    async def list_approvals(self) -> List[AzurePipelineApproval]: pass
+
+    @abstractmethod
+    async def approve_run(self, run_id: str, approval_id: str) -> None: pass
+
+    @abstractmethod
+    async def cancel_run(self, run_id: str) -> None: pass
+
+    async def approve_many(self, approvals: List[AzurePipelineApproval]) -> Dict[str, bool]:
+        ''' Same contract as BasePipelineAPI.approve_many '''
+        results = dict()
+        for approval in approvals:
+            try:
+                await self.approve_run(run_id = approval.run_id, approval_id = approval.id)
+                results[approval.id] = True
+            except AzurePipelineAPIError as exc:
+                logger.error(str(exc))
+                results[approval.id] = False
+        return results
@@ -1,20 +1,24 @@
-import base64
+import functools
 import json
 import requests
 
-from typing import List, Dict, Optional
+from datetime import datetime, timezone
+from typing import Callable, Collection, Dict, Iterator, List, Optional, Tuple
 from http import HTTPStatus
 
 from pipelinerunner.runner.application.model import RunnerModel
 
 from pipelinerunner.pipeline.infrastructure.pipeline_api import BasePipelineAPI
+from pipelinerunner.pipeline.infrastructure.session_pool import AzureSessionPool
 from pipelinerunner.pipeline.application.model import (
     AzurePipelineRunInfo,
     AzurePipelineRunStatus,
-    AzurePipelineApproval
+    AzurePipelineApproval,
+    AgentPool,
+    AgentPoolCapacity
 )
 from pipelinerunner.pipeline.domain.enums import AzurePipelineRunState, AzurePipelineRunResult
-from pipelinerunner.pipeline.domain.exceptions import AzurePipelineAPIError
+from pipelinerunner.pipeline.domain.exceptions import AzurePipelineAPIError, AzurePipelineAPITransientError
 from pipelinerunner.config import DevOpsConfig
 from pipelinerunner.shared.util.logger import BetterLogger
 
@@ -22,20 +26,38 @@ from pipelinerunner.shared.util.logger import BetterLogger
 logger = BetterLogger.get_logger(__name__)
 
 
+def translate_network_errors(method: Callable) -> Callable:
+    ''' Timeouts and dropped connections become transient API errors, which the callers already handle '''
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except requests.RequestException as exc:
+            raise AzurePipelineAPITransientError(f'❌ Request to Azure DevOps failed: {exc}') from exc
+    return wrapper
+
+
 class AzurePipelineAPI(BasePipelineAPI):
-    def __init__(self, runner: RunnerModel):
+    BASE_URL = 'https://dev.azure.com'
+    MAX_RUN_IDS_PER_QUERY = 100  # keeps the query string far below the URL length limit
+    MAX_RECENT_RUNS_TO_INSPECT = 20
+    MAX_APPROVALS_PER_REQUEST = 50
+    APPROVALS_PAGE_SIZE = 100
+    # (connect, read) timeouts in seconds, per operation
+    TRIGGER_TIMEOUT = (5, 60)  # queueing a run can take a while on Azure side
+    QUERY_TIMEOUT = (5, 20)
+    APPROVAL_TIMEOUT = (5, 30)
+    CANCEL_TIMEOUT = (5, 20)
+
+    def __init__(self, runner: RunnerModel, session_pool: Optional[AzureSessionPool] = None):
         super().__init__(runner)
-        auth = base64.b64encode(f":{DevOpsConfig.personal_access_token}".encode("ascii")).decode("ascii")
-        self.headers = {
-            "Authorization": f"Basic {auth}",
-            "Content-Type": "application/json"
-        }
         self.organization_name = DevOpsConfig.organization_name
+        self.session = (session_pool or AzureSessionPool()).get(self.organization_name)
         self.api_version = '7.1'
 
     # Reference: https://learn.microsoft.com/en-us/rest/api/azure/devops/pipelines/runs/run-pipeline?view=azure-devops-rest-7.1
     def trigger_pipeline(self, params: List[Dict]) -> Optional[AzurePipelineRunInfo]:
-        endpoint = f"https://dev.azure.com/{self.organization_name}/{self.runner.project_name}/_apis/pipelines/{self.runner.definition_id}/runs?api-version={self.api_version}"
+        endpoint = f"{self.BASE_URL}/{self.organization_name}/{self.runner.project_name}/_apis/pipelines/{self.runner.definition_id}/runs?api-version={self.api_version}"
         body = {
             "resources": {
                 "repositories": {
@@ -46,8 +68,15 @@ class AzurePipelineAPI(BasePipelineAPI):
             },
             "templateParameters": params
         }
-        logger.info(f"Triggering pipeline with parameters: \r\n{json.dumps(params, indent=2)}")
-        response = requests.post(endpoint, headers = self.headers, json = body)
+        logger.info(f"Triggering pipeline {self.runner.pipeline_name}")
+        if logger.is_enabled_for('debug'):  # pretty-printing the parameters of hundreds of runs is not free
+            logger.debug(f"Triggering pipeline with parameters: \r\n{json.dumps(params, indent=2)}")
+        try:
+            response = self.session.post(endpoint, json = body, timeout = self.TRIGGER_TIMEOUT)
+        except requests.ConnectTimeout as exc:  # it never reached Azure
+            raise AzurePipelineAPITransientError(f'❌ Failed to trigger pipeline: {exc}') from exc
+        except (requests.Timeout, requests.ConnectionError) as exc:  # the run may have been created anyway
+            raise AzurePipelineAPITransientError(f'❌ Failed to trigger pipeline: {exc}', ambiguous = True) from exc
 
         if response.status_code in (HTTPStatus.OK, HTTPStatus.CREATED):
             raw_response = response.json()
@@ -62,62 +91,188 @@ class AzurePipelineAPI(BasePipelineAPI):
             )
 
         error_message = f'❌ Failed to trigger pipeline. Status Code: {response.status_code}, Response: {response.text}'
+        if response.status_code == HTTPStatus.TOO_MANY_REQUESTS:
+            raise AzurePipelineAPITransientError(error_message)
+        if response.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR:
+            raise AzurePipelineAPITransientError(error_message, ambiguous = True)
         raise AzurePipelineAPIError(error_message)
 
+    def wait_until_available(self) -> None:
+        self.session.circuit.wait_until_available()
+
+    # Reference: https://learn.microsoft.com/en-us/rest/api/azure/devops/pipelines/runs/list?view=azure-devops-rest-7.1
+    @translate_network_errors
+    def find_triggered_run(self, params: Dict, since: datetime, exclude: Collection[str] = ()) -> Optional[AzurePipelineRunInfo]:
+        endpoint = f"{self.BASE_URL}/{self.organization_name}/{self.runner.project_name}/_apis/pipelines/{self.runner.definition_id}/runs?api-version={self.api_version}"
+        response = self.session.get(endpoint, timeout = self.QUERY_TIMEOUT)
+        if response.status_code != HTTPStatus.OK:
+            raise AzurePipelineAPIError(f'❌ Failed to list runs. Status Code: {response.status_code}, Response: {response.text}')
+
+        # The list does not bring the parameters, so only the runs created since the first attempt are inspected
+        excluded = { str(run_id) for run_id in exclude }
+        candidates = sorted(
+            [
+                raw_run for raw_run in response.json()['value']
+                if self._parse_date(raw_run.get('createdDate')) >= since and str(raw_run['id']) not in excluded
+            ],
+            key = lambda raw_run: self._parse_date(raw_run.get('createdDate')),
+            reverse = True
+        )
+        expected_ref = f"refs/heads/{self.runner.branch_name}"
+        expected_params = self._normalize_parameters(params)
+        for raw_run in candidates[:self.MAX_RECENT_RUNS_TO_INSPECT]:
+            run_endpoint = f"{self.BASE_URL}/{self.organization_name}/{self.runner.project_name}/_apis/pipelines/{self.runner.definition_id}/runs/{raw_run['id']}?api-version={self.api_version}"
+            run_response = self.session.idempotent_get(run_endpoint, timeout = self.QUERY_TIMEOUT)
+            if run_response.status_code != HTTPStatus.OK:
+                continue
+            raw_details = run_response.json()
+            ref_name = raw_details.get('resources', {}).get('repositories', {}).get('self', {}).get('refName')
+            if ref_name != expected_ref:
+                continue
+            if self._normalize_parameters(raw_details.get('templateParameters') or {}) != expected_params:
+                continue
+            return AzurePipelineRunInfo(
+                id = str(raw_details['id']),
+                status = AzurePipelineRunStatus(
+                    state = AzurePipelineRunState.from_string(raw_details.get('state')),
+                    result = AzurePipelineRunResult.from_string(raw_details.get('result'))
+                )
+            )
+        return None
+
+    @staticmethod
+    def _parse_date(value: Optional[str]) -> datetime:
+        if not value:
+            return datetime.min.replace(tzinfo = timezone.utc)
+        return datetime.fromisoformat(value)
+
+    @staticmethod
+    def _normalize_parameters(params: Dict) -> Dict[str, str]:
+        ''' Azure gives the template parameters back as strings '''
+        return {
+            str(name): str(value).lower() if isinstance(value, bool) or str(value).lower() in ('true', 'false') else str(value)
+            for name, value in params.items()
+        }
+
     # Reference: https://learn.microsoft.com/en-us/rest/api/azure/devops/pipelines/runs/get?view=azure-devops-rest-7.1
+    @translate_network_errors
     def get_run_status(self, run_id: str) -> AzurePipelineRunStatus:
-        endpoint = f"https://dev.azure.com/{self.organization_name}/{self.runner.project_name}/_apis/pipelines/{self.runner.definition_id}/runs/{run_id}?api-version={self.api_version}"
-        response = requests.get(endpoint, headers = self.headers)
-        raw_response = response.json()
-        logger.debug(f'Response from GET on {endpoint}:\n {raw_response}')
-        state = AzurePipelineRunState.from_string(raw_response.get('state'))  # the run on azure could be deleted
-        result = AzurePipelineRunResult.from_string(raw_response.get('result'))
-        return AzurePipelineRunStatus(state = state, result = result)
+        endpoint = f"{self.BASE_URL}/{self.organization_name}/{self.runner.project_name}/_apis/pipelines/{self.runner.definition_id}/runs/{run_id}?api-version={self.api_version}"
+
+        def parse(response: requests.Response) -> AzurePipelineRunStatus:
+            if response.status_code not in (HTTPStatus.OK, HTTPStatus.NOT_FOUND):
+                raise AzurePipelineAPIError(f'❌ Failed to get status of run {run_id}. Status Code: {response.status_code}, Response: {response.text}')
+            raw_response = response.json()
+            logger.debug(f'Response from GET on {endpoint}:\n {raw_response}')
+            state = AzurePipelineRunState.from_string(raw_response.get('state'))  # the run on azure could be deleted
+            result = AzurePipelineRunResult.from_string(raw_response.get('result'))
+            return AzurePipelineRunStatus(state = state, result = result)
+
+        return self.session.get_cached(endpoint, parse, timeout = self.QUERY_TIMEOUT)  # unchanged runs answer 304 and the last status is reused
+
+    # Reference: https://learn.microsoft.com/en-us/rest/api/azure/devops/build/builds/list?view=azure-devops-rest-7.1
+    @translate_network_errors
+    def get_runs_status(self, run_ids: List[str]) -> Dict[str, AzurePipelineRunStatus]:
+        # A pipeline run is a build, so the project-wide builds query filtered by ids
+        # resolves many runs (even from different pipelines) at once
+        statuses: Dict[str, AzurePipelineRunStatus] = dict()
+        for start in range(0, len(run_ids), self.MAX_RUN_IDS_PER_QUERY):
+            chunk = run_ids[start:start + self.MAX_RUN_IDS_PER_QUERY]
+            for raw_build in self._list_builds(chunk):
+                statuses[str(raw_build['id'])] = AzurePipelineRunStatus(
+                    state = AzurePipelineRunState.from_build_status(raw_build.get('status')),
+                    result = AzurePipelineRunResult.from_string(raw_build.get('result'))
+                )
+        return statuses
+
+    def _list_builds(self, run_ids: List[str]) -> List[Dict]:
+        endpoint = f"{self.BASE_URL}/{self.organization_name}/{self.runner.project_name}/_apis/build/builds"
+        params = {
+            'buildIds': ','.join(run_ids),
+            'queryOrder': 'queueTimeDescending',
+            'api-version': self.api_version
+        }
+        builds = list()
+        while True:
+            page, continuation_token = self.session.get_cached(endpoint, self._parse_builds_page, params = dict(params), timeout = self.QUERY_TIMEOUT)
+            builds.extend(page)
+            if not continuation_token:
+                return builds
+            params['continuationToken'] = continuation_token
+
+    @staticmethod
+    def _parse_builds_page(response: requests.Response) -> Tuple[List[Dict], Optional[str]]:
+        if response.status_code != HTTPStatus.OK:
+            raise AzurePipelineAPIError(f'❌ Failed to list runs. Status Code: {response.status_code}, Response: {response.text}')
+        return response.json()['value'], response.headers.get('x-ms-continuationtoken')
 
     # Reference: https://learn.microsoft.com/en-us/rest/api/azure/devops/approvalsandchecks/approvals/query?view=azure-devops-rest-7.1&tabs=HTTP
+    @translate_network_errors
     def get_approval_status(self, run_id: str) -> Optional[AzurePipelineApproval]:
-        endpoint = f'https://dev.azure.com/{self.organization_name}/{self.runner.project_name}/_apis/pipelines/approvals?api-version={self.api_version}'
-        response = requests.get(endpoint, headers = self.headers)
-        raw_response = response.json()
-        #logger.debug(f'Response from GET on {endpoint}:\n {raw_response}')
-
-        response = list()
         # This endpoint returns all the pending approvals in all pipelines of the project
-        # so we must filter it
-        for raw_approval in raw_response['value']:
-            approval_pipeline_definition_id = str(raw_approval['pipeline']['id'])
-            if self.runner.definition_id != approval_pipeline_definition_id:
-                # Ignoring if the pipeline is not the same
-                continue
+        # so we must filter it, stopping at the page that holds the run
+        for page in self._approval_pages():
+            for approval in page:
+                if self.runner.definition_id != approval.definition_id:
+                    # Ignoring if the pipeline is not the same
+                    continue
 
-            approval_run_id = str(raw_approval['pipeline']['owner']['id'])
-            if run_id != approval_run_id:
-                # Ignoring if the run_id is not the same
-                continue
-
-            status = str(raw_approval['status'])
+                if run_id != approval.run_id:
+                    # Ignoring if the run_id is not the same
+                    continue
 
-            return AzurePipelineApproval(
-                id = raw_approval['id'],
-                run_id = run_id,
-                status = status
-            )
+                return approval
         
         return None
 
+    @translate_network_errors
+    def list_approvals(self) -> List[AzurePipelineApproval]:
+        return [ approval for page in self._approval_pages() for approval in page ]
+
+    def _approval_pages(self) -> Iterator[List[AzurePipelineApproval]]:
+        ''' Whole pages, so the unchanged ones come from the conditional GET cache '''
+        endpoint = self._approvals_endpoint(with_api_version = False)
+        params = self._approvals_query(state = 'pending')
+        while True:
+            page, continuation_token = self.session.get_cached(endpoint, self._parse_approvals_page, params = dict(params), timeout = self.QUERY_TIMEOUT)
+            yield page
+            if not continuation_token:
+                return
+            params['continuationToken'] = continuation_token
+
+    def _approvals_query(self, state: str) -> Dict:
+        ''' Filtered on the server, as large projects keep thousands of completed approvals '''
+        return {
+            'state': state,
+            'top': self.APPROVALS_PAGE_SIZE,
+            'api-version': self.api_version
+        }
+
+    @classmethod
+    def _parse_approvals_page(cls, response: requests.Response) -> Tuple[List[AzurePipelineApproval], Optional[str]]:
+        if response.status_code != HTTPStatus.OK:
+            raise AzurePipelineAPIError(f'❌ Failed to list approvals. Status Code: {response.status_code}, Response: {response.text}')
+        raw_response = response.json()
+        approvals = [ cls._parse_approval(raw_approval) for raw_approval in raw_response['value'] ]
+        return approvals, response.headers.get('x-ms-continuationtoken')
+
+    @staticmethod
+    def _parse_approval(raw_approval: Dict) -> AzurePipelineApproval:
+        return AzurePipelineApproval(
+            id = raw_approval['id'],
+            run_id = str(raw_approval['pipeline']['owner']['id']),
+            status = str(raw_approval['status']),
+            definition_id = str(raw_approval['pipeline']['id'])
+        )
+
     # Referece: https://learn.microsoft.com/en-us/rest/api/azure/devops/approvalsandchecks/approvals/update?view=azure-devops-rest-7.1&tabs=HTTP
+    @translate_network_errors
     def approve_run(self, run_id: str, approval_id: str) -> None:
-        endpoint = f'https://dev.azure.com/{self.organization_name}/{self.runner.project_name}/_apis/pipelines/approvals?api-version={self.api_version}'
-        body = [
-            {
-                "approvalId": approval_id,
-                "comment": "Approved by Pipeline Runner",
-                "status": "approved"
-            }
-        ]
+        endpoint = self._approvals_endpoint()
+        body = [ self._approval_update(approval_id) ]
         logger.info(f"Approving run {run_id} using approval_id {approval_id}")
-        response = requests.patch(endpoint, headers = self.headers, json = body)
-        logger.debug(f'Response from PATCH on {endpoint}:\n {response.json()}')
+        response = self.session.patch(endpoint, json = body, timeout = self.APPROVAL_TIMEOUT)
+        logger.debug(f'Response from PATCH on {endpoint}:\n {response.text}')
 
         if response.status_code == HTTPStatus.OK:
             return None
@@ -128,3 +283,116 @@ class AzurePipelineAPI(BasePipelineAPI):
         
         error_message = f'❌ Failed to approve run {run_id}. Status Code: {response.status_code}, Response: {response.text}'
         raise AzurePipelineAPIError(error_message)
+
+    # Reference: https://learn.microsoft.com/en-us/rest/api/azure/devops/approvalsandchecks/approvals/update?view=azure-devops-rest-7.1
+    @translate_network_errors
+    def approve_many(self, approvals: List[AzurePipelineApproval]) -> Dict[str, bool]:
+        ''' The endpoint takes an array, so the approvals go in chunks instead of one request per run '''
+        results = dict()
+        for start in range(0, len(approvals), self.MAX_APPROVALS_PER_REQUEST):
+            results.update(self._approve_chunk(approvals[start:start + self.MAX_APPROVALS_PER_REQUEST]))
+        return results
+
+    def _approve_chunk(self, approvals: List[AzurePipelineApproval]) -> Dict[str, bool]:
+        endpoint = self._approvals_endpoint()
+        body = [ self._approval_update(approval.id) for approval in approvals ]
+        logger.info(f"Approving {len(approvals)} run(s) in a single request: {', '.join(approval.run_id for approval in approvals)}")
+        response = self.session.patch(endpoint, json = body, timeout = self.APPROVAL_TIMEOUT)
+        logger.debug(f'Response from PATCH on {endpoint}:\n {response.text}')
+
+        if response.status_code == HTTPStatus.OK:
+            statuses = { str(raw['id']): raw.get('status') for raw in response.json().get('value', []) }
+            return { approval.id: statuses.get(approval.id) == 'approved' for approval in approvals }
+
+        if len(approvals) > 1:  # a single bad approval fails the whole request, so each one is tried on its own
+            logger.warning(f'Bulk approval failed with status code {response.status_code}, approving one by one')
+            return super().approve_many(approvals)
+
+        logger.error(f'❌ Failed to approve run {approvals[0].run_id}. Status Code: {response.status_code}, Response: {response.text}')
+        return { approvals[0].id: False }
+
+    def _approvals_endpoint(self, with_api_version: bool = True) -> str:
+        endpoint = f'{self.BASE_URL}/{self.organization_name}/{self.runner.project_name}/_apis/pipelines/approvals'
+        return f'{endpoint}?api-version={self.api_version}' if with_api_version else endpoint
+
+    @staticmethod
+    def _approval_update(approval_id: str) -> Dict:
+        return {
+            "approvalId": approval_id,
+            "comment": "Approved by Pipeline Runner",
+            "status": "approved"
+        }
+
+    # Reference: https://learn.microsoft.com/en-us/rest/api/azure/devops/build/builds/update-build?view=azure-devops-rest-7.1
+    @translate_network_errors
+    def cancel_run(self, run_id: str) -> None:
+        # The pipelines API cannot cancel, but a pipeline run is a build
+        endpoint = f"{self.BASE_URL}/{self.organization_name}/{self.runner.project_name}/_apis/build/builds/{run_id}?api-version={self.api_version}"
+        logger.debug(f'Cancelling run {run_id}')
+        response = self.session.patch(endpoint, json = { "status": "cancelling" }, timeout = self.CANCEL_TIMEOUT)
+        logger.debug(f'Response from PATCH on {endpoint}:\n {response.text}')
+
+        if response.status_code == HTTPStatus.OK:
+            return None
+        raise AzurePipelineAPIError(f'❌ Failed to cancel run {run_id}. Status Code: {response.status_code}, Response: {response.text}')
+
+    # Reference: https://learn.microsoft.com/en-us/rest/api/azure/devops/build/definitions/get?view=azure-devops-rest-7.1
+    def _get_definition(self) -> Dict:
+        endpoint = f"{self.BASE_URL}/{self.organization_name}/{self.runner.project_name}/_apis/build/definitions/{self.runner.definition_id}?api-version={self.api_version}"
+        response = self.session.idempotent_get(endpoint, timeout = self.QUERY_TIMEOUT)
+        if response.status_code != HTTPStatus.OK:
+            raise AzurePipelineAPIError(f'❌ Failed to get the definition of pipeline {self.runner.pipeline_name}. Status Code: {response.status_code}, Response: {response.text}')
+        return response.json()
+
+    # Reference: https://learn.microsoft.com/en-us/rest/api/azure/devops/git/refs/list?view=azure-devops-rest-7.1
+    @translate_network_errors
+    def get_branch_commit(self) -> Optional[str]:
+        repository = self._get_definition().get('repository') or {}
+        if repository.get('type') != 'TfsGit' or not repository.get('id'):  # GitHub, Bitbucket... are not reachable with this token
+            return None
+        endpoint = f"{self.BASE_URL}/{self.organization_name}/{self.runner.project_name}/_apis/git/repositories/{repository['id']}/refs"
+        ref_name = f'heads/{self.runner.branch_name}'
+        response = self.session.idempotent_get(endpoint, params = { 'filter': ref_name, 'api-version': self.api_version }, timeout = self.QUERY_TIMEOUT)
+        if response.status_code != HTTPStatus.OK:
+            raise AzurePipelineAPIError(f'❌ Failed to get the branch {self.runner.branch_name} of pipeline {self.runner.pipeline_name}. Status Code: {response.status_code}, Response: {response.text}')
+        for raw_ref in response.json()['value']:  # the filter is a prefix, "main" also brings "main-old"
+            if raw_ref.get('name') == f'refs/{ref_name}':
+                return raw_ref.get('objectId')
+        return None
+
+    @translate_network_errors
+    def get_agent_pool(self) -> Optional[AgentPool]:
+        raw_pool = (self._get_definition().get('queue') or {}).get('pool')
+        if not raw_pool:  # e.g. the pool is only chosen in the YAML
+            return None
+        return AgentPool(
+            id = str(raw_pool['id']),
+            name = raw_pool.get('name', ''),
+            is_hosted = bool(raw_pool.get('isHosted', False))
+        )
+
+    # Reference: https://learn.microsoft.com/en-us/rest/api/azure/devops/distributedtask/agents/list?view=azure-devops-rest-7.1
+    @translate_network_errors
+    def get_agent_pool_capacity(self, pool_id: str) -> Optional[AgentPoolCapacity]:
+        pool_endpoint = f"{self.BASE_URL}/{self.organization_name}/_apis/distributedtask/pools/{pool_id}"
+        response = self.session.idempotent_get(
+            f'{pool_endpoint}/agents',
+            params = { 'includeAssignedRequest': 'true', 'api-version': self.api_version },
+            timeout = self.QUERY_TIMEOUT
+        )
+        if response.status_code != HTTPStatus.OK:
+            raise AzurePipelineAPIError(f'❌ Failed to list the agents of pool {pool_id}. Status Code: {response.status_code}, Response: {response.text}')
+        free_agents = sum(
+            1 for raw_agent in response.json()['value']
+            if raw_agent.get('enabled') and raw_agent.get('status') == 'online' and not raw_agent.get('assignedRequest')
+        )
+
+        # Not documented on the REST reference, but it is what the agent pool page of Azure DevOps uses
+        response = self.session.idempotent_get(f'{pool_endpoint}/jobrequests', timeout = self.QUERY_TIMEOUT)
+        if response.status_code != HTTPStatus.OK:
+            raise AzurePipelineAPIError(f'❌ Failed to list the jobs of pool {pool_id}. Status Code: {response.status_code}, Response: {response.text}')
+        queued_jobs = sum(
+            1 for raw_job in response.json()['value']
+            if not raw_job.get('assignTime') and not raw_job.get('finishTime') and not raw_job.get('result')
+        )
+        return AgentPoolCapacity(free_agents = free_agents, queued_jobs = queued_jobs)
@@ -0,0 +1,138 @@
+import json
+import os
+import secrets
+import threading
+
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from pipelinerunner.pipeline.domain.exceptions import BatchJournalError
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+class BatchJournal:
+    '''
+    Append-only record of a batch: what it was made of, then every trigger, approval and completion.
+    Every event is one JSON line, flushed and fsync'd before going on, so the run ids survive a crash of the CLI
+    and the batch can be resumed. A torn last line (crash while writing) is ignored on replay.
+    Without a path it is kept in memory only (e.g. dry runs, whose run ids are fake).
+    '''
+    def __init__(self, batch_id: str, path: Optional[Path] = None):
+        self.batch_id = batch_id
+        self.path = path
+        self.runners: List[Dict] = list()  # as they were serialized when the batch started
+        self.mode: Optional[str] = None
+        self.run_ids: Dict[str, str] = dict()  # run key -> run id of every triggered run
+        self.approved: Set[str] = set()
+        self.completed: Dict[str, str] = dict()  # run key -> result
+        self._file = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_batch_id() -> str:
+        return f'{datetime.now().strftime("%Y%m%d-%H%M%S")}-{secrets.token_hex(3)}'
+
+    def start_batch(self, runners: List[Dict], mode: str) -> None:
+        self.runners = runners
+        self.mode = mode
+        self._append('batch_started', runners = runners, mode = mode)
+
+    def resumed(self) -> None:
+        self._append('batch_resumed')
+
+    def triggered(self, key: str, run_id: str) -> None:
+        self.run_ids[key] = str(run_id)
+        self._append('triggered', key = key, run_id = str(run_id))
+
+    def approved_run(self, key: str, run_id: str) -> None:
+        self.approved.add(key)
+        self._append('approved', key = key, run_id = str(run_id))
+
+    def completed_run(self, key: str, run_id: str, result: str) -> None:
+        self.completed[key] = result
+        self._append('completed', key = key, run_id = str(run_id), result = result)
+
+    def run_id_of(self, key: str) -> Optional[str]:
+        return self.run_ids.get(key)
+
+    def in_flight(self) -> List[str]:
+        return [ key for key in self.run_ids if key not in self.completed ]
+
+    def _append(self, event: str, **fields) -> None:
+        if self.path is None:
+            return
+        line = json.dumps({ 'event': event, 'at': datetime.now(timezone.utc).isoformat(), **fields }, default = str)
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._file.write(line + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def _open(self) -> None:
+        is_new = not self.path.exists()
+        self.path.parent.mkdir(parents = True, exist_ok = True)
+        self._file = open(self.path, 'a', encoding = 'utf-8')
+        if is_new and hasattr(os, 'O_DIRECTORY'):  # the new directory entry must survive a crash too
+            directory = os.open(self.path.parent, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+
+    def replay(self) -> None:
+        ''' Rebuilds the state of the batch from its events '''
+        with open(self.path, 'r', encoding = 'utf-8') as f:
+            lines = f.readlines()
+        for number, line in enumerate(lines, 1):
+            try:
+                event = json.loads(line)
+            except ValueError:
+                if number == len(lines):
+                    logger.warning(f'Ignoring the last (incomplete) event of the journal of batch {self.batch_id}')
+                    continue
+                raise BatchJournalError(f'The journal of batch {self.batch_id} is corrupted at line {number}')
+            kind = event.get('event')
+            if kind == 'batch_started':
+                self.runners = event['runners']
+                self.mode = event['mode']
+            elif kind == 'triggered':
+                self.run_ids[event['key']] = event['run_id']
+            elif kind == 'approved':
+                self.approved.add(event['key'])
+            elif kind == 'completed':
+                self.completed[event['key']] = event['result']
+        if not self.runners:
+            raise BatchJournalError(f'The journal of batch {self.batch_id} does not say which runners it was made of')
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class BatchJournalFactory:
+    @staticmethod
+    def directory() -> Path:
+        return Path.home() / '.pipelinerunner' / 'journal'
+
+    @classmethod
+    def create(cls, in_memory: bool = False) -> BatchJournal:
+        batch_id = BatchJournal.new_batch_id()
+        if in_memory:
+            return BatchJournal(batch_id)
+        return BatchJournal(batch_id, cls.directory() / f'{batch_id}.jsonl')
+
+    @classmethod
+    def open(cls, batch_id: str) -> BatchJournal:
+        path = cls.directory() / f'{batch_id}.jsonl'
+        if not path.exists():
+            raise BatchJournalError(f'No journal found for batch {batch_id} in {cls.directory()}')
+        journal = BatchJournal(batch_id, path)
+        journal.replay()
+        return journal
@@ -0,0 +1,102 @@
+import threading
+import time
+
+from pipelinerunner.pipeline.domain.enums import CircuitState
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+class CircuitBreaker:
+    '''
+    Stops sending requests to a service that keeps failing.
+    CLOSED: requests flow and consecutive failures are counted.
+    OPEN: requests are refused right away until the recovery timeout expires.
+    HALF_OPEN: a single probe request goes through, closing the circuit on success or opening it again
+    (for twice as long) on failure.
+    '''
+    FAILURE_THRESHOLD = 5  # consecutive failures
+    RECOVERY_TIMEOUT = 15  # seconds
+    MAX_RECOVERY_TIMEOUT = 120
+
+    def __init__(self,
+                 name: str,
+                 failure_threshold: int = FAILURE_THRESHOLD,
+                 recovery_timeout: float = RECOVERY_TIMEOUT,
+                 max_recovery_timeout: float = MAX_RECOVERY_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.initial_recovery_timeout = recovery_timeout
+        self.max_recovery_timeout = max_recovery_timeout
+        self.recovery_timeout = recovery_timeout
+        self.state = CircuitState.CLOSED
+        self.times_opened = 0
+        self._failures = 0
+        self._opened_until = 0.0
+        self._probing = False
+        self._condition = threading.Condition()
+
+    def allow_request(self) -> bool:
+        with self._condition:
+            if self.state == CircuitState.CLOSED:
+                return True
+            if self.state == CircuitState.OPEN and time.monotonic() >= self._opened_until:
+                self.state = CircuitState.HALF_OPEN
+                logger.info(f'{self.name} may have recovered, sending a probe request')
+            if self.state == CircuitState.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._condition:
+            if self.state != CircuitState.CLOSED:
+                logger.success(f'{self.name} is available again, resuming the requests')
+            self.state = CircuitState.CLOSED
+            self.recovery_timeout = self.initial_recovery_timeout
+            self._failures = 0
+            self._probing = False
+            self._condition.notify_all()
+
+    def record_failure(self) -> None:
+        with self._condition:
+            if self.state == CircuitState.HALF_OPEN:
+                self.recovery_timeout = min(self.recovery_timeout * 2, self.max_recovery_timeout)
+                self._open()
+            elif self.state == CircuitState.CLOSED:
+                self._failures += 1
+                if self._failures >= self.failure_threshold:
+                    self._open()
+            self._condition.notify_all()
+
+    def _open(self) -> None:
+        self.state = CircuitState.OPEN
+        self.times_opened += 1
+        self._probing = False
+        self._opened_until = time.monotonic() + self.recovery_timeout
+        logger.warning(f'{self.name} looks unavailable, pausing the requests for {self.recovery_timeout:.0f} second(s)')
+
+    def retry_in(self) -> float:
+        ''' Seconds until a request may be allowed again (zero when it may go right now) '''
+        with self._condition:
+            return self._retry_in()
+
+    def _retry_in(self) -> float:
+        if self.state == CircuitState.CLOSED:
+            return 0.0
+        if self.state == CircuitState.OPEN:
+            return max(0.0, self._opened_until - time.monotonic())
+        return 1.0 if self._probing else 0.0  # woken up earlier when the probe finishes
+
+    def wait_until_available(self) -> None:
+        ''' Blocks while the circuit is open, returning as soon as a request may be tried again '''
+        with self._condition:
+            while True:
+                wait = self._retry_in()
+                if wait <= 0:
+                    return
+                self._condition.wait(wait)
+
+    def __str__(self) -> str:
+        return f'Circuit breaker of {self.name}: {self.state.name}, opened {self.times_opened} time(s)'
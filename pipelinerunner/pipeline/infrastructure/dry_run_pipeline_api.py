@@ -1,10 +1,18 @@
 import random
+import threading
+import time
 
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 from pipelinerunner.runner.application.model import RunnerModel
 from pipelinerunner.pipeline.infrastructure.pipeline_api import BasePipelineAPI
-from pipelinerunner.pipeline.application.model import AzurePipelineRunInfo, AzurePipelineRunStatus, AzurePipelineApproval
+from pipelinerunner.pipeline.application.model import (
+    AzurePipelineRunInfo,
+    AzurePipelineRunStatus,
+    AzurePipelineApproval,
+    AgentPool,
+    AgentPoolCapacity
+)
 from pipelinerunner.pipeline.domain.enums import AzurePipelineRunState, AzurePipelineRunResult
 from pipelinerunner.shared.util.logger import BetterLogger
 
@@ -13,6 +21,18 @@ logger = BetterLogger.get_logger(__name__)
 
 
 class DryRunPipelineAPI(BasePipelineAPI):
+    # project -> run id -> definition id, as approvals are project-wide. A run leaves it once approved, cancelled or finished,
+    # so a long-lived process (e.g. the daemon) does not keep every run it ever simulated, and the oldest ones go first
+    # past the cap (the runs of a batch that does not wait are never looked at again)
+    MAX_PENDING_APPROVALS = 1000  # per project
+    _pending_approvals: Dict[str, Dict[str, str]] = dict()
+    _approvals_lock = threading.Lock()
+    # A make-believe agent pool, so the agent pool throttling can be tried offline: every run holds an agent for a while
+    SIMULATED_AGENTS = 2
+    SIMULATED_JOB_SECONDS = 5
+    _busy_until: List[float] = list()
+    _pool_lock = threading.Lock()
+
     def __init__(self, runner: RunnerModel):
         super().__init__(runner)
 
@@ -25,9 +45,19 @@ class DryRunPipelineAPI(BasePipelineAPI):
             state = AzurePipelineRunState.IN_PROGRESS,
             result = AzurePipelineRunResult.UNKNOWN 
         )
+        with self._approvals_lock:
+            runs = self._pending_approvals.setdefault(self.runner.project_name, dict())
+            runs[str(fake_id)] = self.runner.definition_id
+            while len(runs) > self.MAX_PENDING_APPROVALS:
+                del runs[next(iter(runs))]
+        now = time.monotonic()
+        with self._pool_lock:
+            self._forget_free_agents(now)  # nothing else prunes them without --respect-agent-pools
+            self._busy_until.append(now + self.SIMULATED_JOB_SECONDS)
         return AzurePipelineRunInfo(id = str(fake_id), status = status)
     
-    def get_run_status(self, *args, **kwargs) -> AzurePipelineRunStatus:
+    def get_run_status(self, run_id: str) -> AzurePipelineRunStatus:
+        self._forget(run_id)  # a finished run has no pending approval
         state = AzurePipelineRunState.COMPLETED
         result = AzurePipelineRunResult.SUCCEEDED
         return AzurePipelineRunStatus(state = state, result = result)
@@ -37,8 +67,56 @@ class DryRunPipelineAPI(BasePipelineAPI):
         return AzurePipelineApproval(
             id = str(fake_id),
             run_id = run_id,
-            status = 'pending'
+            status = 'pending',
+            definition_id = self.runner.definition_id
         )
+
+    def list_approvals(self) -> List[AzurePipelineApproval]:
+        with self._approvals_lock:
+            pending = list(self._pending_approvals.get(self.runner.project_name, dict()).items())
+        return [
+            AzurePipelineApproval(
+                id = f'dry-run-{run_id}',
+                run_id = run_id,
+                status = 'pending',
+                definition_id = definition_id
+            )
+            for run_id, definition_id in pending
+        ]
     
-    def approve_run(self, *args, **kwargs) -> None:
+    def approve_run(self, run_id: str, approval_id: str) -> None:
+        self._forget(run_id)
         return None
+
+    def cancel_run(self, run_id: str) -> None:
+        logger.info(f"[DRY RUN] Would cancel run {run_id}")
+        self._forget(run_id)
+        return None
+
+    def _forget(self, run_id: str) -> None:
+        with self._approvals_lock:
+            runs = self._pending_approvals.get(self.runner.project_name)
+            if runs is not None:
+                runs.pop(str(run_id), None)
+                if not runs:
+                    del self._pending_approvals[self.runner.project_name]
+
+    def get_branch_commit(self) -> Optional[str]:
+        return f'dry-run-{self.runner.branch_name}'
+
+    def get_agent_pool(self) -> Optional[AgentPool]:
+        return AgentPool(id = 'dry-run', name = 'Dry run pool')
+
+    def get_agent_pool_capacity(self, pool_id: str) -> Optional[AgentPoolCapacity]:
+        now = time.monotonic()
+        with self._pool_lock:
+            self._forget_free_agents(now)
+            busy = len(self._busy_until)
+        return AgentPoolCapacity(
+            free_agents = max(0, self.SIMULATED_AGENTS - busy),
+            queued_jobs = max(0, busy - self.SIMULATED_AGENTS)
+        )
+
+    def _forget_free_agents(self, now: float) -> None:
+        ''' The lock of the pool must be held '''
+        self._busy_until[:] = [ until for until in self._busy_until if until > now ]
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import statistics
+import threading
+import time
+
+from pathlib import Path
+from typing import Dict, Optional
+
+from pipelinerunner.shared.util.json import load_json_from_file
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+class DurationHistory:
+    '''
+    How long the past successful runs took, keyed by project, definition and a fingerprint of the parameters.
+    A run without history of its own parameters is estimated from the other runs of the same definition.
+    Without a path it is kept in memory only (e.g. dry runs, whose durations mean nothing).
+    '''
+    MAX_SAMPLES = 20  # per key, the most recent ones
+    MAX_KEYS = 5000  # the least recently updated ones are dropped first
+
+    def __init__(self, path: Optional[Path] = None, max_samples: int = MAX_SAMPLES, max_keys: int = MAX_KEYS):
+        self.path = path
+        self.max_samples = max_samples
+        self.max_keys = max_keys
+        self._entries: Dict[str, Dict] = dict()  # key -> {"samples": [...], "updated_at": epoch}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def fingerprint(params: Dict) -> str:
+        canonical = json.dumps(params or {}, sort_keys = True, default = str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+    @classmethod
+    def key(cls, project_name: str, definition_id: str, params: Dict) -> str:
+        return f'{project_name}/{definition_id}/{cls.fingerprint(params)}'
+
+    def expected(self, project_name: str, definition_id: str, params: Dict) -> Optional[float]:
+        ''' Median of the past durations (in seconds), None when the definition never ran '''
+        key = self.key(project_name, definition_id, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['samples']:
+                return statistics.median(entry['samples'])
+            prefix = f'{project_name}/{definition_id}/'
+            samples = [ s for k, e in self._entries.items() if k.startswith(prefix) for s in e['samples'] ]
+        return statistics.median(samples) if samples else None
+
+    def record(self, project_name: str, definition_id: str, params: Dict, seconds: float) -> None:
+        key = self.key(project_name, definition_id, params)
+        with self._lock:
+            entry = self._entries.setdefault(key, { 'samples': list(), 'updated_at': 0 })
+            entry['samples'] = (entry['samples'] + [ round(seconds, 1) ])[-self.max_samples:]
+            entry['updated_at'] = int(time.time())
+            self._dirty = True
+
+    def save(self) -> None:
+        if self.path is None or not self._dirty:
+            return
+        with self._lock:
+            entries = sorted(self._entries.items(), key = lambda item: item[1]['updated_at'])[-self.max_keys:]
+            content = { 'version': 1, 'durations': dict(entries) }
+            self._dirty = False
+        try:
+            self.path.parent.mkdir(parents = True, exist_ok = True)
+            temporary = self.path.with_suffix('.tmp')
+            with open(temporary, 'w') as f:
+                json.dump(content, f)
+            os.replace(temporary, self.path)  # a crash never leaves a half written file behind
+        except OSError as exc:
+            logger.warning(f'Failed to save the duration history on {self.path}: {exc}')
+
+    def _load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            content = load_json_from_file(self.path)
+            self._entries = dict(content.get('durations', {}))
+        except (OSError, ValueError, AttributeError) as exc:
+            logger.warning(f'Ignoring the duration history on {self.path}: {exc}')
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DurationHistoryFactory:
+    @staticmethod
+    def create(in_memory: bool = False) -> DurationHistory:
+        if in_memory:
+            return DurationHistory()
+        return DurationHistory(Path.home() / '.pipelinerunner' / 'history' / 'durations.json')
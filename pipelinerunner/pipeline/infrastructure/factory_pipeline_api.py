@@ -1,12 +1,26 @@
+from typing import Optional
+
 from pipelinerunner.runner.application.model import RunnerModel
 from pipelinerunner.pipeline.infrastructure.pipeline_api import BasePipelineAPI
 from pipelinerunner.pipeline.infrastructure.azure_pipeline_api import AzurePipelineAPI
 from pipelinerunner.pipeline.infrastructure.dry_run_pipeline_api import DryRunPipelineAPI
+from pipelinerunner.pipeline.infrastructure.async_pipeline_api import BaseAsyncPipelineAPI
+from pipelinerunner.pipeline.infrastructure.async_azure_pipeline_api import AsyncAzurePipelineAPI
+from pipelinerunner.pipeline.infrastructure.async_dry_run_pipeline_api import AsyncDryRunPipelineAPI
+from pipelinerunner.pipeline.infrastructure.session_pool import AzureSessionPool
 
 
 class PipelineAPIFactory:
     @staticmethod
-    def create(runner: RunnerModel, dry_run: bool = False) -> BasePipelineAPI:
+    def create(runner: RunnerModel, dry_run: bool = False, session_pool: Optional[AzureSessionPool] = None) -> BasePipelineAPI:
         if dry_run:
             return DryRunPipelineAPI(runner)
-        return AzurePipelineAPI(runner)
+        return AzurePipelineAPI(runner, session_pool = session_pool)
+
+
+class AsyncPipelineAPIFactory:
+    @staticmethod
+    def create(runner: RunnerModel, dry_run: bool = False, session_pool: Optional[AzureSessionPool] = None) -> BaseAsyncPipelineAPI:
+        if dry_run:
+            return AsyncDryRunPipelineAPI(runner)
+        return AsyncAzurePipelineAPI(runner, session_pool = session_pool)
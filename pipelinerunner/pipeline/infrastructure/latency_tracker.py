@@ -0,0 +1,75 @@
+import re
+import threading
+
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional
+from urllib.parse import urlparse
+
+
+@dataclass(frozen = True)
+class LatencySummary:
+    endpoint: str
+    samples: int
+    p50: float
+    p95: float
+    p99: float
+
+    def __str__(self) -> str:
+        return (
+            f'{self.endpoint}: {self.samples} request(s), '
+            f'p50 = {self.p50 * 1000:.0f}ms, p95 = {self.p95 * 1000:.0f}ms, p99 = {self.p99 * 1000:.0f}ms'
+        )
+
+
+class LatencyTracker:
+    '''
+    Keeps the most recent latencies of every endpoint, so the percentiles follow how Azure behaves right now.
+    Endpoints are keyed by method and path, with ids replaced by a placeholder.
+    '''
+    WINDOW = 500  # samples kept per endpoint
+
+    def __init__(self, window: int = WINDOW):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def endpoint_key(method: str, url: str) -> str:
+        path = urlparse(url).path
+        if '/_apis/' in path:  # the organization and project do not matter here
+            path = path[path.index('/_apis/'):]
+        path = re.sub(r'/\d+(?=/|$)', '/{id}', path)
+        return f'{method.upper()} {path}'
+
+    def record(self, endpoint: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if samples is None:
+                samples = self._samples[endpoint] = deque(maxlen = self.window)
+            samples.append(seconds)
+
+    def percentile(self, endpoint: str, percentile: float, min_samples: int = 1) -> Optional[float]:
+        ''' None while there are not enough samples to trust it '''
+        with self._lock:
+            samples = sorted(self._samples.get(endpoint, ()))
+        if len(samples) < max(1, min_samples):
+            return None
+        index = min(len(samples) - 1, int(round(percentile / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def summary(self) -> List[LatencySummary]:
+        with self._lock:
+            endpoints = list(self._samples.keys())
+        summaries = list()
+        for endpoint in sorted(endpoints):
+            with self._lock:
+                samples = len(self._samples[endpoint])
+            summaries.append(LatencySummary(
+                endpoint = endpoint,
+                samples = samples,
+                p50 = self.percentile(endpoint, 50),
+                p95 = self.percentile(endpoint, 95),
+                p99 = self.percentile(endpoint, 99)
+            ))
+        return summaries
@@ -1,8 +1,20 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Optional
+from datetime import datetime
+from typing import Collection, Dict, List, Optional
 
 from pipelinerunner.runner.application.model import RunnerModel
-from pipelinerunner.pipeline.application.model import AzurePipelineRunInfo, AzurePipelineRunStatus, AzurePipelineApproval
+from pipelinerunner.pipeline.application.model import (
+    AzurePipelineRunInfo,
+    AzurePipelineRunStatus,
+    AzurePipelineApproval,
+    AgentPool,
+    AgentPoolCapacity
+)
+from pipelinerunner.pipeline.domain.exceptions import AzurePipelineAPIError
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
 
 
 class BasePipelineAPI(ABC):
@@ -12,12 +24,60 @@ class BasePipelineAPI(ABC):
     @abstractmethod
     def trigger_pipeline(self, params: Dict) -> AzurePipelineRunInfo: pass
 
+    def wait_until_available(self) -> None:
+        ''' Blocks while the service is known to be unavailable '''
+        return None
+
+    def find_triggered_run(self, params: Dict, since: datetime, exclude: Collection[str] = ()) -> Optional[AzurePipelineRunInfo]:
+        ''' Looks for a run created since the given (UTC) time with the same parameters and branch, ignoring the excluded run ids '''
+        return None
+
     @abstractmethod
     def get_run_status(self, run_id: str) -> AzurePipelineRunStatus: pass
 
+    def get_runs_status(self, run_ids: List[str]) -> Dict[str, AzurePipelineRunStatus]:
+        ''' Status of many runs at once. Implementations should override it with a batched query. '''
+        return { run_id: self.get_run_status(run_id) for run_id in run_ids }
+
     @abstractmethod
     def get_approval_status(self, run_id: str) -> Optional[AzurePipelineApproval]: pass
     
+    @abstractmethod
+    def list_approvals(self) -> List[AzurePipelineApproval]:
+        ''' All the pending approvals of the project of the runner, whatever the pipeline '''
+        pass
+
     @abstractmethod
     def approve_run(self, run_id: str, approval_id: str) -> None: pass
-    
\ No newline at end of file
+
+    @abstractmethod
+    def cancel_run(self, run_id: str) -> None:
+        ''' Asks Azure to cancel the run, which is not finished right away: it goes through a cancelling state first '''
+        pass
+
+    def get_branch_commit(self) -> Optional[str]:
+        ''' The commit the branch of the runner points at, None when it is unknown (e.g. the repository is not on Azure Repos) '''
+        return None
+
+    def get_agent_pool(self) -> Optional[AgentPool]:
+        ''' The agent pool of the default queue of the pipeline, None when it is unknown '''
+        return None
+
+    def get_agent_pool_capacity(self, pool_id: str) -> Optional[AgentPoolCapacity]:
+        ''' Free agents and queued jobs of the pool, None when it is unknown '''
+        return None
+
+    def approve_many(self, approvals: List[AzurePipelineApproval]) -> Dict[str, bool]:
+        '''
+        Approves many runs at once and tells, by approval id, whether each one was approved.
+        Implementations should override it with a bulk request.
+        '''
+        results = dict()
+        for approval in approvals:
+            try:
+                self.approve_run(run_id = approval.run_id, approval_id = approval.id)
+                results[approval.id] = True
+            except AzurePipelineAPIError as exc:
+                logger.error(str(exc))
+                results[approval.id] = False
+        return results
@@ -0,0 +1,143 @@
+import threading
+import time
+
+from email.utils import parsedate_to_datetime
+from http import HTTPStatus
+from typing import Mapping, Optional
+
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+class RequestGovernor:
+    '''
+    Process-wide gate that every Azure DevOps request passes through.
+    A token bucket caps the request rate and a congestion window caps the requests in flight.
+    The window starts small and grows on success (slow start) until the first throttling signal,
+    then it is halved and the whole process backs off as long as Azure asks it to.
+    Reference: https://learn.microsoft.com/en-us/azure/devops/integrate/concepts/rate-limits
+    '''
+    DEFAULT_RATE = 20.0  # requests per second
+    DEFAULT_BURST = 40
+    INITIAL_WINDOW = 2
+    MAX_WINDOW = 64
+
+    _shared: Optional['RequestGovernor'] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self,
+                 rate: float = DEFAULT_RATE,
+                 burst: int = DEFAULT_BURST,
+                 initial_window: int = INITIAL_WINDOW,
+                 max_window: int = MAX_WINDOW):
+        self.rate = rate
+        self.burst = burst
+        self.max_window = max_window
+        self.window = float(initial_window)
+        self.slow_start_threshold = float(max_window)
+        self.throttled_count = 0
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    @classmethod
+    def shared(cls) -> 'RequestGovernor':
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def acquire(self) -> None:
+        ''' Blocks until the request is allowed to go out '''
+        with self._condition:
+            while True:
+                wait = self._time_to_wait()
+                if wait <= 0:
+                    self._tokens -= 1
+                    self._in_flight += 1
+                    return
+                self._condition.wait(wait)
+
+    def _time_to_wait(self) -> float:
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+        if self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        if self._in_flight >= int(self.window):
+            return 1.0  # woken up earlier by release()
+        return 0
+
+    def release(self, status_code: Optional[int] = None, headers: Optional[Mapping[str, str]] = None) -> None:
+        ''' Gives the slot back and learns from the response (None when the request failed without one) '''
+        with self._condition:
+            self._in_flight -= 1
+            if status_code is not None:
+                self._learn(status_code, headers or {})
+            self._condition.notify_all()
+
+    def _learn(self, status_code: int, headers: Mapping[str, str]) -> None:
+        retry_after = self._parse_retry_after(headers.get('Retry-After'))
+        remaining = self._parse_float(headers.get('X-RateLimit-Remaining'))
+        reset_at = self._parse_float(headers.get('X-RateLimit-Reset'))
+        delayed = self._parse_float(headers.get('X-RateLimit-Delay'))
+
+        if status_code in (HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.SERVICE_UNAVAILABLE) or retry_after:
+            self.throttled_count += 1
+            self._back_off(retry_after if retry_after is not None else 1.0)
+            return
+
+        if remaining is not None and remaining <= 0 and reset_at:
+            self._back_off(max(0.0, reset_at - time.time()))
+            return
+
+        if delayed:  # Azure is already delaying our requests, we are close to the limit
+            self._shrink_window()
+            return
+
+        self._grow_window()
+
+    def _back_off(self, seconds: float) -> None:
+        self._shrink_window()
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        logger.warning(f'Azure DevOps is throttling the requests, backing off for {seconds:.1f} second(s) (window = {int(self.window)})')
+
+    def _shrink_window(self) -> None:
+        self.slow_start_threshold = max(1.0, self.window / 2)
+        self.window = self.slow_start_threshold
+
+    def _grow_window(self) -> None:
+        if self.window < self.slow_start_threshold:
+            self.window += 1  # slow start, it doubles every round trip
+        else:
+            self.window += 1 / self.window  # congestion avoidance, it grows linearly
+        self.window = min(self.window, float(self.max_window))
+
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:  # it can also be an HTTP date
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _parse_float(value: Optional[str]) -> Optional[float]:
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+
+    def __str__(self) -> str:
+        return f'Request governor: window = {int(self.window)}, throttled {self.throttled_count} time(s)'
@@ -0,0 +1,106 @@
+import threading
+import requests
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+T = TypeVar("T")
+
+
+@dataclass
+class CachedResponse:
+    etag: Optional[str]
+    last_modified: Optional[str]
+    value: Any
+    size: int  # bytes of the body, which a 304 does not send again
+
+
+@dataclass
+class ResponseCacheStats:
+    hits: int = 0
+    misses: int = 0
+    bytes_saved: int = 0
+    _lock: threading.Lock = field(default_factory = threading.Lock, repr = False, compare = False)
+
+    def hit(self, size: int) -> None:
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += size
+
+    def miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+
+    def __str__(self) -> str:
+        total = self.hits + self.misses
+        ratio = (self.hits / total * 100) if total else 0
+        return f'{self.hits} hit(s) and {self.misses} miss(es) ({ratio:.0f}%), {self.bytes_saved / 1024:.1f} KiB not downloaded again'
+
+
+class ResponseCache:
+    '''
+    Conditional GET cache keyed by endpoint.
+    It keeps the ETag/Last-Modified of every response and sends them back as If-None-Match/If-Modified-Since.
+    On a 304 the parsed object of the previous response is returned, so the body is neither downloaded nor decoded again.
+    '''
+    MAX_ENTRIES = 1000
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.stats = ResponseCacheStats()
+        self._entries: 'OrderedDict[Tuple, CachedResponse]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self,
+            fetch: Callable[..., requests.Response],
+            url: str,
+            parse: Callable[[requests.Response], T],
+            params: Optional[Dict] = None,
+            **kwargs) -> T:
+        ''' The parse function gets only fresh responses, so it is in charge of raising on errors '''
+        key = (url, tuple(sorted((params or {}).items())))
+        cached = self._lookup(key)
+        headers = dict()
+        if cached and cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached and cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+
+        response = fetch(url, params = params, headers = headers, **kwargs)
+        if cached and response.status_code == HTTPStatus.NOT_MODIFIED:
+            self.stats.hit(cached.size)
+            return cached.value
+
+        self.stats.miss()
+        value = parse(response)
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status_code == HTTPStatus.OK and (etag or last_modified):
+            self._store(key, CachedResponse(etag, last_modified, value, len(response.content)))
+        return value
+
+    def _lookup(self, key: Tuple) -> Optional[CachedResponse]:
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+            return cached
+
+    def _store(self, key: Tuple, cached: CachedResponse) -> None:
+        with self._lock:
+            self._entries[key] = cached
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:  # least recently used first
+                self._entries.popitem(last = False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
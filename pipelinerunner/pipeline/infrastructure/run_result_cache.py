@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from pathlib import Path
+from typing import Dict, Optional
+
+from pipelinerunner.shared.util.json import load_json_from_file
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+class RunResultCache:
+    '''
+    The successful runs of the past batches, keyed by a fingerprint of everything that goes into a run
+    (pipeline, branch commit and parameters), so an identical run can be skipped.
+    Entries expire after the retention and the least recently used ones are dropped first.
+    Without a path it is kept in memory only (e.g. dry runs, whose runs never happened).
+    '''
+    RETENTION = 7 * 24 * 3600  # seconds, whatever the freshness asked by the batch
+    MAX_KEYS = 5000
+
+    def __init__(self, path: Optional[Path] = None, retention: float = RETENTION, max_keys: int = MAX_KEYS):
+        self.path = path
+        self.retention = retention
+        self.max_keys = max_keys
+        self._entries: Dict[str, Dict] = dict()  # fingerprint -> {"run_id": ..., "recorded_at": epoch, "used_at": epoch}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def fingerprint(project_name: str, definition_id: str, branch_name: str, commit: Optional[str], params: Dict) -> str:
+        canonical = json.dumps([ project_name, str(definition_id), branch_name, commit, params or {} ], sort_keys = True, default = str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:32]
+
+    def lookup(self, fingerprint: str, max_age: float) -> Optional[str]:
+        ''' The run id of a successful run with the same fingerprint recorded less than max_age seconds ago '''
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is None or now - entry['recorded_at'] > min(max_age, self.retention):
+                return None
+            entry['used_at'] = int(now)
+            self._dirty = True
+            return entry['run_id']
+
+    def record(self, fingerprint: str, run_id: str) -> None:
+        now = int(time.time())
+        with self._lock:
+            self._entries[fingerprint] = { 'run_id': str(run_id), 'recorded_at': now, 'used_at': now }
+            self._dirty = True
+
+    def save(self) -> None:
+        if self.path is None or not self._dirty:
+            return
+        oldest = time.time() - self.retention
+        with self._lock:
+            entries = [ item for item in self._entries.items() if item[1]['recorded_at'] >= oldest ]
+            entries = sorted(entries, key = lambda item: item[1]['used_at'])[-self.max_keys:]
+            content = { 'version': 1, 'runs': dict(entries) }
+            self._dirty = False
+        try:
+            self.path.parent.mkdir(parents = True, exist_ok = True)
+            temporary = self.path.with_suffix('.tmp')
+            with open(temporary, 'w') as f:
+                json.dump(content, f)
+            os.replace(temporary, self.path)
+        except OSError as exc:
+            logger.warning(f'Failed to save the run results on {self.path}: {exc}')
+
+    def _load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            content = load_json_from_file(self.path)
+            self._entries = dict(content.get('runs', {}))
+        except (OSError, ValueError, AttributeError) as exc:
+            logger.warning(f'Ignoring the run results on {self.path}: {exc}')
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RunResultCacheFactory:
+    @staticmethod
+    def create(in_memory: bool = False) -> RunResultCache:
+        if in_memory:
+            return RunResultCache()
+        return RunResultCache(Path.home() / '.pipelinerunner' / 'history' / 'results.json')
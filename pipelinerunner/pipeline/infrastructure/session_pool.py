@@ -0,0 +1,271 @@
+import base64
+import socket
+import threading
+import time
+import requests
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Callable, Dict, List, Optional, TypeVar
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+from pipelinerunner.pipeline.infrastructure.request_governor import RequestGovernor
+from pipelinerunner.pipeline.infrastructure.response_cache import ResponseCache
+from pipelinerunner.pipeline.infrastructure.latency_tracker import LatencyTracker
+from pipelinerunner.pipeline.infrastructure.circuit_breaker import CircuitBreaker
+from pipelinerunner.pipeline.domain.exceptions import AzurePipelineAPIUnavailableError
+from pipelinerunner.config import DevOpsConfig
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+T = TypeVar("T")
+
+
+@dataclass
+class SessionStats:
+    organization_name: str
+    connections_opened: int = 0
+    requests_served: int = 0
+    requests_hedged: int = 0
+    _lock: threading.Lock = field(default_factory = threading.Lock, repr = False, compare = False)
+
+    def connection_opened(self) -> None:
+        with self._lock:
+            self.connections_opened += 1
+
+    def request_served(self) -> None:
+        with self._lock:
+            self.requests_served += 1
+
+    def request_hedged(self) -> None:
+        with self._lock:
+            self.requests_hedged += 1
+
+    def __str__(self) -> str:
+        hedged = f' ({self.requests_hedged} hedged)' if self.requests_hedged else ''
+        return (
+            f'Organization "{self.organization_name}": '
+            f'{self.connections_opened} connection(s) opened for {self.requests_served} request(s) served{hedged}'
+        )
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    ''' HTTPAdapter that counts every new TCP/TLS connection opened by its pools '''
+    def __init__(self, stats: SessionStats, keep_alive: bool = True, **kwargs):
+        self.stats = stats
+        self.keep_alive = keep_alive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections: int, maxsize: int, block: bool = False, **pool_kwargs):
+        if self.keep_alive:
+            pool_kwargs['socket_options'] = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            ]
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: self._counting(pool_cls)
+            for scheme, pool_cls in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+    def _counting(self, pool_cls: type) -> type:
+        stats = self.stats
+
+        class CountingConnectionPool(pool_cls):
+            def _new_conn(self):
+                stats.connection_opened()
+                return super()._new_conn()
+
+        return CountingConnectionPool
+
+
+class AzureSession:
+    ''' A keep-alive HTTP session bound to one Azure DevOps organization '''
+    MAX_THROTTLED_RETRIES = 5
+    DEFAULT_TIMEOUT = (5, 30)  # (connect, read) seconds, when the caller does not give one
+    HEDGING_PERCENTILE = 95
+    HEDGING_MIN_SAMPLES = 20  # the percentile is not trusted before it
+    HEDGING_MIN_DELAY = 0.05  # seconds, below it the second request costs more than it saves
+    HEDGING_BUDGET = 0.1  # at most this fraction of the requests is hedged, so a slow Azure is not doubly loaded
+
+    def __init__(self,
+                 organization_name: str,
+                 personal_access_token: str,
+                 pool_size: int,
+                 keep_alive: bool = True,
+                 governor: Optional[RequestGovernor] = None,
+                 hedging: bool = False):
+        self.organization_name = organization_name
+        self.governor = governor or RequestGovernor.shared()
+        self.stats = SessionStats(organization_name = organization_name)
+        self.response_cache = ResponseCache()
+        self.latency = LatencyTracker()
+        self.circuit = CircuitBreaker(name = f'Azure DevOps organization "{organization_name}"')
+        self.hedging = hedging
+        self._hedging_executor = ThreadPoolExecutor(max_workers = pool_size, thread_name_prefix = 'hedged-request') if hedging else None
+        self._session = requests.Session()
+        self._session.headers.update(self._build_headers(personal_access_token, keep_alive))
+        adapter = CountingHTTPAdapter(
+            stats = self.stats,
+            keep_alive = keep_alive,
+            pool_connections = pool_size,
+            pool_maxsize = pool_size
+        )
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+    @staticmethod
+    def _build_headers(personal_access_token: str, keep_alive: bool) -> Dict[str, str]:
+        auth = base64.b64encode(f":{personal_access_token}".encode("ascii")).decode("ascii")
+        return {
+            "Authorization": f"Basic {auth}",
+            "Content-Type": "application/json",
+            "Connection": "keep-alive" if keep_alive else "close"
+        }
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        ''' Every request goes through the governor and throttled ones are retried once it allows them again '''
+        kwargs.setdefault('timeout', self.DEFAULT_TIMEOUT)  # a stalled connection must never block forever
+        endpoint = LatencyTracker.endpoint_key(method, url)
+        for attempt in range(self.MAX_THROTTLED_RETRIES + 1):
+            if not self.circuit.allow_request():
+                raise AzurePipelineAPIUnavailableError(
+                    f'❌ Azure DevOps is unavailable, {method} {url} not sent (retry in {self.circuit.retry_in():.0f}s)'
+                )
+            self.governor.acquire()
+            started_at = time.monotonic()
+            try:
+                response = self._session.request(method, url, **kwargs)
+            except requests.RequestException:
+                self.governor.release()
+                self.circuit.record_failure()
+                raise
+            self.latency.record(endpoint, time.monotonic() - started_at)
+            self.governor.release(response.status_code, response.headers)
+            if response.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR:
+                self.circuit.record_failure()
+            else:
+                self.circuit.record_success()  # even a 4xx or a 429 means the service is answering
+            self.stats.request_served()
+            if response.status_code != HTTPStatus.TOO_MANY_REQUESTS:
+                return response
+            logger.debug(f'Request {method} {url} throttled (attempt {attempt + 1})')
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def get_cached(self, url: str, parse: Callable[[requests.Response], T], params: Optional[Dict] = None, **kwargs) -> T:
+        ''' Conditional (and maybe hedged) GET, see ResponseCache '''
+        return self.response_cache.get(self.idempotent_get, url, parse, params = params, **kwargs)
+
+    def idempotent_get(self, url: str, **kwargs) -> requests.Response:
+        '''
+        When hedging is on and the first attempt takes longer than the p95 latency of the endpoint,
+        a second one is sent and whichever answers first wins. It is only safe for requests without side effects.
+        '''
+        threshold = self._hedging_threshold(url)
+        if threshold is None:
+            return self.get(url, **kwargs)
+
+        first = self._hedging_executor.submit(self.get, url, **kwargs)
+        done, _ = wait([ first ], timeout = threshold)
+        if done or not self._within_hedging_budget():
+            return first.result()
+
+        logger.debug(f'GET {url} is taking more than {threshold * 1000:.0f}ms, hedging it')
+        self.stats.request_hedged()
+        pending = { first, self._hedging_executor.submit(self.get, url, **kwargs) }
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when = FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.add_done_callback(self._discard)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _hedging_threshold(self, url: str) -> Optional[float]:
+        if not self.hedging:
+            return None
+        threshold = self.latency.percentile(
+            LatencyTracker.endpoint_key('GET', url),
+            self.HEDGING_PERCENTILE,
+            min_samples = self.HEDGING_MIN_SAMPLES
+        )
+        return max(threshold, self.HEDGING_MIN_DELAY) if threshold is not None else None
+
+    def _within_hedging_budget(self) -> bool:
+        return self.stats.requests_hedged < self.stats.requests_served * self.HEDGING_BUDGET
+
+    @staticmethod
+    def _discard(future: Future) -> None:
+        if future.exception() is None:
+            future.result().close()
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url: str, **kwargs) -> requests.Response:
+        return self.request('PATCH', url, **kwargs)
+
+    def close(self) -> None:
+        if self._hedging_executor:
+            self._hedging_executor.shutdown(wait = False, cancel_futures = True)
+        self.response_cache.clear()
+        self._session.close()
+
+
+class AzureSessionPool:
+    ''' Thread-safe registry of keep-alive sessions, one per Azure DevOps organization '''
+    DEFAULT_POOL_SIZE = 20
+
+    def __init__(self,
+                 pool_size: int = DEFAULT_POOL_SIZE,
+                 keep_alive: bool = True,
+                 governor: Optional[RequestGovernor] = None,
+                 hedging: bool = False):
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.hedging = hedging
+        self.governor = governor or RequestGovernor.shared()  # process-wide unless told otherwise
+        self._sessions: Dict[str, AzureSession] = dict()
+        self._lock = threading.Lock()
+
+    def get(self, organization_name: Optional[str] = None) -> AzureSession:
+        organization_name = organization_name or DevOpsConfig.organization_name
+        with self._lock:
+            session = self._sessions.get(organization_name)
+            if session is None:
+                logger.debug(f'Creating HTTP session for organization "{organization_name}" (pool size = {self.pool_size})')
+                session = AzureSession(
+                    organization_name = organization_name,
+                    personal_access_token = DevOpsConfig.personal_access_token,
+                    pool_size = self.pool_size,
+                    keep_alive = self.keep_alive,
+                    governor = self.governor,
+                    hedging = self.hedging
+                )
+                self._sessions[organization_name] = session
+            return session
+
+    def stats(self) -> List[SessionStats]:
+        with self._lock:
+            return [ session.stats for session in self._sessions.values() ]
+
+    def sessions(self) -> List[AzureSession]:
+        with self._lock:
+            return list(self._sessions.values())
+
+    def close(self) -> None:
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
@@ -0,0 +1,232 @@
+import json
+import sqlite3
+import threading
+import time
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from pipelinerunner.pipeline.domain.exceptions import WorkQueueError
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+@dataclass(frozen = True)
+class QueuedRun:
+    id: int
+    batch_id: str
+    position: int  # of the run in its runner, as in the file
+    runner: Dict  # serialized runner, without its runs
+    parameters: Dict
+    priority: int
+    attempts: int
+    run_id: Optional[str]  # set when a previous worker already triggered it
+
+
+class WorkQueue:
+    '''
+    Runs waiting to be triggered, shared by every worker through a SQLite database.
+    A worker claims runs with a lease it must renew; when a worker dies its lease expires and another worker
+    reclaims the runs, re-attaching to the ones already triggered instead of triggering them again.
+    Every change is a short IMMEDIATE transaction, so concurrent workers never claim the same run.
+    The rollback journal (not WAL) is used, as WAL does not work on network filesystems shared by several hosts.
+    '''
+    PENDING = 'pending'
+    CLAIMED = 'claimed'
+    DONE = 'done'
+    MAX_ATTEMPTS = 5  # a run whose workers keep dying is given up
+    BUSY_TIMEOUT = 30  # seconds to wait for the lock held by another worker
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            batch_id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            runner TEXT NOT NULL,
+            parameters TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            state TEXT NOT NULL,
+            worker TEXT,
+            lease_until REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_id TEXT,
+            result TEXT,
+            enqueued_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS runs_by_state ON runs (state, priority, id);
+    '''
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            self.path.parent.mkdir(parents = True, exist_ok = True)
+            self._db = sqlite3.connect(str(path), timeout = self.BUSY_TIMEOUT, isolation_level = None, check_same_thread = False)
+            self._db.executescript(self.SCHEMA)
+        except sqlite3.Error as exc:
+            raise WorkQueueError(f'Unable to open the work queue {path}: {exc}')
+
+    def enqueue(self, batch_id: str, runners: List[Dict]) -> int:
+        ''' Every run of the given (serialized) runners, in one transaction '''
+        now = time.time()
+        rows = list()
+        for runner in runners:
+            template = { k: v for k, v in runner.items() if k != 'runs' }
+            for position, run in enumerate(runner.get('runs') or [], 1):
+                rows.append((batch_id, position, json.dumps(template), json.dumps(run['parameters']), run.get('priority', 0), self.PENDING, now, now))
+        with self._transaction() as db:
+            db.executemany(
+                'INSERT INTO runs (batch_id, position, runner, parameters, priority, state, enqueued_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+        return len(rows)
+
+    def claim(self, worker: str, limit: int, lease: float) -> List[QueuedRun]:
+        ''' Takes up to limit runs, the pending ones and the ones whose lease expired (their worker is gone) '''
+        if limit < 1:
+            return list()
+        now = time.time()
+        with self._transaction() as db:
+            abandoned = db.execute(
+                'UPDATE runs SET state = ?, result = ?, worker = NULL, lease_until = NULL, updated_at = ? '
+                'WHERE state = ? AND lease_until < ? AND attempts >= ?',
+                (self.DONE, 'abandoned', now, self.CLAIMED, now, self.MAX_ATTEMPTS)
+            ).rowcount
+            rows = db.execute(
+                'SELECT id, batch_id, position, runner, parameters, priority, attempts, run_id, state FROM runs '
+                'WHERE state = ? OR (state = ? AND lease_until < ?) ORDER BY priority DESC, id LIMIT ?',
+                (self.PENDING, self.CLAIMED, now, limit)
+            ).fetchall()
+            db.executemany(
+                'UPDATE runs SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?',
+                [ (self.CLAIMED, worker, now + lease, now, row[0]) for row in rows ]
+            )
+        if abandoned:
+            logger.error(f'{abandoned} run(s) given up after {self.MAX_ATTEMPTS} workers died holding them')
+        reclaimed = sum(1 for row in rows if row[8] == self.CLAIMED)
+        if reclaimed:
+            logger.warning(f'{reclaimed} run(s) reclaimed from workers whose lease expired')
+        return [
+            QueuedRun(
+                id = row[0],
+                batch_id = row[1],
+                position = row[2],
+                runner = self._load(row[3], row[0]),
+                parameters = self._load(row[4], row[0]),
+                priority = row[5],
+                attempts = row[6] + 1,
+                run_id = row[7]
+            )
+            for row in rows
+        ]
+
+    def triggered(self, run: QueuedRun, worker: str, run_id: str) -> bool:
+        ''' Records the run id right away, so a worker taking over the run re-attaches to it '''
+        return self._update(run, worker, 'run_id = ?', (str(run_id),))
+
+    def renew(self, runs: List[QueuedRun], worker: str, lease: float) -> Set[int]:
+        ''' Extends the leases still held by the worker, returns the ids of the runs it still holds '''
+        if not runs:
+            return set()
+        now = time.time()
+        with self._transaction() as db:
+            return {
+                run.id for run in runs
+                if db.execute(
+                    'UPDATE runs SET lease_until = ?, updated_at = ? WHERE id = ? AND state = ? AND worker = ?',
+                    (now + lease, now, run.id, self.CLAIMED, worker)
+                ).rowcount
+            }
+
+    def complete(self, run: QueuedRun, worker: str, result: str) -> bool:
+        ''' False when the lease was lost meanwhile (another worker owns the run now) '''
+        return self._update(run, worker, 'state = ?, result = ?, worker = NULL, lease_until = NULL', (self.DONE, result))
+
+    def release(self, runs: List[QueuedRun], worker: str) -> None:
+        ''' Gives the runs back (e.g. the worker is stopping), another worker takes them over right away '''
+        with self._transaction() as db:
+            db.executemany(
+                'UPDATE runs SET state = ?, worker = NULL, lease_until = NULL, attempts = attempts - 1, updated_at = ? '
+                'WHERE id = ? AND state = ? AND worker = ?',
+                [ (self.PENDING, time.time(), run.id, self.CLAIMED, worker) for run in runs ]
+            )
+
+    def counts(self, batch_id: Optional[str] = None) -> Dict[str, int]:
+        ''' Runs per state, and per result for the finished ones '''
+        query = 'SELECT state, result, COUNT(*) FROM runs {} GROUP BY state, result'
+        with self._lock:
+            if batch_id:
+                rows = self._db.execute(query.format('WHERE batch_id = ?'), (batch_id,)).fetchall()
+            else:
+                rows = self._db.execute(query.format('')).fetchall()
+        counts = { self.PENDING: 0, self.CLAIMED: 0, self.DONE: 0 }
+        for state, result, count in rows:
+            counts[state] = counts.get(state, 0) + count
+            if state == self.DONE and result:
+                counts[result] = counts.get(result, 0) + count
+        return counts
+
+    def has_open_runs(self) -> bool:
+        ''' Runs pending or being worked on, in any batch '''
+        counts = self.counts()
+        return counts[self.PENDING] + counts[self.CLAIMED] > 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _update(self, run: QueuedRun, worker: str, assignments: str, values: tuple) -> bool:
+        with self._transaction() as db:
+            updated = db.execute(
+                f'UPDATE runs SET {assignments}, updated_at = ? WHERE id = ? AND state = ? AND worker = ?',
+                (*values, time.time(), run.id, self.CLAIMED, worker)
+            ).rowcount
+        return updated == 1
+
+    @staticmethod
+    def _load(value: str, run_id: int) -> Dict:
+        try:
+            return json.loads(value)
+        except ValueError:
+            raise WorkQueueError(f'The queued run {run_id} is corrupted')
+
+    def _transaction(self) -> '_Transaction':
+        return _Transaction(self._db, self._lock)
+
+
+class _Transaction:
+    ''' BEGIN IMMEDIATE takes the write lock upfront, so two workers never read the same pending runs '''
+    def __init__(self, db: sqlite3.Connection, lock: threading.Lock):
+        self.db = db
+        self.lock = lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.lock.acquire()
+        try:
+            self.db.execute('BEGIN IMMEDIATE')
+        except sqlite3.Error as exc:
+            self.lock.release()
+            raise WorkQueueError(f'Unable to lock the work queue: {exc}')
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        try:
+            self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.lock.release()
+        return False
+
+
+class WorkQueueFactory:
+    @staticmethod
+    def default_path() -> Path:
+        return Path.home() / '.pipelinerunner' / 'queue' / 'queue.db'
+
+    @classmethod
+    def create(cls, path: Optional[str] = None) -> WorkQueue:
+        ''' The path must be on a filesystem shared by the workers of every host '''
+        return WorkQueue(Path(path) if path else cls.default_path())
@@ -1,10 +1,13 @@
 from typing import List, Dict, Optional
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field
 
 
 @dataclass
 class RunModel:
     parameters: Dict
+    name: Optional[str] = None  # referenced by depends_on as "<runner>/<name>", defaults to its position (1, 2, ...)
+    depends_on: List[str] = field(default_factory = list)
+    priority: int = 0  # higher ones are started first when the runs are throttled
 
 
 @dataclass
@@ -15,6 +18,8 @@ class RunnerModel:
     pipeline_name: str
     runs: List[RunModel]
     branch_name: Optional[str] = 'main'
+    max_in_flight: Optional[int] = None  # runs of this pipeline at the same time (window mode)
+    depends_on: List[str] = field(default_factory = list)  # runners (or "<runner>/<run>") that must succeed first
 
     def __str__(self) -> str:
         run_count = len(self.runs) if self.runs else 0
@@ -0,0 +1,357 @@
+import json
+import os
+import signal
+import socketserver
+import threading
+import time
+
+from dataclasses import asdict, dataclass, field, fields, replace
+from enum import Enum
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from pipelinerunner.runner.domain.executor_service import RunnerExecutorService
+from pipelinerunner.runner.infrastructure.daemon_client import DaemonClient, DaemonSocketFactory
+from pipelinerunner.pipeline.application.model import ExecutionOptions
+from pipelinerunner.pipeline.domain.batch_context import BatchContext
+from pipelinerunner.pipeline.domain.batch_orchestrator import PipelineBatchOrchestrator
+from pipelinerunner.pipeline.domain.enums import PipelineExecutionMode, RunOrder, ShardBy
+from pipelinerunner.pipeline.domain.exceptions import DaemonError
+from pipelinerunner.pipeline.infrastructure.batch_journal import BatchJournalFactory
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+def options_to_dict(options: ExecutionOptions) -> Dict:
+    return { name: value.value if isinstance(value, Enum) else value for name, value in asdict(options).items() }
+
+
+def options_from_dict(data: Dict) -> ExecutionOptions:
+    ''' Unknown options are ignored, so a client and a daemon of different versions still get along '''
+    known = { f.name for f in fields(ExecutionOptions) }
+    values = { name: value for name, value in data.items() if name in known }
+    if 'run_order' in values:
+        values['run_order'] = RunOrder.from_value(values['run_order'])
+    if 'shard_by' in values:
+        values['shard_by'] = ShardBy.from_value(values['shard_by'])
+    if values.get('wave_sizes') is not None:
+        values['wave_sizes'] = tuple(values['wave_sizes'])
+    if values.get('shard') is not None:
+        values['shard'] = tuple(values['shard'])
+    return ExecutionOptions(**values)
+
+
+@dataclass(eq = False)
+class DaemonBatch:
+    orchestrator: PipelineBatchOrchestrator
+    started_at: float = field(default_factory = time.time)
+    finished_at: Optional[float] = None
+    state: str = 'running'  # then finished, cancelled or error
+    error: Optional[str] = None
+
+    @property
+    def batch_id(self) -> str:
+        return self.orchestrator.context.journal.batch_id
+
+    def to_dict(self) -> Dict:
+        journal = self.orchestrator.context.journal
+        return {
+            'batch_id': self.batch_id,
+            'mode': self.orchestrator.mode.value,
+            'state': self.state,
+            'error': self.error,
+            'total': sum(len(runner.runs) for runner in self.orchestrator.runners),
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'runs': [
+                { 'key': key, 'run_id': run_id, 'result': journal.completed.get(key) }
+                for key, run_id in list(journal.run_ids.items())
+            ]
+        }
+
+
+class RunnerDaemon:
+    '''
+    Long-running process that executes the batches sent by the CLI over a Unix domain socket.
+    The connections to Azure DevOps, the status poller, the trigger cap, the agent pool gate, the duration history,
+    the results of the past runs and the runners stay warm across batches, and all the batches running at the same time share them.
+    The batches are journaled as usual, so the ones left running when the daemon stops can be resumed.
+    '''
+    MAX_FINISHED_BATCHES = 50  # kept for the status requests, the oldest ones are forgotten first
+    SHARED_OPTIONS = ('max_concurrent_triggers', 'http_pool_size', 'hedge_requests')  # set when the daemon starts, for all the batches
+
+    def __init__(self, options: ExecutionOptions, path: Optional[Path] = None):
+        self.options = options
+        self.path = path or DaemonSocketFactory.path()
+        self.warm = BatchContext.create(
+            replace(options, respect_agent_pools = True, incremental = True),  # only used by the batches asking for them
+            journal = BatchJournalFactory.create(in_memory = True)
+        )
+        self.service = RunnerExecutorService(mode = PipelineExecutionMode.PARALLEL)  # its repository caches the runners
+        self.batches: Dict[str, DaemonBatch] = dict()
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def serve(self) -> None:
+        if not DaemonSocketFactory.is_supported():
+            raise DaemonError('The daemon needs Unix domain sockets, which this platform does not have')
+        if DaemonClient(self.path).is_running():
+            raise DaemonError(f'A daemon is already listening on {self.path}')
+        if self.path.exists():
+            self.path.unlink()  # left behind by a daemon that died
+        self.path.parent.mkdir(parents = True, exist_ok = True)
+
+        BetterLogger.set_interactive(False)  # several batches at once, their progress bars cannot share the terminal
+        previous_umask = os.umask(0o177)  # the socket is created 0600: only the owner can send batches with their token
+        try:
+            server = _DaemonServer(str(self.path), _DaemonRequestHandler, self)
+        finally:
+            os.umask(previous_umask)
+        logger.success(f'Daemon listening on {self.path} (pid {os.getpid()}), stop it with Ctrl+C')
+        signal.signal(signal.SIGTERM, _stop_on_sigterm)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.path.unlink(missing_ok = True)
+            self._stop()
+
+    def handle(self, request: Dict) -> Dict:
+        handlers = {
+            'ping': self._ping,
+            'run': self._run,
+            'status': self._status,
+            'cancel': self._cancel
+        }
+        handler = handlers.get(request.get('op'))
+        if handler is None:
+            return { 'ok': False, 'error': f'Unknown operation "{request.get("op")}"' }
+        try:
+            return { 'ok': True, **handler(request) }
+        except DaemonError as exc:
+            return { 'ok': False, 'error': str(exc) }
+
+    def _ping(self, request: Dict) -> Dict:
+        return { 'pid': os.getpid(), 'uptime': time.time() - self.started_at, 'running': len(self._running()) }
+
+    def _run(self, request: Dict) -> Dict:
+        try:
+            options = options_from_dict(request.get('options') or {})
+            mode = PipelineExecutionMode.from_value(request.get('mode'))
+        except (ValueError, TypeError, AttributeError) as exc:  # sent by a client of another version, or by hand
+            raise DaemonError(f'Invalid batch: {exc}')
+        try:
+            if request.get('name'):
+                runners = self.service.load_from_name(request['name'], options)
+            else:
+                runners = self.service.load_from_file(request['from_file'], options)
+        except Exception as exc:
+            raise DaemonError(f'Unable to load the runners: {exc}')
+        if not runners:
+            raise DaemonError('Nothing to run (see the log of the daemon)')
+
+        batch = DaemonBatch(orchestrator = PipelineBatchOrchestrator(runners, mode, options, warm = self.warm))
+        with self._lock:
+            self.batches[batch.batch_id] = batch
+            self._forget_finished()
+        threading.Thread(target = self._execute, args = (batch,), name = f'batch-{batch.batch_id}', daemon = True).start()
+        logger.info(f'Batch {batch.batch_id} of {len(runners)} runner(s) started in {mode.value} mode')
+        return { 'batch_id': batch.batch_id, 'ignored_options': self._ignored_options(options) }
+
+    def _ignored_options(self, options: ExecutionOptions) -> Dict:
+        ''' The options of the batch that differ from the ones the daemon shares between all its batches, with the value used '''
+        return {
+            name: getattr(self.options, name) for name in self.SHARED_OPTIONS
+            if getattr(options, name) != getattr(self.options, name)
+        }
+
+    def _execute(self, batch: DaemonBatch) -> None:
+        try:
+            batch.orchestrator.run_all()
+            state = 'cancelled' if batch.orchestrator.context.canceller.is_cancelling() else 'finished'
+        except Exception as exc:
+            state = 'error'
+            batch.error = str(exc)
+            logger.error(f'Batch {batch.batch_id} failed: {exc}')
+        batch.finished_at = time.time()
+        batch.state = state  # last, a client seeing it no longer running gets the whole batch
+        logger.info(f'Batch {batch.batch_id} {batch.state}')
+
+    def _status(self, request: Dict) -> Dict:
+        batch_id = request.get('batch_id')
+        with self._lock:
+            batches = [ self._get(batch_id) ] if batch_id else list(self.batches.values())
+        return { 'batches': [ batch.to_dict() for batch in batches ] }
+
+    def _cancel(self, request: Dict) -> Dict:
+        with self._lock:
+            batch = self._get(request.get('batch_id'))
+        if batch.state != 'running':
+            raise DaemonError(f'Batch {batch.batch_id} is not running ({batch.state})')
+        cancelled = batch.orchestrator.context.canceller.cancel_all(reason = 'cancelled from the CLI')
+        return { 'cancelled': len(cancelled) }
+
+    def _get(self, batch_id: Optional[str]) -> DaemonBatch:
+        batch = self.batches.get(batch_id)
+        if batch is None:
+            raise DaemonError(f'No batch {batch_id} in the daemon')
+        return batch
+
+    def _running(self) -> List[DaemonBatch]:
+        return [ batch for batch in list(self.batches.values()) if batch.state == 'running' ]
+
+    def _forget_finished(self) -> None:
+        finished = [ batch for batch in self.batches.values() if batch.state != 'running' ]
+        for batch in sorted(finished, key = lambda b: b.finished_at)[:max(0, len(finished) - self.MAX_FINISHED_BATCHES)]:
+            del self.batches[batch.batch_id]
+
+    def _stop(self) -> None:
+        running = self._running()
+        for batch in running:
+            logger.warning(f'Batch {batch.batch_id} is left running, resume it with: pipeline run --resume {batch.batch_id}')
+        self.warm.close()
+        logger.info('Daemon stopped')
+
+
+def _stop_on_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
+
+class _DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, handler, daemon: RunnerDaemon):
+        self.daemon = daemon
+        super().__init__(path, handler)
+
+
+class _DaemonRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line)
+        except ValueError:
+            response = { 'ok': False, 'error': 'Invalid request' }
+        else:
+            response = self.server.daemon.handle(request)
+        self.wfile.write(json.dumps(response, default = str).encode('utf-8') + b'\n')
+
+
+class DaemonForwarder:
+    ''' The CLI side: sends the batch to the daemon and follows it, as if it ran in this process '''
+    FOLLOW_INTERVAL = 1  # seconds between two status requests
+
+    def __init__(self, client: DaemonClient):
+        self.client = client
+
+    def run(self, name: Optional[str], filename: Optional[str], mode: PipelineExecutionMode, options: ExecutionOptions) -> None:
+        try:
+            response = self.client.request(
+                'run',
+                name = name,
+                from_file = str(Path(filename).resolve()) if filename else None,  # the daemon has its own working directory
+                mode = mode.value,
+                options = options_to_dict(options)
+            )
+        except DaemonError as exc:
+            logger.error(str(exc))
+            return
+        batch_id = response['batch_id']
+        for name, value in (response.get('ignored_options') or {}).items():
+            option = '--' + name.replace('_', '-')
+            logger.warning(f'{option} is set when the daemon starts, this batch uses its value ({value}), not {getattr(options, name)}')
+        logger.info(f'Batch {batch_id} started by the daemon (follow it with: pipeline status {batch_id})')
+        if options.wait:
+            self.follow(batch_id)
+
+    def follow(self, batch_id: str) -> None:
+        ''' Prints every run as it starts and finishes, Ctrl+C cancels the batch '''
+        triggered = set()
+        completed = set()
+        try:
+            while True:
+                batch = self.client.request('status', batch_id = batch_id)['batches'][0]
+                for run in batch['runs']:
+                    if run['key'] not in triggered:
+                        triggered.add(run['key'])
+                        logger.info(f'Run {run["run_id"]} ({run["key"]}) started')
+                    if run['result'] and run['key'] not in completed:
+                        completed.add(run['key'])
+                        self._log_result(run)
+                if batch['state'] != 'running':
+                    break
+                time.sleep(self.FOLLOW_INTERVAL)
+        except KeyboardInterrupt:
+            logger.warning(f'Interrupted, cancelling batch {batch_id} in the daemon')
+            self.cancel(batch_id)
+            raise
+        except DaemonError as exc:
+            logger.error(f'Lost track of batch {batch_id}: {exc}')
+            return
+        self._log_end(batch)
+
+    def status(self, batch_id: Optional[str] = None) -> None:
+        try:
+            batches = self.client.request('status', batch_id = batch_id)['batches']
+        except DaemonError as exc:
+            logger.error(str(exc))
+            return
+        if not batches:
+            logger.info('No batch in the daemon')
+            return
+        rows = list()
+        for batch in batches:
+            results = [ run['result'] for run in batch['runs'] if run['result'] ]
+            succeeded = sum(1 for result in results if result == 'succeeded')
+            rows.append([
+                batch['batch_id'],
+                batch['mode'],
+                batch['state'],
+                f'{len(batch["runs"])}/{batch["total"]}',
+                f'{succeeded}/{len(results)}',
+                f'{(batch["finished_at"] or time.time()) - batch["started_at"]:.0f}s'
+            ])
+        logger.print_table(
+            title = f'Batches of the daemon ({len(batches)})',
+            columns = ["Batch", "Mode", "State", "Started", "Succeeded", "Elapsed"],
+            rows = rows
+        )
+        if batch_id:
+            logger.print_table(
+                title = f'Runs of batch {batch_id}',
+                columns = ["Run", "Run ID", "Result"],
+                rows = [ [ run['key'], run['run_id'], run['result'] or 'in progress' ] for run in batches[0]['runs'] ]
+            )
+
+    def cancel(self, batch_id: str) -> None:
+        try:
+            cancelled = self.client.request('cancel', batch_id = batch_id)['cancelled']
+        except DaemonError as exc:
+            logger.error(str(exc))
+            return
+        logger.warning(f'{cancelled} run(s) of batch {batch_id} cancelled')
+
+    @staticmethod
+    def _log_result(run: Dict) -> None:
+        if run['result'] == 'succeeded':
+            logger.success(f'Run {run["run_id"]} ({run["key"]}) completed successfully!')
+            return
+        logger.error(f'Run {run["run_id"]} ({run["key"]}) finished with result = {run["result"]}')
+
+    @staticmethod
+    def _log_end(batch: Dict) -> None:
+        results = [ run['result'] for run in batch['runs'] if run['result'] ]
+        failed = sum(1 for result in results if result != 'succeeded')
+        elapsed = (batch['finished_at'] or time.time()) - batch['started_at']
+        if batch['state'] == 'error':
+            logger.error(f'Batch {batch["batch_id"]} failed after {elapsed:.0f}s: {batch["error"]}')
+            return
+        message = f'Batch {batch["batch_id"]} {batch["state"]} in {elapsed:.0f}s: {len(results) - failed} run(s) succeeded, {failed} failed'
+        if failed or batch['state'] != 'finished':
+            logger.warning(message)
+            return
+        logger.success(message)
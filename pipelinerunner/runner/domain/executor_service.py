@@ -1,11 +1,15 @@
-from typing import List, Union, Dict
+from typing import List, Union, Dict, Optional
 
 from pipelinerunner.runner.application.model import RunnerModel
 from pipelinerunner.runner.infrastructure.repository import RunnerRepositoryFactory
 from pipelinerunner.runner.domain.serializer import RunnerSerializer
 from pipelinerunner.pipeline.application.model import ExecutionOptions
 from pipelinerunner.pipeline.domain.batch_orchestrator import PipelineBatchOrchestrator
+from pipelinerunner.pipeline.domain.sharding import BatchSharder
 from pipelinerunner.pipeline.domain.enums import PipelineExecutionMode
+from pipelinerunner.pipeline.domain.exceptions import DependencyGraphError, BatchJournalError
+from pipelinerunner.pipeline.infrastructure.batch_journal import BatchJournal, BatchJournalFactory
+from pipelinerunner.pipeline.infrastructure.duration_history import DurationHistoryFactory
 from pipelinerunner.shared.domain.base_on_disk_repository import BaseOnDiskRepository
 from pipelinerunner.shared.util.json import load_json_from_file
 from pipelinerunner.shared.util.measure_time import measure_time
@@ -21,28 +25,75 @@ class RunnerExecutorService:
 
     @measure_time
     def execute_from_name(self, name: str, options: ExecutionOptions):
+        runners = self.load_from_name(name, options)
+        if runners:
+            self._execute(runners, options)
+
+    @measure_time
+    def execute_from_file(self, filename: str, options: ExecutionOptions):
+        runners = self.load_from_file(filename, options)
+        if runners:
+            self._execute(runners, options)
+
+    def load_from_name(self, name: str, options: ExecutionOptions) -> List[RunnerModel]:
+        ''' The runner (or its shard), an empty list when there is nothing to run '''
         runner = self.repository.get(name)
         if not runner:
             logger.warning(f'No runner found with name "{name}"')
-            return
+            return list()
         logger.info(f'Starting single runner: {runner.name}')
-        self._execute([ runner ], options)
+        return self._select_shard([ runner ], options)
 
-    @measure_time
-    def execute_from_file(self, filename: str, options: ExecutionOptions):
+    def load_from_file(self, filename: str, options: ExecutionOptions) -> List[RunnerModel]:
+        ''' The runners of the file (or their shard), an empty list when there is nothing to run '''
         logger.info(f'Loading runners from {filename}')
         data: Union[Dict, List[Dict]] = load_json_from_file(filename)
         runners = RunnerSerializer.deserialize(data)
         if isinstance(runners, RunnerModel):
             runners = [ runners ]
 
+        runners = self._select_shard(runners, options)
+        if not runners:
+            return list()
         logger.info(f"Starting {len(runners)} runner(s)")
         self._print_runners_table(runners)
-        self._execute(runners, options)
+        return runners
+
+    @measure_time
+    def execute_resume(self, batch_id: str, options: ExecutionOptions):
+        ''' The runners and the mode are the ones recorded in the journal of the batch '''
+        try:
+            journal = BatchJournalFactory.open(batch_id)
+        except BatchJournalError as exc:
+            logger.error(str(exc))
+            return
+        runners = [ RunnerSerializer.deserialize(data) for data in journal.runners ]
+        self.mode = PipelineExecutionMode.from_value(journal.mode)
+        logger.info(f'Resuming batch {batch_id} of {len(runners)} runner(s) in {self.mode.value} mode')
+        self._print_runners_table(runners)
+        self._execute(runners, options, journal)
+
+    def _execute(self, runners: List[RunnerModel], options: ExecutionOptions, journal: Optional[BatchJournal] = None):
+        orchestrator = PipelineBatchOrchestrator(runners, self.mode, options, journal = journal)
+        try:
+            orchestrator.run_all()
+        except DependencyGraphError as exc:
+            logger.error(f'Invalid dependencies, nothing was started: {exc}')
 
-    def _execute(self, runners: List[RunnerModel], options: ExecutionOptions):
-        orchestrator = PipelineBatchOrchestrator(runners, self.mode, options)
-        orchestrator.run_all()
+    def _select_shard(self, runners: List[RunnerModel], options: ExecutionOptions) -> List[RunnerModel]:
+        ''' All of them when the batch is not sharded, an empty list when there is nothing to run '''
+        if not options.shard:
+            return runners
+        index, total = options.shard
+        sharder = BatchSharder(index, total, by = options.shard_by, history = DurationHistoryFactory.create())
+        try:
+            selected = sharder.select(runners)
+        except DependencyGraphError as exc:
+            logger.error(f'Invalid dependencies, nothing was started: {exc}')
+            return list()
+        if not selected:
+            logger.warning(f'Shard {index}/{total} has no run, nothing to do')
+        return selected
 
     def _print_runners_table(self, runners: List[RunnerModel]):
         rows = [
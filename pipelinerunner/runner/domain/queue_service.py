@@ -0,0 +1,72 @@
+import os
+import socket
+
+from typing import Dict, List, Optional, Union
+
+from pipelinerunner.runner.application.model import RunnerModel
+from pipelinerunner.runner.domain.serializer import RunnerSerializer
+from pipelinerunner.pipeline.application.model import ExecutionOptions
+from pipelinerunner.pipeline.domain.batch_context import BatchContext
+from pipelinerunner.pipeline.domain.queue_worker import QueueWorker
+from pipelinerunner.pipeline.domain.exceptions import WorkQueueError
+from pipelinerunner.pipeline.infrastructure.batch_journal import BatchJournal, BatchJournalFactory
+from pipelinerunner.pipeline.infrastructure.work_queue import WorkQueueFactory
+from pipelinerunner.shared.util.json import load_json_from_file
+from pipelinerunner.shared.util.measure_time import measure_time
+from pipelinerunner.shared.util.logger import BetterLogger
+
+logger = BetterLogger.get_logger(__name__)
+
+
+class RunnerQueueService:
+    def __init__(self, queue_path: Optional[str] = None):
+        self.queue_path = queue_path
+
+    def enqueue_from_file(self, filename: str) -> None:
+        logger.info(f'Loading runners from {filename}')
+        data: Union[Dict, List[Dict]] = load_json_from_file(filename)
+        runners = RunnerSerializer.deserialize(data)
+        if isinstance(runners, RunnerModel):
+            runners = [ runners ]
+        if any(runner.depends_on or any(run.depends_on for run in runner.runs) for runner in runners):
+            logger.warning('The work queue does not follow depends_on, every run is enqueued right away')
+
+        try:
+            queue = WorkQueueFactory.create(self.queue_path)
+            batch_id = BatchJournal.new_batch_id()
+            total = queue.enqueue(batch_id, [ RunnerSerializer.serialize(runner) for runner in runners ])
+            queue.close()
+        except WorkQueueError as exc:
+            logger.error(str(exc))
+            return
+        logger.success(f'{total} run(s) of {len(runners)} runner(s) enqueued in {queue.path} as batch {batch_id}')
+
+    @measure_time
+    def work(self,
+             options: ExecutionOptions,
+             capacity: int,
+             lease: float,
+             follow: bool = False,
+             worker_id: Optional[str] = None) -> None:
+        try:
+            queue = WorkQueueFactory.create(self.queue_path)
+        except WorkQueueError as exc:
+            logger.error(str(exc))
+            return
+        context = BatchContext.create(options, journal = BatchJournalFactory.create(in_memory = True))  # the queue is the journal
+        worker = QueueWorker(
+            queue = queue,
+            options = options,
+            context = context,
+            worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}',
+            capacity = capacity,
+            lease = lease,
+            follow = follow
+        )
+        try:
+            worker.run()
+        except WorkQueueError as exc:
+            logger.error(str(exc))
+        finally:
+            context.close()
+            queue.close()
@@ -15,10 +15,21 @@ class RunnerSerializer:
             "branch_name": runner.branch_name,
             "runs": []
         }
+        if runner.max_in_flight is not None:
+            data["max_in_flight"] = runner.max_in_flight
+        if runner.depends_on:
+            data["depends_on"] = list(runner.depends_on)
 
         if runner.runs:
             for r in runner.runs:
-                data["runs"].append({ "parameters": r.parameters })
+                run = { "parameters": r.parameters }
+                if r.name:
+                    run["name"] = r.name
+                if r.depends_on:
+                    run["depends_on"] = list(r.depends_on)
+                if r.priority:
+                    run["priority"] = r.priority
+                data["runs"].append(run)
 
         return data
 
@@ -37,7 +48,10 @@ class RunnerSerializer:
             for r in data["runs"]:
                 runs.append(
                     RunModel(
-                        parameters = r['parameters']
+                        parameters = r['parameters'],
+                        name = r.get('name'),
+                        depends_on = list(r.get('depends_on') or []),
+                        priority = r.get('priority', 0)
                     )
                 )
 
@@ -47,5 +61,7 @@ class RunnerSerializer:
             definition_id = data['definition_id'],
             pipeline_name = data['pipeline_name'],
             branch_name = data.get('branch_name', 'main'),
-            runs = runs
+            runs = runs,
+            max_in_flight = data.get('max_in_flight'),
+            depends_on = list(data.get('depends_on') or [])
         )
@@ -2,6 +2,7 @@ from pathlib import Path
 from typing import Union, Dict, List
 from pipelinerunner.runner.application.model import RunnerModel
 from pipelinerunner.runner.domain.serializer import RunnerSerializer
+from pipelinerunner.pipeline.domain.dependency_graph import DependencyGraph
 from pipelinerunner.shared.util.json import load_json_from_file
 from pipelinerunner.shared.util.logger import BetterLogger
 
@@ -23,7 +24,10 @@ class RunnerValidatorService:
             logger.info(f'Validating file: {path.absolute()}')
             data: Union[Dict, List[Dict]] = load_json_from_file(path)
             runners = self._deserialize(data)
+            graph = DependencyGraph(runners)  # unknown references and cycles
             self._log_summary(runners)
+            if graph.has_dependencies():
+                logger.info(f'Execution order: {" → ".join(node.key for node in graph.order)}')
             return True
         
         except Exception as e:
@@ -48,6 +52,10 @@ class RunnerValidatorService:
                 ["Branch", runner.branch_name],
                 ["Runs", len(runner.runs)],
             ]
+            if runner.max_in_flight is not None:
+                rows.append(["Max in flight", runner.max_in_flight])
+            if runner.depends_on:
+                rows.append(["Depends on", ", ".join(runner.depends_on)])
             logger.print_table(
                 title=f"Runner #{idx}",
                 columns=["Field", "Value"],
@@ -63,6 +71,7 @@ class RunnerValidatorService:
             "   • Missing required fields (name, project_name, definition_id, pipeline_name)\n"
             "   • Invalid JSON syntax\n"
             "   • Incorrect data types\n"
-            "   • Missing \"runs\" array"
+            "   • Missing \"runs\" array\n"
+            "   • \"depends_on\" referencing unknown runners or forming a cycle"
         )
         logger.error(error_message)
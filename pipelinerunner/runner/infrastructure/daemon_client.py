@@ -0,0 +1,58 @@
+import json
+import socket
+
+from pathlib import Path
+from typing import Dict, Optional
+
+from pipelinerunner.pipeline.domain.exceptions import DaemonError
+
+
+class DaemonSocketFactory:
+    @staticmethod
+    def path() -> Path:
+        return Path.home() / '.pipelinerunner' / 'daemon.sock'
+
+    @staticmethod
+    def is_supported() -> bool:
+        ''' Unix domain sockets only (not on Windows) '''
+        return hasattr(socket, 'AF_UNIX')
+
+
+class DaemonClient:
+    '''
+    Talks to the daemon over its Unix domain socket: one JSON request per connection, answered by one JSON line.
+    Every answer has "ok", and "error" when it is false.
+    '''
+    CONNECT_TIMEOUT = 0.5  # seconds, a daemon that does not answer this fast is considered gone
+    REQUEST_TIMEOUT = 30
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path or DaemonSocketFactory.path()
+
+    def is_running(self) -> bool:
+        if not DaemonSocketFactory.is_supported() or not self.path.exists():
+            return False
+        try:
+            self.request('ping', timeout = self.CONNECT_TIMEOUT)
+            return True
+        except DaemonError:
+            return False
+
+    def request(self, op: str, timeout: float = REQUEST_TIMEOUT, **payload) -> Dict:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+                connection.settimeout(timeout)
+                connection.connect(str(self.path))
+                connection.sendall(json.dumps({ 'op': op, **payload }).encode('utf-8') + b'\n')
+                answer = connection.makefile('rb').readline()
+        except OSError as exc:
+            raise DaemonError(f'Unable to reach the daemon on {self.path}: {exc}')
+        if not answer:
+            raise DaemonError('The daemon closed the connection without answering')
+        try:
+            response = json.loads(answer)
+        except ValueError:
+            raise DaemonError('The daemon sent an invalid answer')
+        if not response.get('ok'):
+            raise DaemonError(response.get('error') or 'The daemon refused the request')
+        return response
@@ -0,0 +1,62 @@
+import click
+
+from typing import Optional
+
+from pipelinerunner.pipeline.application.model import ExecutionOptions
+from pipelinerunner.pipeline.domain.exceptions import DaemonError
+from pipelinerunner.runner.domain.daemon_service import RunnerDaemon, DaemonForwarder
+from pipelinerunner.runner.infrastructure.daemon_client import DaemonClient
+from pipelinerunner.shared.util.logger import BetterLogger
+
+
+logger = BetterLogger.get_logger(__name__)
+
+
+@click.command(name="serve")
+@click.option('--http-pool-size',
+              type = click.IntRange(min = 1),
+              default = 20,
+              show_default = True,
+              help = 'Maximum number of keep-alive connections per Azure DevOps organization, shared by all the batches')
+@click.option('--hedge-requests',
+              is_flag = True,
+              default = False,
+              help = 'Send a second status/approval query when the first one is slower than the p95 latency')
+@click.option('--max-concurrent-triggers',
+              type = click.IntRange(min = 1),
+              default = 10,
+              show_default = True,
+              help = 'Maximum number of trigger requests sent at the same time, across all the batches (a run no longer counts once triggered)')
+def serve(http_pool_size: int, hedge_requests: bool, max_concurrent_triggers: int):
+    ''' Run the daemon: "pipeline run" sends it the batches while it is running '''
+    options = ExecutionOptions(
+        http_pool_size = http_pool_size,
+        hedge_requests = hedge_requests,
+        max_concurrent_triggers = max_concurrent_triggers
+    )
+    try:
+        RunnerDaemon(options).serve()
+    except DaemonError as exc:
+        logger.error(str(exc))
+
+
+@click.command(name="status")
+@click.argument('batch_id', type = click.STRING, required = False)
+def status(batch_id: Optional[str]):
+    ''' Show the batches of the daemon, or the runs of one of them '''
+    client = DaemonClient()
+    if not client.is_running():
+        logger.error('The daemon is not running (start it with: pipeline serve)')
+        return
+    DaemonForwarder(client).status(batch_id)
+
+
+@click.command(name="cancel")
+@click.argument('batch_id', type = click.STRING, required = True)
+def cancel(batch_id: str):
+    ''' Cancel the runs in flight of a batch of the daemon '''
+    client = DaemonClient()
+    if not client.is_running():
+        logger.error('The daemon is not running (start it with: pipeline serve)')
+        return
+    DaemonForwarder(client).cancel(batch_id)
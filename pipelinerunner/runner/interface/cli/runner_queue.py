@@ -0,0 +1,93 @@
+import click
+
+from typing import Optional
+
+from pipelinerunner.pipeline.application.model import ExecutionOptions
+from pipelinerunner.runner.domain.queue_service import RunnerQueueService
+
+
+@click.command(name="enqueue")
+@click.option('--from-file',
+              type = click.STRING,
+              required = True,
+              help = 'Path to the json file')
+@click.option('--queue',
+              type = click.STRING,
+              required = False,
+              help = 'Path to the work queue (default: ~/.pipelinerunner/queue/queue.db), on a filesystem shared by the workers')
+def enqueue(from_file: str, queue: Optional[str]):
+    ''' Add the runs of a JSON file to the work queue shared by the workers '''
+    RunnerQueueService(queue_path = queue).enqueue_from_file(filename = from_file)
+
+
+@click.command(name="worker")
+@click.option('--queue',
+              type = click.STRING,
+              required = False,
+              help = 'Path to the work queue (default: ~/.pipelinerunner/queue/queue.db), on a filesystem shared by the workers')
+@click.option('--capacity',
+              type = click.IntRange(min = 1),
+              default = 20,
+              show_default = True,
+              help = 'Maximum number of runs held (triggered and monitored) by this worker at the same time')
+@click.option('--lease',
+              type = click.IntRange(min = 30),
+              default = 120,
+              show_default = True,
+              help = 'Seconds a claimed run stays with this worker without renewal, before another worker reclaims it')
+@click.option('--follow',
+              is_flag = True,
+              default = False,
+              help = 'Keep waiting for new runs once the queue is empty')
+@click.option('--worker-id',
+              type = click.STRING,
+              required = False,
+              help = 'Name of this worker in the queue (default: <hostname>:<pid>)')
+@click.option('--no-auto-approve',
+              is_flag = True,
+              default = False,
+              help='Do not auto approve the pipeline executions')
+@click.option('--http-pool-size',
+              type = click.IntRange(min = 1),
+              default = 20,
+              show_default = True,
+              help = 'Maximum number of keep-alive connections per Azure DevOps organization')
+@click.option('--max-concurrent-triggers',
+              type = click.IntRange(min = 1),
+              default = 10,
+              show_default = True,
+              help = 'Maximum number of trigger requests sent at the same time (a run no longer counts once triggered)')
+@click.option('--trigger-concurrency',
+              type = click.IntRange(min = 1),
+              default = 8,
+              show_default = True,
+              help = 'Maximum number of claimed runs being triggered at the same time')
+@click.option('--respect-agent-pools',
+              is_flag = True,
+              default = False,
+              help = 'Hold back the triggers while the agent pool of the pipeline has no free agent (self-hosted pools only)')
+def worker(queue: Optional[str],
+           capacity: int,
+           lease: int,
+           follow: bool,
+           worker_id: Optional[str],
+           no_auto_approve: bool,
+           http_pool_size: int,
+           max_concurrent_triggers: int,
+           trigger_concurrency: int,
+           respect_agent_pools: bool):
+    ''' Claim runs from the work queue, trigger and monitor them (start as many workers as needed) '''
+    options = ExecutionOptions(
+        auto_approve = not no_auto_approve,
+        http_pool_size = http_pool_size,
+        max_concurrent_triggers = max_concurrent_triggers,
+        trigger_concurrency = trigger_concurrency,
+        respect_agent_pools = respect_agent_pools
+    )
+    RunnerQueueService(queue_path = queue).work(
+        options = options,
+        capacity = capacity,
+        lease = lease,
+        follow = follow,
+        worker_id = worker_id
+    )
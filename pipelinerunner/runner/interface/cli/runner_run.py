@@ -1,20 +1,50 @@
 import click
 
+from typing import Optional, Tuple
+
 from pipelinerunner.pipeline.application.model import ExecutionOptions
-from pipelinerunner.pipeline.domain.enums import PipelineExecutionMode
+from pipelinerunner.pipeline.domain.enums import PipelineExecutionMode, RunOrder, ShardBy
 from pipelinerunner.runner.domain.executor_service import RunnerExecutorService
+from pipelinerunner.runner.domain.daemon_service import DaemonForwarder
+from pipelinerunner.runner.infrastructure.daemon_client import DaemonClient
 from pipelinerunner.shared.util.logger import BetterLogger
 
 
 logger = BetterLogger.get_logger(__name__)
 
 
+def parse_wave_sizes(ctx, param, value: str) -> Tuple[int, ...]:
+    try:
+        sizes = tuple(int(size) for size in value.split(',') if size.strip())
+    except ValueError:
+        raise click.BadParameter('it must be a comma separated list of numbers, like 1,5,20')
+    if not sizes or any(size < 1 for size in sizes):
+        raise click.BadParameter('every wave must have at least one run')
+    return sizes
+
+
+def parse_shard(ctx, param, value: Optional[str]) -> Optional[Tuple[int, int]]:
+    if value is None:
+        return None
+    try:
+        index, total = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise click.BadParameter('it must be like 3/8 (the third of eight shards)')
+    if not 1 <= index <= total:
+        raise click.BadParameter(f'the shard must be between 1 and {total}')
+    return (index, total)
+
+
 @click.command(name="run")
 @click.argument('name', type = click.STRING, required = False)
 @click.option('--from-file',
               type = click.STRING,
               required = False,
               help = 'Path to the json file')
+@click.option('--resume',
+              type = click.STRING,
+              required = False,
+              help = 'Id of an interrupted batch to resume: its in-flight runs are re-attached and only the runs never started are triggered')
 @click.option('--mode',
               type = click.Choice(PipelineExecutionMode.get_values()),
               required = False,
@@ -28,23 +58,151 @@ logger = BetterLogger.get_logger(__name__)
               is_flag = True,
               default = False,
               help='Do not auto approve the pipeline executions')
+@click.option('--fail-fast',
+              is_flag = True,
+              default = False,
+              help = 'Cancel the runs in flight and start no other as soon as a run fails')
 @click.option('--dry-run',
               is_flag = True,
               default = False,
               help = 'Dry run')
-def run(name: str, from_file: str, mode: str, no_wait: bool, no_auto_approve: bool, dry_run: bool):
+@click.option('--http-pool-size',
+              type = click.IntRange(min = 1),
+              default = 20,
+              show_default = True,
+              help = 'Maximum number of keep-alive connections per Azure DevOps organization')
+@click.option('--hedge-requests',
+              is_flag = True,
+              default = False,
+              help = 'Send a second status/approval query when the first one is slower than the p95 latency')
+@click.option('--max-concurrent-triggers',
+              type = click.IntRange(min = 1),
+              default = 10,
+              show_default = True,
+              help = 'Maximum number of trigger requests sent at the same time, across all runners (a run no longer counts once triggered)')
+@click.option('--trigger-concurrency',
+              type = click.IntRange(min = 1),
+              default = 8,
+              show_default = True,
+              help = 'Maximum number of runs of the same runner being triggered at the same time (parallel mode)')
+@click.option('--max-runs-per-definition',
+              type = click.IntRange(min = 1),
+              default = 8,
+              show_default = True,
+              help = 'Window mode: runs of the same pipeline in flight (a runner can override it with "max_in_flight")')
+@click.option('--max-runs-per-project',
+              type = click.IntRange(min = 1),
+              default = None,
+              help = 'Window mode: runs of the same project in flight')
+@click.option('--max-runs',
+              type = click.IntRange(min = 1),
+              default = None,
+              help = 'Window mode: runs in flight in total')
+@click.option('--waves',
+              type = click.STRING,
+              default = '1,5',
+              show_default = True,
+              callback = parse_wave_sizes,
+              help = 'Waves mode: size of the waves of each runner, the remaining runs go in a last wave')
+@click.option('--wave-success-ratio',
+              type = click.FloatRange(min = 0, max = 1),
+              default = 1.0,
+              show_default = True,
+              help = 'Waves mode: ratio of successful runs a wave needs for the next one to start')
+@click.option('--order',
+              type = click.Choice(RunOrder.get_values()),
+              default = RunOrder.FILE.value,
+              show_default = True,
+              help = 'Order the runs are started in, using the durations of past runs. ' + RunOrder.get_help_message())
+@click.option('--shard',
+              type = click.STRING,
+              default = None,
+              callback = parse_shard,
+              help = 'Run only this part of the batch, like 3/8 (e.g. from a CI matrix), with no coordination between the shards')
+@click.option('--shard-by',
+              type = click.Choice(ShardBy.get_values()),
+              default = ShardBy.COUNT.value,
+              show_default = True,
+              help = 'How the shards are balanced. ' + ShardBy.get_help_message())
+@click.option('--respect-agent-pools',
+              is_flag = True,
+              default = False,
+              help = 'Hold back the triggers while the agent pool of the pipeline has no free agent (self-hosted pools only)')
+@click.option('--incremental',
+              is_flag = True,
+              default = False,
+              help = 'Skip the runs whose pipeline, parameters and branch commit did not change since a successful run, and trigger identical runs once')
+@click.option('--incremental-ttl',
+              type = click.IntRange(min = 1),
+              default = 24,
+              show_default = True,
+              help = 'Incremental mode: hours a successful run is trusted for')
+@click.option('--no-daemon',
+              is_flag = True,
+              default = False,
+              help = 'Run the batch in this process even when the daemon (pipeline serve) is running')
+def run(name: str,
+        from_file: str,
+        resume: Optional[str],
+        mode: str,
+        no_wait: bool,
+        no_auto_approve: bool,
+        fail_fast: bool,
+        dry_run: bool,
+        http_pool_size: int,
+        hedge_requests: bool,
+        max_concurrent_triggers: int,
+        trigger_concurrency: int,
+        max_runs_per_definition: int,
+        max_runs_per_project: Optional[int],
+        max_runs: Optional[int],
+        waves: Tuple[int, ...],
+        wave_success_ratio: float,
+        order: str,
+        shard: Optional[Tuple[int, int]],
+        shard_by: str,
+        respect_agent_pools: bool,
+        incremental: bool,
+        incremental_ttl: int,
+        no_daemon: bool):
     ''' Execute Azure DevOps pipelines using a saved runner or JSON file '''
-    if not name and not from_file:
-        logger.error('Incomplete arguments provided. Use the --from-file or provide the name argument')
+    if not name and not from_file and not resume:
+        logger.error('Incomplete arguments provided. Use the --from-file, the --resume or provide the name argument')
         return
     
     mode = PipelineExecutionMode.from_value(mode)
+    if mode == PipelineExecutionMode.WINDOW and no_wait:
+        logger.error('The window mode waits for the runs to know when a slot frees up, it cannot be used with --no-wait')
+        return
     service = RunnerExecutorService(mode = mode)
     options = ExecutionOptions(
         wait = not no_wait,
         auto_approve = not no_auto_approve,
-        dry_run = dry_run
+        dry_run = dry_run,
+        http_pool_size = http_pool_size,
+        hedge_requests = hedge_requests,
+        max_concurrent_triggers = max_concurrent_triggers,
+        trigger_concurrency = trigger_concurrency,
+        max_runs_per_definition = max_runs_per_definition,
+        max_runs_per_project = max_runs_per_project,
+        max_runs = max_runs,
+        wave_sizes = waves,
+        wave_success_ratio = wave_success_ratio,
+        run_order = RunOrder.from_value(order),
+        fail_fast = fail_fast,
+        shard = shard,
+        shard_by = ShardBy.from_value(shard_by),
+        respect_agent_pools = respect_agent_pools,
+        incremental = incremental,
+        incremental_ttl = incremental_ttl
     )
+    if resume:
+        return service.execute_resume(batch_id = resume, options = options)
+
+    client = DaemonClient()
+    if not no_daemon and client.is_running():
+        return DaemonForwarder(client).run(name = name, filename = from_file, mode = mode, options = options)
+
     if name:
         return service.execute_from_name(name = name, options = options)
     
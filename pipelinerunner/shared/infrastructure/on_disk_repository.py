@@ -1,6 +1,9 @@
+import copy
+import threading
+
 from abc import ABC
 from pathlib import Path
-from typing import List, Optional, Type, TypeVar
+from typing import Dict, List, Optional, Tuple, Type, TypeVar
 
 from pipelinerunner.shared.domain.base_on_disk_repository import BaseOnDiskRepository
 from pipelinerunner.shared.domain.exceptions import SerializationException, FileSystemException
@@ -18,6 +21,8 @@ class OnDiskRepository(BaseOnDiskRepository[T], ABC):
     def __init__(self, directory: Path, serializer: Type):
         self.directory = directory
         self.serializer = serializer
+        self._cache: Dict[Path, Tuple[int, int, T]] = dict()  # file -> (mtime, size, entity), for long-lived processes
+        self._cache_lock = threading.Lock()
         self.initialize()
 
     def initialize(self) -> None:
@@ -27,16 +32,26 @@ class OnDiskRepository(BaseOnDiskRepository[T], ABC):
     def get(self, name: str) -> Optional[T]:
         file_path = self._get_file_path(name)
         
-        if not file_path.exists():
+        try:
+            stat = file_path.stat()
+        except FileNotFoundError:
             return None
-        
+
+        with self._cache_lock:
+            cached = self._cache.get(file_path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return copy.deepcopy(cached[2])  # the caller may change it
+
         try:
             content = load_json_from_file(file_path)
-            return self.serializer.deserialize(content)
+            entity = self.serializer.deserialize(content)
         except Exception as e:
             raise SerializationException(
                 f'Failed to deserialize entity from {file_path.name}!'
             ) from e
+        with self._cache_lock:
+            self._cache[file_path] = (stat.st_mtime_ns, stat.st_size, copy.deepcopy(entity))
+        return entity
 
     def _get_file_path(self, name: str) -> Path:
         # Sanitize filename to avoid issues with special characters
@@ -29,6 +29,13 @@ class BetterLogger:
     ENV_LEVEL = os.getenv('LOG_LEVEL', DEFAULT_MIN_LEVEL).lower()
     MIN_LEVEL_NUM = LEVELS.get(ENV_LEVEL, LEVELS[DEFAULT_MIN_LEVEL])
 
+    _interactive = True  # progress bars are shown
+
+    @classmethod
+    def set_interactive(cls, interactive: bool):
+        ''' A process running several batches at once (e.g. the daemon) cannot show their progress bars together '''
+        cls._interactive = interactive
+
     @classmethod
     def get_logger(cls, name: str):
         return cls()
@@ -36,6 +43,10 @@ class BetterLogger:
     def _should_log(self, level: str) -> bool:
         return self.LEVELS[level] >= self.MIN_LEVEL_NUM
 
+    def is_enabled_for(self, level: str) -> bool:
+        ''' Lets the caller skip building expensive messages that would not be printed '''
+        return self._should_log(level)
+
     def message(self, message: str):
         ''' Print a neutral message without log level or icon '''
         self._console.print(message)
@@ -72,7 +83,8 @@ class BetterLogger:
             TextColumn("[cyan]{task.description}"),
             TimeElapsedColumn(),
             transient = True,
-            console = cls._console
+            console = cls._console,
+            disable = not cls._interactive
         )
 
     @classmethod
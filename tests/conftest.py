@@ -0,0 +1,15 @@
+import os
+
+import pytest
+
+
+# pipelinerunner.config refuses to be imported without them, the tests never reach Azure DevOps
+os.environ.setdefault('AZURE_DEVOPS_PERSONAL_ACCESS_TOKEN', 'test-token')
+os.environ.setdefault('AZURE_DEVOPS_ORGANIZATION_NAME', 'test-organization')
+
+
+@pytest.fixture(autouse = True)
+def home(tmp_path, monkeypatch):
+    ''' The histories, journals and queues go to ~/.pipelinerunner, which must not be the one of the user '''
+    monkeypatch.setenv('HOME', str(tmp_path))
+    return tmp_path
@@ -0,0 +1,91 @@
+import time
+
+import pytest
+
+from pipelinerunner.runner.application.model import RunnerModel, RunModel
+from pipelinerunner.pipeline.application.model import AgentPool
+from pipelinerunner.pipeline.domain.agent_pool_gate import AgentPoolGate
+from pipelinerunner.pipeline.domain.cancellation import RunCanceller
+from pipelinerunner.pipeline.domain.exceptions import PipelineExecutionCancelled
+from pipelinerunner.pipeline.domain.poll_scheduler import PollingPolicy
+from pipelinerunner.pipeline.domain.run import PipelineExecution
+from pipelinerunner.pipeline.infrastructure.dry_run_pipeline_api import DryRunPipelineAPI
+
+
+RUNNER = RunnerModel(name = 'build', project_name = 'P', definition_id = '1', pipeline_name = 'build', runs = [ RunModel(parameters = {}) ])
+
+
+@pytest.fixture(autouse = True)
+def idle_pool(monkeypatch):
+    ''' Every test starts with all the simulated agents free, and waits in short steps '''
+    monkeypatch.setattr(DryRunPipelineAPI, '_busy_until', list())
+    monkeypatch.setattr(AgentPoolGate, 'WAITING', PollingPolicy(initial_interval = 0.1, min_interval = 0.05, max_interval = 0.2, jitter = 0))
+
+
+def execution(api = None) -> PipelineExecution:
+    return PipelineExecution(runner = RUNNER, params = {}, pipeline_api = api or DryRunPipelineAPI(RUNNER))
+
+
+def occupy_agents(count: int = DryRunPipelineAPI.SIMULATED_AGENTS) -> None:
+    api = DryRunPipelineAPI(RUNNER)
+    for _ in range(count):
+        api.trigger_pipeline({})
+
+
+def test_lets_through_as_many_runs_as_free_agents():
+    gate = AgentPoolGate()
+    assert gate.wait_for_room(execution())
+    assert gate.wait_for_room(execution())
+    # the pool does not show the two runs yet, the gate counts them itself
+    assert not gate.wait_for_room(execution(), timeout = 0)
+
+
+def test_holds_back_while_every_agent_is_busy():
+    occupy_agents()
+    started = time.monotonic()
+    assert not AgentPoolGate().wait_for_room(execution(), timeout = 0.3)
+    assert time.monotonic() - started >= 0.3
+
+
+def test_lets_through_once_an_agent_is_free(monkeypatch):
+    monkeypatch.setattr(DryRunPipelineAPI, 'SIMULATED_JOB_SECONDS', 0.2)
+    occupy_agents()
+    started = time.monotonic()
+    assert AgentPoolGate().wait_for_room(execution(), timeout = 5)
+    assert time.monotonic() - started >= 0.2
+
+
+def test_cancelling_the_batch_stops_the_wait():
+    occupy_agents()
+    canceller = RunCanceller()
+    canceller.requested.set()
+    with pytest.raises(PipelineExecutionCancelled):
+        AgentPoolGate().wait_for_room(execution(), canceller = canceller, timeout = 5)
+
+
+def test_resumed_runs_are_not_held_back():
+    occupy_agents()
+    resumed = execution()
+    resumed.resumed = True
+    assert AgentPoolGate().wait_for_room(resumed, timeout = 0)
+
+
+def test_hosted_pools_are_not_held_back(monkeypatch):
+    monkeypatch.setattr(DryRunPipelineAPI, 'get_agent_pool', lambda self: AgentPool(id = '9', name = 'Azure Pipelines', is_hosted = True))
+    occupy_agents()
+    assert AgentPoolGate().wait_for_room(execution(), timeout = 0)
+
+
+def test_the_pool_of_a_pipeline_is_looked_up_once(monkeypatch):
+    lookups = list()
+    original = DryRunPipelineAPI.get_agent_pool
+
+    def get_agent_pool(self):
+        lookups.append(self.runner.definition_id)
+        return original(self)
+
+    monkeypatch.setattr(DryRunPipelineAPI, 'get_agent_pool', get_agent_pool)
+    gate = AgentPoolGate()
+    for _ in range(2):
+        gate.wait_for_room(execution())
+    assert lookups == [ '1' ]
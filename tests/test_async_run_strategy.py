@@ -0,0 +1,73 @@
+import asyncio
+
+from dataclasses import replace
+
+import pytest
+
+from pipelinerunner.runner.application.model import RunnerModel, RunModel
+from pipelinerunner.pipeline.application.model import ExecutionOptions
+from pipelinerunner.pipeline.domain.async_run_strategy import AsyncPipelineExecutionStrategy
+from pipelinerunner.pipeline.domain.batch_context import BatchContext
+from pipelinerunner.pipeline.infrastructure.async_dry_run_pipeline_api import AsyncDryRunPipelineAPI
+
+
+RUNNER = RunnerModel(
+    name = 'build',
+    project_name = 'P',
+    definition_id = '1',
+    pipeline_name = 'build',
+    runs = [ RunModel(parameters = { 'n': 1 }), RunModel(parameters = { 'n': 2, 'hangs': True }) ]
+)
+OPTIONS = ExecutionOptions(dry_run = True)
+
+
+@pytest.fixture(autouse = True)
+def hanging_trigger(monkeypatch):
+    ''' The triggers of the runs with "hangs" never return, as if the CLI died while sending them '''
+    trigger_pipeline = AsyncDryRunPipelineAPI.trigger_pipeline
+
+    async def trigger(self, params):
+        if params.get('hangs'):
+            await asyncio.Event().wait()
+        return await trigger_pipeline(self, params)
+
+    monkeypatch.setattr(AsyncDryRunPipelineAPI, 'trigger_pipeline', trigger)
+
+
+def start_all(context: BatchContext, runner: RunnerModel = RUNNER, timeout: float = 1) -> list:
+    ''' The runs started, or None when it was interrupted after the timeout '''
+    strategy = AsyncPipelineExecutionStrategy(runner, OPTIONS, context)
+
+    async def start():
+        limiter = asyncio.Semaphore(4)
+        executions = [
+            strategy._create_async_pipeline_execution(params = run.parameters, limiter = limiter, position = idx)
+            for idx, run in enumerate(runner.runs, 1)
+        ]
+        try:
+            return await asyncio.wait_for(strategy._start_all(executions), timeout = timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    return asyncio.run(start())
+
+
+def test_a_run_is_journaled_and_tracked_as_soon_as_it_is_triggered():
+    context = BatchContext.create(OPTIONS)
+    assert start_all(context) is None
+    run_id = context.journal.run_id_of('build/1')
+    assert list(context.journal.run_ids) == [ 'build/1' ]
+    assert [ run.run_id for run in context.canceller.cancel_all(reason = 'interrupted') ] == [ run_id ]
+
+
+def test_nothing_is_triggered_once_the_batch_is_cancelling():
+    context = BatchContext.create(OPTIONS)
+    context.canceller.requested.set()
+    assert start_all(context) == []
+    assert not context.journal.run_ids
+
+
+def test_the_triggers_share_the_cap_of_the_batch():
+    context = BatchContext.create(replace(OPTIONS, max_concurrent_triggers = 1))
+    assert start_all(context, replace(RUNNER, runs = list(reversed(RUNNER.runs)))) is None
+    assert not context.journal.run_ids  # the second run waits for the slot of the first one, which never returns
@@ -0,0 +1,65 @@
+import pytest
+
+from pipelinerunner.pipeline.domain.exceptions import BatchJournalError
+from pipelinerunner.pipeline.infrastructure.batch_journal import BatchJournal, BatchJournalFactory
+
+
+RUNNERS = [ { 'name': 'build', 'project_name': 'P', 'definition_id': '1', 'pipeline_name': 'build', 'runs': [ { 'parameters': {} } ] * 3 } ]
+
+
+@pytest.fixture
+def journal():
+    journal = BatchJournalFactory.create()
+    journal.start_batch(RUNNERS, 'parallel')
+    journal.triggered('build/1', '101')
+    journal.triggered('build/2', '102')
+    journal.approved_run('build/2', '102')
+    journal.completed_run('build/1', '101', 'succeeded')
+    journal.close()
+    return journal
+
+
+def test_replay_rebuilds_the_batch(journal):
+    replayed = BatchJournalFactory.open(journal.batch_id)
+    assert replayed.runners == RUNNERS
+    assert replayed.mode == 'parallel'
+    assert replayed.run_id_of('build/2') == '102'
+    assert replayed.run_id_of('build/3') is None
+    assert replayed.approved == { 'build/2' }
+    assert replayed.completed == { 'build/1': 'succeeded' }
+    assert replayed.in_flight() == [ 'build/2' ]
+
+
+def test_a_torn_last_event_is_ignored(journal):
+    with open(journal.path, 'a', encoding = 'utf-8') as f:
+        f.write('{"event": "completed", "key": "bui')
+    replayed = BatchJournalFactory.open(journal.batch_id)
+    assert replayed.in_flight() == [ 'build/2' ]
+
+
+def test_a_corrupted_journal_is_rejected(journal):
+    lines = journal.path.read_text(encoding = 'utf-8').splitlines()
+    lines[1] = 'not json'
+    journal.path.write_text('\n'.join(lines) + '\n', encoding = 'utf-8')
+    with pytest.raises(BatchJournalError, match = 'corrupted at line 2'):
+        BatchJournalFactory.open(journal.batch_id)
+
+
+def test_a_journal_without_its_runners_is_rejected(tmp_path):
+    path = tmp_path / 'batch.jsonl'
+    path.write_text('{"event": "triggered", "key": "build/1", "run_id": "101"}\n', encoding = 'utf-8')
+    with pytest.raises(BatchJournalError, match = 'which runners'):
+        BatchJournal('batch', path).replay()
+
+
+def test_an_unknown_batch_is_rejected():
+    with pytest.raises(BatchJournalError, match = 'No journal found'):
+        BatchJournalFactory.open('20240101-000000-abcdef')
+
+
+def test_an_in_memory_journal_writes_nothing(home):
+    journal = BatchJournalFactory.create(in_memory = True)
+    journal.start_batch(RUNNERS, 'parallel')
+    journal.triggered('build/1', '101')
+    assert journal.run_id_of('build/1') == '101'
+    assert not (home / '.pipelinerunner').exists()
@@ -0,0 +1,57 @@
+from dataclasses import replace
+
+import pytest
+
+from pipelinerunner.runner.application.model import RunnerModel, RunModel
+from pipelinerunner.runner.domain.daemon_service import RunnerDaemon
+from pipelinerunner.pipeline.application.model import ExecutionOptions
+from pipelinerunner.pipeline.domain.batch_orchestrator import PipelineBatchOrchestrator
+from pipelinerunner.pipeline.domain.enums import PipelineExecutionMode
+from pipelinerunner.pipeline.domain.run_strategy import ParallelPipelineExecutionStrategy
+from pipelinerunner.pipeline.infrastructure.azure_pipeline_api import AzurePipelineAPI
+from pipelinerunner.pipeline.infrastructure.dry_run_pipeline_api import DryRunPipelineAPI
+
+
+RUNNER = RunnerModel(name = 'build', project_name = 'P', definition_id = '1', pipeline_name = 'build', runs = [ RunModel(parameters = {}) ])
+OPTIONS = ExecutionOptions(respect_agent_pools = True)
+
+
+@pytest.fixture
+def daemon(tmp_path) -> RunnerDaemon:
+    return RunnerDaemon(ExecutionOptions(), path = tmp_path / 'daemon.sock')
+
+
+def batch(daemon: RunnerDaemon, options: ExecutionOptions) -> PipelineBatchOrchestrator:
+    return PipelineBatchOrchestrator([ RUNNER ], PipelineExecutionMode.PARALLEL, options, warm = daemon.warm)
+
+
+def test_a_dry_run_does_not_leave_its_fake_api_to_the_real_batches(daemon):
+    dry_run = batch(daemon, replace(OPTIONS, dry_run = True))
+    dry_run.run_all()
+    assert dry_run.context.agent_pools is not daemon.warm.agent_pools
+
+    real = batch(daemon, OPTIONS)
+    execution, = ParallelPipelineExecutionStrategy(RUNNER, OPTIONS, real.context).create_executions()
+    assert isinstance(execution.approval_index.api, AzurePipelineAPI)
+    assert real.context.agent_pools is daemon.warm.agent_pools
+    assert not daemon.warm.agent_pools._pools  # nothing looked up through the fake api
+
+
+def test_a_dry_run_after_a_real_batch_uses_the_fake_api(daemon):
+    real = batch(daemon, OPTIONS)
+    ParallelPipelineExecutionStrategy(RUNNER, OPTIONS, real.context).create_executions()
+
+    options = replace(OPTIONS, dry_run = True)
+    dry_run = batch(daemon, options)
+    execution, = ParallelPipelineExecutionStrategy(RUNNER, options, dry_run.context).create_executions()
+    assert isinstance(execution.approval_index.api, DryRunPipelineAPI)
+
+@pytest.mark.parametrize('request_', [
+    { 'op': 'run', 'mode': 'nonsense', 'options': {} },
+    { 'op': 'run', 'mode': 5 },
+    { 'op': 'run', 'mode': 'parallel', 'options': { 'run_order': 'nonsense' } },
+    { 'op': 'run', 'mode': 'parallel', 'options': { 'shard': 3 } }
+])
+def test_an_invalid_batch_is_answered_with_an_error(daemon, request_):
+    response = daemon.handle(request_)
+    assert not response['ok'] and response['error']
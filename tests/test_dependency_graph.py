@@ -0,0 +1,77 @@
+import pytest
+
+from pipelinerunner.runner.application.model import RunnerModel, RunModel
+from pipelinerunner.pipeline.domain.dependency_graph import DependencyGraph
+from pipelinerunner.pipeline.domain.enums import DependencyNodeState
+from pipelinerunner.pipeline.domain.exceptions import DependencyGraphError
+
+
+def runner(name: str, runs: int = 1, depends_on = None, run_names = None) -> RunnerModel:
+    run_names = run_names or [ None ] * runs
+    return RunnerModel(
+        name = name,
+        project_name = 'P',
+        definition_id = name,
+        pipeline_name = name,
+        runs = [ RunModel(parameters = { 'n': i }, name = run_names[i]) for i in range(runs) ],
+        depends_on = depends_on or list()
+    )
+
+
+def keys(nodes) -> list:
+    return [ node.key for node in nodes ]
+
+
+def test_a_runner_in_depends_on_stands_for_all_of_its_runs():
+    graph = DependencyGraph([ runner('build', runs = 2), runner('deploy', depends_on = [ 'build' ]) ])
+    deploy = graph.nodes[-1]
+    assert keys(deploy.predecessors) == [ 'build/1', 'build/2' ]
+    assert keys(graph.ready()) == [ 'build/1', 'build/2' ]
+
+
+def test_a_single_run_can_be_depended_on():
+    graph = DependencyGraph([ runner('build', runs = 2, run_names = [ 'linux', 'windows' ]), runner('deploy', depends_on = [ 'build/linux' ]) ])
+    assert keys(graph.nodes[-1].predecessors) == [ 'build/linux' ]
+
+
+def test_dependents_are_ready_once_their_predecessors_succeeded():
+    graph = DependencyGraph([ runner('build'), runner('deploy', depends_on = [ 'build' ]) ])
+    build, deploy = graph.nodes
+    build.state = DependencyNodeState.SUCCEEDED
+    assert graph.ready() == [ deploy ]
+
+
+def test_the_dependents_of_a_failed_run_are_skipped():
+    graph = DependencyGraph([ runner('build'), runner('test', depends_on = [ 'build' ]), runner('deploy', depends_on = [ 'test' ]) ])
+    build, test, deploy = graph.nodes
+    assert graph.skip_dependents(build) == [ test, deploy ]
+    assert deploy.state == DependencyNodeState.SKIPPED
+
+
+def test_a_cycle_is_rejected():
+    with pytest.raises(DependencyGraphError, match = 'cycle'):
+        DependencyGraph([ runner('a', depends_on = [ 'b' ]), runner('b', depends_on = [ 'a' ]) ])
+
+
+def test_an_unknown_name_is_rejected():
+    with pytest.raises(DependencyGraphError, match = 'neither a runner nor a run'):
+        DependencyGraph([ runner('deploy', depends_on = [ 'build' ]) ])
+
+
+def test_duplicate_names_are_rejected_when_the_batch_declares_dependencies():
+    with pytest.raises(DependencyGraphError, match = 'declared more than once'):
+        DependencyGraph([ runner('build'), runner('build'), runner('deploy', depends_on = [ 'build' ]) ])
+    with pytest.raises(DependencyGraphError, match = 'declared more than once'):
+        DependencyGraph([ runner('build', runs = 2, run_names = [ 'x', 'x' ]), runner('deploy', depends_on = [ 'build/x' ]) ])
+
+
+def test_duplicate_names_are_allowed_without_dependencies():
+    graph = DependencyGraph([ runner('build'), runner('build') ])
+    assert len(graph.nodes) == 2
+    assert not graph.has_dependencies()
+
+
+def test_the_predicted_makespan_is_the_longest_chain():
+    graph = DependencyGraph([ runner('build'), runner('lint'), runner('deploy', depends_on = [ 'build' ]) ])
+    durations = { 'build/1': 60, 'lint/1': 100, 'deploy/1': 50 }
+    assert graph.predict_makespan(lambda node: durations[node.key]) == 110
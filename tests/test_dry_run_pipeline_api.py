@@ -0,0 +1,51 @@
+import itertools
+
+import pytest
+
+from pipelinerunner.pipeline.infrastructure import dry_run_pipeline_api
+from pipelinerunner.runner.application.model import RunnerModel, RunModel
+from pipelinerunner.pipeline.infrastructure.dry_run_pipeline_api import DryRunPipelineAPI
+
+
+def api(definition_id: str) -> DryRunPipelineAPI:
+    return DryRunPipelineAPI(RunnerModel(name = definition_id, project_name = 'P', definition_id = definition_id, pipeline_name = definition_id, runs = [ RunModel(parameters = {}) ]))
+
+
+@pytest.fixture(autouse = True)
+def simulated_runs(monkeypatch):
+    ''' No pending approvals yet, and sequential run ids as the random ones could collide '''
+    monkeypatch.setattr(DryRunPipelineAPI, '_pending_approvals', dict())
+    ids = itertools.count(10000)
+    monkeypatch.setattr(dry_run_pipeline_api.random, 'randint', lambda a, b: next(ids))
+
+
+def test_approvals_are_listed_for_the_whole_project():
+    build, deploy = api('1'), api('2')
+    run = build.trigger_pipeline({})
+    assert [ approval.run_id for approval in deploy.list_approvals() ] == [ run.id ]
+
+
+def test_runs_approved_cancelled_or_finished_are_forgotten():
+    build = api('1')
+    approved, cancelled, finished = (build.trigger_pipeline({}) for _ in range(3))
+    build.approve_run(approved.id, f'dry-run-{approved.id}')
+    build.cancel_run(cancelled.id)
+    build.get_run_status(finished.id)
+    assert build.list_approvals() == []
+    assert DryRunPipelineAPI._pending_approvals == {}
+
+
+def test_the_oldest_runs_are_dropped_past_the_cap(monkeypatch):
+    monkeypatch.setattr(DryRunPipelineAPI, 'MAX_PENDING_APPROVALS', 2)
+    build = api('1')
+    runs = [ build.trigger_pipeline({}) for _ in range(3) ]
+    assert [ approval.run_id for approval in build.list_approvals() ] == [ run.id for run in runs[1:] ]
+
+
+def test_the_agents_of_finished_jobs_are_forgotten_on_trigger(monkeypatch):
+    monkeypatch.setattr(DryRunPipelineAPI, '_busy_until', list())
+    monkeypatch.setattr(DryRunPipelineAPI, 'SIMULATED_JOB_SECONDS', 0)
+    build = api('1')
+    for _ in range(3):
+        build.trigger_pipeline({})
+    assert len(DryRunPipelineAPI._busy_until) == 1
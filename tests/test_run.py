@@ -0,0 +1,25 @@
+import time
+
+from datetime import timedelta
+
+import pytest
+
+from pipelinerunner.pipeline.domain.run import PipelineExecution
+
+
+@pytest.fixture(autouse = True)
+def no_claims(monkeypatch):
+    monkeypatch.setattr(PipelineExecution, '_claimed_run_ids', dict())
+
+
+def test_a_claimed_run_is_excluded_from_the_lookups():
+    PipelineExecution.claim_run_id(1234)
+    assert PipelineExecution.claimed_run_ids() == { '1234' }
+
+
+def test_the_claims_are_forgotten_after_a_while(monkeypatch):
+    monkeypatch.setattr(PipelineExecution, 'CLAIM_RETENTION', timedelta(seconds = 0.1))
+    PipelineExecution.claim_run_id('1')
+    time.sleep(0.2)
+    PipelineExecution.claim_run_id('2')
+    assert PipelineExecution.claimed_run_ids() == { '2' }
@@ -0,0 +1,59 @@
+import pytest
+
+from pipelinerunner.runner.application.model import RunnerModel, RunModel
+from pipelinerunner.pipeline.domain.enums import ShardBy
+from pipelinerunner.pipeline.domain.sharding import BatchSharder
+from pipelinerunner.pipeline.infrastructure.duration_history import DurationHistory
+
+
+def runner(name: str, runs: int, depends_on = None) -> RunnerModel:
+    return RunnerModel(
+        name = name,
+        project_name = 'P',
+        definition_id = name,
+        pipeline_name = name,
+        runs = [ RunModel(parameters = { 'n': i }) for i in range(runs) ],
+        depends_on = depends_on or list()
+    )
+
+
+def shards(runners, total: int, **kwargs) -> list:
+    ''' The runs of every shard, as "<runner>/<parameters>" '''
+    return [
+        { f'{r.name}/{run.parameters["n"]}' for r in BatchSharder(index, total, **kwargs).select(runners) for run in r.runs }
+        for index in range(1, total + 1)
+    ]
+
+
+def test_every_run_goes_to_exactly_one_shard():
+    runners = [ runner('a', 5), runner('b', 4) ]
+    parts = shards(runners, 3)
+    assert sum(len(part) for part in parts) == 9
+    assert set().union(*parts) == { f'a/{i}' for i in range(5) } | { f'b/{i}' for i in range(4) }
+    assert max(len(part) for part in parts) - min(len(part) for part in parts) <= 1
+
+
+def test_reordering_the_file_does_not_move_the_runs():
+    runners = [ runner('a', 5), runner('b', 4) ]
+    assert shards(runners, 3) == shards(list(reversed(runners)), 3)
+
+
+def test_runs_linked_by_depends_on_go_to_the_same_shard():
+    runners = [ runner('build', 2), runner('deploy', 1, depends_on = [ 'build' ]), runner('lint', 3) ]
+    linked = { 'build/0', 'build/1', 'deploy/0' }
+    assert any(linked <= part for part in shards(runners, 2))
+
+
+def test_the_shards_can_be_balanced_by_duration():
+    history = DurationHistory()
+    history.record('P', 'slow', { 'n': 0 }, 600)
+    for i in range(4):
+        history.record('P', 'fast', { 'n': i }, 100)
+    runners = [ runner('slow', 1), runner('fast', 4) ]
+    parts = shards(runners, 2, by = ShardBy.DURATION, history = history)
+    assert { 'slow/0' } in parts
+
+
+def test_an_invalid_shard_is_rejected():
+    with pytest.raises(ValueError):
+        BatchSharder(3, 2)
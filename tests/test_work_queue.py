@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+from pipelinerunner.pipeline.infrastructure.work_queue import WorkQueue
+
+
+RUNNERS = [
+    { 'name': 'build', 'project_name': 'P', 'definition_id': '1', 'pipeline_name': 'build', 'runs': [
+        { 'parameters': { 'n': 1 } },
+        { 'parameters': { 'n': 2 }, 'priority': 5 },
+        { 'parameters': { 'n': 3 } }
+    ] }
+]
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue(tmp_path / 'queue.db')
+    queue.enqueue('batch', RUNNERS)
+    yield queue
+    queue.close()
+
+
+def test_runs_are_claimed_once_by_priority_then_file_order(queue):
+    first = queue.claim('w1', limit = 2, lease = 60)
+    second = queue.claim('w2', limit = 5, lease = 60)
+    assert [ run.position for run in first ] == [ 2, 1 ]
+    assert [ run.position for run in second ] == [ 3 ]
+    assert queue.claim('w3', limit = 5, lease = 60) == []
+    assert first[0].runner['name'] == 'build' and 'runs' not in first[0].runner
+
+
+def test_an_expired_lease_is_reclaimed_with_its_run_id(queue):
+    run, = queue.claim('w1', limit = 1, lease = 0.1)
+    assert queue.triggered(run, 'w1', '1234')
+    time.sleep(0.2)
+    reclaimed, = queue.claim('w2', limit = 1, lease = 60)
+    assert reclaimed.id == run.id
+    assert reclaimed.run_id == '1234'  # re-attached instead of triggered again
+    assert reclaimed.attempts == 2
+
+
+def test_the_worker_that_lost_a_lease_can_no_longer_update_the_run(queue):
+    run, = queue.claim('w1', limit = 1, lease = 0.1)
+    time.sleep(0.2)
+    queue.claim('w2', limit = 1, lease = 60)
+    assert queue.renew([ run ], 'w1', lease = 60) == set()
+    assert not queue.complete(run, 'w1', 'succeeded')
+    assert queue.complete(run, 'w2', 'succeeded')
+
+
+def test_a_renewed_lease_is_not_reclaimed(queue):
+    run, = queue.claim('w1', limit = 1, lease = 0.2)
+    time.sleep(0.1)
+    assert queue.renew([ run ], 'w1', lease = 60) == { run.id }
+    time.sleep(0.2)
+    assert run.id not in { other.id for other in queue.claim('w2', limit = 5, lease = 60) }
+
+
+def test_released_runs_go_back_to_the_queue(queue):
+    runs = queue.claim('w1', limit = 3, lease = 60)
+    queue.release(runs, 'w1')
+    again = queue.claim('w2', limit = 3, lease = 60)
+    assert { run.id for run in again } == { run.id for run in runs }
+    assert all(run.attempts == 1 for run in again)
+
+
+def test_a_run_whose_workers_keep_dying_is_given_up(queue, monkeypatch):
+    monkeypatch.setattr(WorkQueue, 'MAX_ATTEMPTS', 2)
+    for worker in ('w1', 'w2'):
+        queue.claim(worker, limit = 3, lease = 0.05)
+        time.sleep(0.1)
+    assert queue.claim('w3', limit = 3, lease = 60) == []
+    assert queue.counts('batch') == { 'pending': 0, 'claimed': 0, 'done': 3, 'abandoned': 3 }
+    assert not queue.has_open_runs()